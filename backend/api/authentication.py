@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.cache import LRUCache
+from users.models import User
+
+TOKEN_CACHE_SETTINGS = {
+    'MAX_SIZE': 1024,
+    'TTL': 60,
+    'CACHE_ALIAS': None,
+    'KEY_PREFIX': 'auth-token:',
+}
+TOKEN_CACHE_SETTINGS.update(getattr(settings, 'TOKEN_CACHE', {}))
+
+token_cache = LRUCache(max_size=TOKEN_CACHE_SETTINGS['MAX_SIZE'],
+                       ttl=TOKEN_CACHE_SETTINGS['TTL'])
+
+
+def get_shared_cache():
+    """Optional cross-worker cache from settings.CACHES."""
+    alias = TOKEN_CACHE_SETTINGS['CACHE_ALIAS']
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def shared_key(key):
+    return TOKEN_CACHE_SETTINGS['KEY_PREFIX'] + key
+
+
+# Left out of the snapshots: the hash is not shared, and loaded from
+# the database (deferred) when the request checks or changes it.
+SNAPSHOT_EXCLUDE = ('password',)
+
+
+def make_snapshot(user):
+    """Plain field values of the user, safe to pickle and share."""
+    return {field.attname: getattr(user, field.attname)
+            for field in User._meta.concrete_fields
+            if field.attname not in SNAPSHOT_EXCLUDE}
+
+
+def from_snapshot(snapshot):
+    """
+    User of the snapshot. It may be stale: the fields a save() does not
+    change are reloaded first (api.signals.reload_cached_user).
+    """
+    user = User.from_db('default', list(snapshot), list(snapshot.values()))
+    user._token_snapshot = snapshot
+    return user
+
+
+def invalidate_token(key):
+    token_cache.delete(key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(shared_key(key))
+
+
+def invalidate_user(user_id):
+    for key in Token.objects.filter(
+            user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication which keeps token -> user snapshots in
+    a bounded in-process LRU cache (and optionally in a shared cache),
+    so authenticated requests skip the authtoken lookup.
+    Entries are dropped on logout, password change and deactivation
+    (see api.signals); the password hash is not cached.
+    """
+    def authenticate_credentials(self, key):
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            shared_cache = get_shared_cache()
+            if shared_cache is not None:
+                snapshot = shared_cache.get(shared_key(key))
+            if snapshot is None:
+                user, token = super().authenticate_credentials(key)
+                snapshot = make_snapshot(user)
+                if shared_cache is not None:
+                    shared_cache.set(shared_key(key), snapshot,
+                                     TOKEN_CACHE_SETTINGS['TTL'])
+                token_cache.set(key, snapshot)
+                return user, token
+            token_cache.set(key, snapshot)
+        user = from_snapshot(snapshot)
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user, Token(key=key, user=user)
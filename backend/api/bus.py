@@ -0,0 +1,238 @@
+"""
+Cross-worker cache invalidation bus.
+
+publish() broadcasts compact events {"m": model label, "k": keys,
+"t": unix time, "p": publisher pid} to every worker of every node:
+through PostgreSQL NOTIFY (delivered on commit) or, for local
+development on SQLite, through an append-only event file polled by
+the workers. Each worker runs one listener thread which passes the keys
+to the handlers registered for the model; keys None means flush
+everything (sent after the listener reconnects, as events may have been
+missed meanwhile).
+
+Keys are primary keys, except for the per-user relations (favorites,
+shopping cart, subscriptions) where they are the ids of the users whose
+lists changed.
+"""
+import fcntl
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+import orjson
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_BUS_SETTINGS = {
+    'BACKEND': 'auto',
+    'CHANNEL': 'foodgram_invalidation',
+    'FILE': '/tmp/foodgram-invalidation.log',
+    'FILE_MAX_BYTES': 16 * 1024 * 1024,
+    'POLL_INTERVAL': 0.5,
+    'RECONNECT_DELAY': 1.0,
+    'LAG_WARNING': 1.0,
+}
+INVALIDATION_BUS_SETTINGS.update(getattr(settings, 'INVALIDATION_BUS', {}))
+
+# PostgreSQL limits NOTIFY payloads to 8000 bytes.
+MAX_KEYS_PER_EVENT = 200
+
+handlers = defaultdict(list)
+
+
+def register(label, handler):
+    """Call handler(keys) on events of the model (app_label.model)."""
+    handlers[label].append(handler)
+
+
+def get_backend():
+    backend = INVALIDATION_BUS_SETTINGS['BACKEND']
+    if backend == 'auto':
+        return 'postgres' if connection.vendor == 'postgresql' else 'file'
+    return backend
+
+
+def publish(label, keys):
+    """
+    Broadcast changed keys of a model. Inside a transaction the event is
+    sent only if and when it commits.
+    """
+    keys = list(keys)
+    for start in range(0, len(keys), MAX_KEYS_PER_EVENT):
+        payload = orjson.dumps({
+            'm': label,
+            'k': keys[start:start + MAX_KEYS_PER_EVENT],
+            't': time.time(),
+            'p': os.getpid(),
+        }).decode()
+        if get_backend() == 'postgres':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [
+                    INVALIDATION_BUS_SETTINGS['CHANNEL'], payload])
+        else:
+            transaction.on_commit(lambda payload=payload: append(payload))
+
+
+def append(payload):
+    path = INVALIDATION_BUS_SETTINGS['FILE']
+    with open(path, 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            if file.tell() > INVALIDATION_BUS_SETTINGS['FILE_MAX_BYTES']:
+                # Listeners see the file shrink and flush everything.
+                file.truncate(0)
+            file.write(payload + '\n')
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class BusStats:
+    """Delivery metrics of the listener of this process."""
+    def __init__(self):
+        self.events = 0
+        self.flushes = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_event_at = None
+
+    def record(self, sent_at):
+        lag = max(time.time() - sent_at, 0.0)
+        self.events += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        self.last_event_at = time.time()
+        if lag > INVALIDATION_BUS_SETTINGS['LAG_WARNING']:
+            logger.warning('Invalidation event delivered after %.2fs', lag)
+        return lag
+
+    def as_dict(self):
+        return {
+            'events': self.events,
+            'flushes': self.flushes,
+            'avg_lag_seconds': (
+                self.total_lag / self.events if self.events else 0.0),
+            'max_lag_seconds': self.max_lag,
+            'last_event_at': self.last_event_at,
+        }
+
+
+def dispatch(payload, stats):
+    event = orjson.loads(payload)
+    stats.record(event['t'])
+    for handler in handlers.get(event['m'], ()):
+        try:
+            handler(event['k'])
+        except Exception:
+            logger.exception('Invalidation handler failed: %s', event['m'])
+    return event
+
+
+def flush_all(stats):
+    stats.flushes += 1
+    for label_handlers in list(handlers.values()):
+        for handler in label_handlers:
+            try:
+                handler(None)
+            except Exception:
+                logger.exception('Invalidation flush failed')
+
+
+class Listener(threading.Thread):
+    """Daemon thread applying the events to the registered handlers."""
+    def __init__(self, backend, on_event=None):
+        super().__init__(daemon=True, name='invalidation-bus')
+        self.backend = backend
+        self.stats = BusStats()
+        self.on_event = on_event
+        self.stopped = threading.Event()
+
+    def run(self):
+        listen = (self.listen_postgres if self.backend == 'postgres'
+                  else self.listen_file)
+        first = True
+        while not self.stopped.is_set():
+            try:
+                listen(flush=not first)
+            except Exception:
+                logger.exception('Invalidation bus listener failed')
+            first = False
+            self.stopped.wait(INVALIDATION_BUS_SETTINGS['RECONNECT_DELAY'])
+
+    def handle(self, payload):
+        event = dispatch(payload, self.stats)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def listen_postgres(self, flush):
+        wrapper = connections['default']
+        raw = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            raw.autocommit = True
+            with raw.cursor() as cursor:
+                cursor.execute(
+                    'LISTEN ' + wrapper.ops.quote_name(
+                        INVALIDATION_BUS_SETTINGS['CHANNEL']))
+            if flush:
+                flush_all(self.stats)
+            while not self.stopped.is_set():
+                if select.select([raw], [], [], 5) == ([], [], []):
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    self.handle(raw.notifies.pop(0).payload)
+        finally:
+            raw.close()
+
+    def listen_file(self, flush):
+        path = INVALIDATION_BUS_SETTINGS['FILE']
+        open(path, 'a').close()
+        with open(path, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            if flush:
+                flush_all(self.stats)
+            while not self.stopped.is_set():
+                if os.path.getsize(path) < file.tell():
+                    # Truncated: events between may be lost.
+                    file.seek(0)
+                    flush_all(self.stats)
+                line = file.readline()
+                if line.endswith(b'\n'):
+                    self.handle(line)
+                    continue
+                file.seek(file.tell() - len(line))
+                self.stopped.wait(INVALIDATION_BUS_SETTINGS['POLL_INTERVAL'])
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def ensure_listening():
+    """
+    Start the listener of this process. Checked per request, so workers
+    forked from a preloading master start their own thread.
+    """
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return _listener
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            _listener = Listener(get_backend())
+            _listener.start()
+            _listener_pid = os.getpid()
+    return _listener
+
+
+class InvalidationBusMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        ensure_listening()
+        return self.get_response(request)
@@ -0,0 +1,239 @@
+"""
+Incremental change feed of the recipes for sync clients.
+
+Every change of a recipe (its fields, tags, ingredients, and the author,
+tag and ingredient data shown in it) and every deletion is logged as
+a RecipeChange row. GET /api/recipes/changes/?cursor=<id> streams the
+changes after the cursor as NDJSON, one line per recipe:
+
+    {"cursor": 42, "id": 7, "op": "upsert", "recipe": {...}}
+    {"cursor": 43, "id": 5, "op": "delete"}
+    {"next_cursor": 43, "has_more": false}
+
+A client stores next_cursor and resumes from it (or from the cursor of
+the last line it applied if the stream broke). cursor=0 is a full sync.
+
+Changes are logged in the transaction of the change, so the rows commit
+or roll back with it; several changes of a recipe in one transaction
+are separate rows, and the stream sends only the last one of a batch.
+Ids are taken before the commit, so transactions commit out of id
+order: the cursor is instead the position of the row, numbered by
+sequence_changes (before each stream) once the row is committed. The
+numbering runs in one transaction at a time, so positions become
+visible in increasing order, and a transaction committing later gets
+positions after every row a client may already have read. A long
+transaction only delays its own rows. compact_recipe_changes keeps
+only the latest row of each recipe and drops deletions older than
+RETENTION_DAYS; cursors before the dropped deletions get 410 and must
+sync from scratch.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api.documents import (build_documents, recipes_for_documents,
+                           render_recipes)
+from api.renderers import ORJSONRenderer
+from api.serializers import RecipeListSerializer
+from api.services import recipes_for_reading
+from posts.models import Recipe, RecipeChange
+
+CHANGE_FEED_SETTINGS = {
+    'PAGE_SIZE': 1000,
+    'MAX_PAGE_SIZE': 10000,
+    'BATCH': 200,
+    'RETENTION_DAYS': 30,
+}
+CHANGE_FEED_SETTINGS.update(getattr(settings, 'CHANGE_FEED', {}))
+
+CURSOR_PARAM = 'cursor'
+LIMIT_PARAM = 'limit'
+CONTENT_TYPE = 'application/x-ndjson'
+
+# pg_advisory_xact_lock key of sequence_changes.
+SEQUENCE_LOCK = 0x52434853
+
+render = ORJSONRenderer().render
+
+
+def write_changes(changes):
+    """Store {recipe_id: deleted} as RecipeChange rows."""
+    RecipeChange.objects.bulk_create([
+        RecipeChange(
+            recipe_id=pk,
+            kind=RecipeChange.DELETE if is_deleted else RecipeChange.UPSERT)
+        for pk, is_deleted in sorted(changes.items())], batch_size=1000)
+
+
+def record_recipe_changes(recipe_ids, deleted=False):
+    """
+    Log changed (or deleted) recipes in the current transaction, so a
+    committed change always has its row.
+    """
+    changes = dict.fromkeys(recipe_ids, deleted)
+    if changes:
+        write_changes(changes)
+
+
+def sequence_changes():
+    """
+    Number the committed rows without a position, in id order, after
+    the last position. Skipped while another process numbers them (its
+    rows are read once it commits). Returns how many were numbered.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_xact_lock(%s)',
+                               [SEQUENCE_LOCK])
+                if not cursor.fetchone()[0]:
+                    return 0
+        # SQLite: one write transaction at a time, the UPDATE waits.
+        changes = list(RecipeChange.objects.filter(
+            position=None).order_by('id').only('id'))
+        if not changes:
+            return 0
+        last = RecipeChange.objects.aggregate(
+            Max('position'))['position__max'] or 0
+        for position, change in enumerate(changes, last + 1):
+            change.position = position
+        RecipeChange.objects.bulk_update(changes, ['position'],
+                                         batch_size=1000)
+    return len(changes)
+
+
+def feed_horizon():
+    """Cursors below the last compacted deletion are expired."""
+    return RecipeChange.objects.filter(kind=RecipeChange.HORIZON).aggregate(
+        Max('position'))['position__max'] or 0
+
+
+def feed_params(request):
+    """(cursor, limit) of the request, ValidationError if invalid."""
+    params = request.query_params
+    values = {}
+    for param, default in ((CURSOR_PARAM, 0),
+                           (LIMIT_PARAM, CHANGE_FEED_SETTINGS['PAGE_SIZE'])):
+        value = params.get(param, '')
+        if not value:
+            values[param] = default
+        elif value.isdigit():
+            values[param] = int(value)
+        else:
+            raise ValidationError(
+                {param: ['A non-negative integer is required.']})
+    limit = values[LIMIT_PARAM]
+    if not 0 < limit <= CHANGE_FEED_SETTINGS['MAX_PAGE_SIZE']:
+        raise ValidationError({LIMIT_PARAM: [
+            f'Must be from 1 to {CHANGE_FEED_SETTINGS["MAX_PAGE_SIZE"]}.']})
+    return values[CURSOR_PARAM], limit
+
+
+def render_upserts(changed_at, request):
+    """
+    {recipe id: JSON} of the recipes {id: time of the change} which
+    still exist and are published (an imported recipe is sent once
+    its image is saved, which logs a later change). Documents older
+    than the change (rebuilt in the background, or changed outside the
+    API) are built again for the response, not stored.
+    """
+    recipes = Recipe.objects.filter(pk__in=changed_at).published()
+    if settings.RECIPE_DOCUMENTS:
+        recipes = list(recipes_for_documents(recipes, request.user))
+        stale = {recipe.pk: recipe for recipe in recipes
+                 if hasattr(recipe, 'document')
+                 and recipe.document.updated_at < changed_at[recipe.pk]}
+        if stale:
+            for pk, document in build_documents(
+                    Recipe.objects.filter(pk__in=stale)).items():
+                stale[pk].document = document
+        return dict(zip((recipe.pk for recipe in recipes),
+                        render_recipes(recipes, request)))
+    data = RecipeListSerializer(
+        recipes_for_reading(recipes, request.user),
+        many=True, context={'request': request}).data
+    return {item['id']: render(item) for item in data}
+
+
+def stream_changes(cursor, limit, request):
+    """
+    NDJSON lines of at most limit changes after the cursor, numbered by
+    sequence_changes beforehand. The horizon row has no line, but moves
+    the cursor of a full sync past it.
+    """
+    changes = RecipeChange.objects.all()
+    sent = 0
+    while sent < limit:
+        batch = list(changes.filter(position__gt=cursor).order_by(
+            'position').values_list(
+                'position', 'recipe_id', 'kind', 'created_at')[
+                    :min(CHANGE_FEED_SETTINGS['BATCH'], limit - sent)])
+        if not batch:
+            break
+        sent += len(batch)
+        cursor = batch[-1][0]
+        # Only the last change of a recipe in the batch is sent.
+        latest = {recipe_id: (change_id, kind, created_at)
+                  for change_id, recipe_id, kind, created_at in batch}
+        recipes = render_upserts(
+            {recipe_id: created_at
+             for recipe_id, (_, kind, created_at) in latest.items()
+             if kind == RecipeChange.UPSERT}, request)
+        lines = []
+        for recipe_id, (change_id, kind, _) in sorted(
+                latest.items(), key=lambda item: item[1]):
+            if kind == RecipeChange.DELETE:
+                lines.append(render({
+                    'cursor': change_id, 'id': recipe_id, 'op': kind}))
+            elif kind == RecipeChange.UPSERT and recipe_id in recipes:
+                # Otherwise deleted since (a later delete follows) or
+                # an import still pending (a later upsert follows).
+                lines.append(b'{"cursor":%d,"id":%d,"op":"%s","recipe":%s}' % (
+                    change_id, recipe_id, kind.encode(), recipes[recipe_id]))
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+    yield render({
+        'next_cursor': cursor,
+        'has_more': changes.filter(position__gt=cursor).exists(),
+    }) + b'\n'
+
+
+def compact_changes(retention_days=None):
+    """
+    Drop the rows superseded by a later row of the same recipe and the
+    deletions older than the retention; the last dropped deletion
+    becomes the horizon row. Rows not numbered yet are kept. Returns
+    (superseded, expired) counts.
+    """
+    if retention_days is None:
+        retention_days = CHANGE_FEED_SETTINGS['RETENTION_DAYS']
+    sequence_changes()
+    superseded, _ = RecipeChange.objects.filter(Exists(
+        RecipeChange.objects.filter(
+            recipe_id=OuterRef('recipe_id'),
+            position__gt=OuterRef('position')))).delete()
+    expired = RecipeChange.objects.filter(position__isnull=False).filter(
+        Q(kind=RecipeChange.HORIZON) | Q(
+            kind=RecipeChange.DELETE,
+            created_at__lt=timezone.now() - timedelta(days=retention_days)))
+    with transaction.atomic():
+        horizon = expired.aggregate(Max('position'))['position__max']
+        if horizon is None:
+            return superseded, 0
+        dropped, _ = expired.exclude(position=horizon).delete()
+        RecipeChange.objects.filter(position=horizon).update(
+            kind=RecipeChange.HORIZON)
+    return superseded, dropped
+
+
+def seed_changes():
+    """Log the recipes which have no change yet (created before the log)."""
+    recipe_ids = list(Recipe.objects.exclude(
+        pk__in=RecipeChange.objects.values('recipe_id')).order_by(
+            'pk').values_list('pk', flat=True))
+    write_changes(dict.fromkeys(recipe_ids, False))
+    return len(recipe_ids)
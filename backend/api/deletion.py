@@ -0,0 +1,201 @@
+"""
+Soft deletion of users and recipes, purged in the background.
+
+Deleting a user or a recipe only sets deleted_at (the default managers
+leave such rows out, so they disappear from the API at once) and does
+the cheap set-based work the rest of the API relies on: shopping cart
+rows and totals, auth tokens, change feed deletions and invalidation
+events. The purge task then removes the rows PURGE_AFTER seconds later,
+BATCH_SIZE recipes / users per transaction, with plain DELETE
+statements instead of the collector (which loads every related row
+and sends signals for each), and removes the recipe images.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import bus
+from api.changes import record_recipe_changes
+from api.services import update_cart_totals
+from posts.models import (CartIngredient, Favorite, Follow, IngredientRecipe,
+                          Recipe, RecipeDocument, ShoppingCart)
+from posts.stats import refresh_author_stats
+from tasks.queue import task
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+SOFT_DELETE_SETTINGS = {
+    'PURGE_AFTER': 0,
+    'BATCH_SIZE': 200,
+    # batches per purge task run, the rest is left to a new task
+    'MAX_BATCHES': 50,
+}
+SOFT_DELETE_SETTINGS.update(getattr(settings, 'SOFT_DELETE', {}))
+
+RecipeTag = Recipe.tags.through
+IMAGE_DIR = Recipe._meta.get_field('image').upload_to
+
+
+def soft_delete_recipes(recipe_ids):
+    """Hide the recipes and take them out of the shopping carts."""
+    authors = dict(Recipe.objects.filter(
+        pk__in=recipe_ids).values_list('pk', 'author_id'))
+    recipe_ids = list(authors)
+    if not recipe_ids:
+        return []
+    with transaction.atomic():
+        carts = ShoppingCart.objects.filter(recipe_id__in=recipe_ids)
+        cart_users = set(carts.values_list('author_id', flat=True))
+        if cart_users:
+            update_cart_totals(recipe_ids, -1)
+            carts.delete()
+            bus.publish(ShoppingCart._meta.label_lower, cart_users)
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            deleted_at=timezone.now())
+        refresh_author_stats(set(authors.values()))
+        record_recipe_changes(recipe_ids, deleted=True)
+        bus.publish(Recipe._meta.label_lower, recipe_ids)
+    return recipe_ids
+
+
+def soft_delete_user(user):
+    """Hide the user and their recipes, and log them out."""
+    with transaction.atomic():
+        soft_delete_recipes(user.recipe.values_list('pk', flat=True))
+        Token.objects.filter(user=user).delete()
+        followers = set(Follow.objects.filter(
+            author=user).values_list('user_id', flat=True))
+        if followers:
+            bus.publish(Follow._meta.label_lower, followers)
+        user.deleted_at = timezone.now()
+        user.is_active = False
+        user.save(update_fields=['deleted_at', 'is_active'])
+        # Their follows and favorites no longer count.
+        refresh_author_stats(set(Follow.objects.filter(
+            user=user).values_list('author_id', flat=True)).union(
+                Favorite.objects.filter(author=user).values_list(
+                    'recipe__author_id', flat=True)))
+
+
+def _delete_rows(cursor, model, column, ids):
+    quote_name = connection.ops.quote_name
+    cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+        quote_name(model._meta.db_table), quote_name(column),
+        ', '.join(['%s'] * len(ids))), ids)
+    return cursor.rowcount
+
+
+def remove_images(names):
+    """Remove the image files no remaining recipe refers to."""
+    used = set(Recipe.all_objects.filter(image__in=names).values_list(
+        'image', flat=True))
+    for name in set(names) - used:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning('Could not remove image %s', name, exc_info=True)
+
+
+def purge_recipe_batch(deadline):
+    """Delete one batch of recipes deleted before deadline."""
+    recipes = dict(Recipe.all_objects.filter(
+        deleted_at__lte=deadline).order_by('pk').values_list(
+            'pk', 'image')[:SOFT_DELETE_SETTINGS['BATCH_SIZE']])
+    if not recipes:
+        return 0
+    recipe_ids = list(recipes)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, column in ((IngredientRecipe, 'recipe_id'),
+                              (RecipeTag, 'recipe_id'),
+                              (Favorite, 'recipe_id'),
+                              (ShoppingCart, 'recipe_id'),
+                              (RecipeDocument, 'recipe_id'),
+                              (Recipe, 'id')):
+            _delete_rows(cursor, model, column, recipe_ids)
+        images = [name for name in recipes.values() if name]
+        transaction.on_commit(lambda: remove_images(images))
+    return len(recipe_ids)
+
+
+def purge_user_batch(deadline):
+    """
+    Delete one batch of users deleted before deadline whose recipes
+    are already purged.
+    """
+    user_ids = list(User.all_objects.filter(deleted_at__lte=deadline).exclude(
+        Exists(Recipe.all_objects.filter(author=OuterRef('pk')))).order_by(
+            'pk').values_list('pk', flat=True)[
+                :SOFT_DELETE_SETTINGS['BATCH_SIZE']])
+    if not user_ids:
+        return 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for model, column in ((Follow, 'user_id'),
+                                  (Follow, 'author_id'),
+                                  (Favorite, 'author_id'),
+                                  (ShoppingCart, 'author_id'),
+                                  (CartIngredient, 'user_id')):
+                _delete_rows(cursor, model, column, user_ids)
+        # The rest (tokens, groups, admin log) is small.
+        User.all_objects.filter(pk__in=user_ids).delete()
+    return len(user_ids)
+
+
+def purge_deleted(max_batches=None):
+    """
+    Purge the soft-deleted recipes, then the users. Returns
+    (recipes, users, done) with done False if max_batches ran out.
+    """
+    if max_batches is None:
+        max_batches = SOFT_DELETE_SETTINGS['MAX_BATCHES']
+    deadline = timezone.now() - timedelta(
+        seconds=SOFT_DELETE_SETTINGS['PURGE_AFTER'])
+    purged = {purge_recipe_batch: 0, purge_user_batch: 0}
+    batches = 0
+    for purge_batch in purged:
+        while batches < max_batches:
+            count = purge_batch(deadline)
+            if not count:
+                break
+            purged[purge_batch] += count
+            batches += 1
+    done = batches < max_batches
+    return purged[purge_recipe_batch], purged[purge_user_batch], done
+
+
+@task(priority=-20)
+def purge_deleted_task():
+    recipes, users, done = purge_deleted()
+    logger.info('Purged %s recipes and %s users', recipes, users)
+    if not done:
+        purge_deleted_task.enqueue()
+
+
+def remove_orphan_images(min_age):
+    """
+    Remove the files of the recipe image directory no recipe refers
+    to (left by failed uploads or edits) and older than min_age
+    seconds. Returns the removed names.
+    """
+    if not default_storage.exists(IMAGE_DIR):
+        return []
+    _, files = default_storage.listdir(IMAGE_DIR)
+    deadline = timezone.now() - timedelta(seconds=min_age)
+    used = set(Recipe.all_objects.exclude(image='').values_list(
+        'image', flat=True))
+    removed = []
+    for name in (os.path.join(IMAGE_DIR, file) for file in files):
+        if name in used:
+            continue
+        if default_storage.get_modified_time(name) < deadline:
+            default_storage.delete(name)
+            removed.append(name)
+    return removed
@@ -0,0 +1,205 @@
+"""
+Precomputed JSON documents of recipes.
+
+RecipeDocument.body holds the RecipeListSerializer output of a recipe
+as rendered by ORJSONRenderer, without the parts which depend on the
+request: the viewer flags (author.is_subscribed, is_favorited,
+is_in_shopping_cart) and the scheme / host of the image URL.
+RecipeDocument.splices lists where these parts go, so a read is
+the document row plus a few byte slices instead of serializing the
+recipe, its author, tags and ingredients.
+
+Documents are stored on write (API, admin, import) and rebuilt by the
+task queue when author, tag or ingredient data changes; reads never
+write. A recipe without a document yet (created before the documents or
+outside these paths) is rendered from one built for the request, until
+rebuild_recipe_documents --missing stores it (run it at deploy).
+"""
+import orjson
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from api.fieldsets import FIELDSET_PARAM, FIELDS_PARAM, OMIT_PARAM
+from api.renderers import ORJSONRenderer
+from api.serializers import RecipeListSerializer
+from api.write_behind import list_flags
+from posts.models import (Favorite, Follow, Recipe, RecipeDocument,
+                          ShoppingCart)
+from tasks.queue import task
+
+HOST = 'host'
+FLAGS = ('is_subscribed', 'is_favorited', 'is_in_shopping_cart')
+RAW_BOOLEANS = {True: b'true', False: b'false'}
+# Rows per INSERT of store_documents (4 parameters a row).
+STORE_BATCH = 200
+
+render = ORJSONRenderer().render
+
+
+def build_document(recipe):
+    """(body, splices) of a recipe with prefetched relations."""
+    recipe.is_favorited = recipe.is_in_shopping_cart = False
+    recipe.author.is_subscribed = False
+    data = RecipeListSerializer(recipe, context={'request': None}).data
+    body = bytearray()
+    splices = []
+    _compose(data, body, splices)
+    return bytes(body), splices
+
+
+def _compose(data, body, splices):
+    body += b'{'
+    for index, (key, value) in enumerate(data.items()):
+        if index:
+            body += b','
+        body += render(key) + b':'
+        if key in FLAGS:
+            splices.append([len(body), key])
+        elif key == 'author':
+            _compose(value, body, splices)
+        elif key == 'image' and isinstance(value, str) \
+                and value.startswith('/'):
+            body += b'"'
+            splices.append([len(body), HOST])
+            body += render(value)[1:]
+        elif value is None:
+            # Renderers render None as an empty body.
+            body += b'null'
+        else:
+            body += render(value)
+    body += b'}'
+
+
+def render_document(body, splices, values):
+    """The stored body with the request dependent values spliced in."""
+    parts = []
+    start = 0
+    for offset, name in splices:
+        parts.append(body[start:offset])
+        parts.append(values[name])
+        start = offset
+    parts.append(body[start:])
+    return b''.join(parts)
+
+
+def build_documents(recipes):
+    """{recipe id: unsaved RecipeDocument} of a Recipe queryset."""
+    recipes = recipes.select_related('author').prefetch_related(
+        'tags', 'recipe_ingredients__ingredient')
+    now = timezone.now()
+    documents = {}
+    for recipe in recipes:
+        body, splices = build_document(recipe)
+        documents[recipe.pk] = RecipeDocument(
+            recipe=recipe, body=body, splices=splices, updated_at=now)
+    return documents
+
+
+def store_documents(documents):
+    """
+    Insert or replace the documents with INSERT ... ON CONFLICT DO
+    UPDATE, so concurrent rebuilds of a recipe do not conflict.
+    """
+    documents = list(documents)
+    opts = RecipeDocument._meta
+    fields = [opts.get_field(name)
+              for name in ('recipe', 'body', 'splices', 'updated_at')]
+    quote_name = connection.ops.quote_name
+    columns = [quote_name(field.column) for field in fields]
+    with transaction.atomic():
+        for start in range(0, len(documents), STORE_BATCH):
+            batch = documents[start:start + STORE_BATCH]
+            sql = ('INSERT INTO {table} ({columns}) VALUES {rows} '
+                   'ON CONFLICT ({key}) DO UPDATE SET {updates}').format(
+                table=quote_name(opts.db_table),
+                columns=', '.join(columns),
+                rows=', '.join(
+                    ['({})'.format(', '.join(['%s'] * len(columns)))]
+                    * len(batch)),
+                key=columns[0],
+                updates=', '.join(f'{column} = EXCLUDED.{column}'
+                                  for column in columns[1:]))
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [
+                    field.get_db_prep_save(
+                        getattr(document, field.attname), connection)
+                    for document in batch for field in fields])
+
+
+def refresh_recipe_documents(recipes):
+    """Rebuild and store the documents of a Recipe queryset."""
+    documents = build_documents(recipes)
+    store_documents(documents.values())
+    return documents
+
+
+@task(priority=-10)
+def rebuild_recipe_documents(**lookups):
+    """
+    Background rebuild of the documents of the recipes matching
+    lookups, e.g. author_id=..., tags=..., ingredients=...
+    """
+    recipe_ids = list(Recipe.objects.filter(**lookups).values_list(
+        'pk', flat=True).distinct())
+    for start in range(0, len(recipe_ids), 500):
+        refresh_recipe_documents(Recipe.objects.filter(
+            pk__in=recipe_ids[start:start + 500]))
+
+
+def documents_enabled(request):
+    """Plain JSON reads of all fields are served from the documents."""
+    return (getattr(settings, 'RECIPE_DOCUMENTS', False)
+            and request.accepted_renderer.format == 'json'
+            and not any(param in request.query_params
+                        for param in (FIELDS_PARAM, OMIT_PARAM,
+                                      FIELDSET_PARAM)))
+
+
+def recipes_for_documents(recipes, user):
+    """Recipes with their documents and the viewer flags."""
+    recipes = recipes.select_related('document')
+    if user.is_anonymous:
+        return recipes
+    flags = list_flags(user)
+    return recipes.annotate(
+        is_subscribed=Exists(Follow.objects.filter(
+            user=user, author=OuterRef('author_id'))),
+        is_favorited=flags[Favorite],
+        is_in_shopping_cart=flags[ShoppingCart])
+
+
+def render_recipes(recipes, request):
+    """JSON documents of the recipes annotated by recipes_for_documents."""
+    recipes = list(recipes)
+    missing = [recipe.pk for recipe in recipes
+               if not hasattr(recipe, 'document')]
+    built = {}
+    if missing:
+        built = build_documents(Recipe.objects.filter(pk__in=missing))
+    host = orjson.dumps(request.build_absolute_uri('/')[:-1])[1:-1]
+    rendered = []
+    for recipe in recipes:
+        document = built.get(recipe.pk) or recipe.document
+        values = {HOST: host}
+        for flag in FLAGS:
+            values[flag] = RAW_BOOLEANS[getattr(recipe, flag, False)]
+        rendered.append(render_document(
+            bytes(document.body), document.splices, values))
+    return rendered
+
+
+def render_recipe_list(recipes, request):
+    """JSON array of the recipes, see render_recipes."""
+    return b'[' + b','.join(render_recipes(recipes, request)) + b']'
+
+
+def splice_results(data, results):
+    """
+    Render paginated data whose 'results' (the last key, empty)
+    is replaced with the rendered results array.
+    """
+    body = render({**data, 'results': []})
+    assert body.endswith(b'[]}')
+    return body[:-3] + results + b'}'
@@ -0,0 +1,330 @@
+"""
+Server-sent events of the per-user lists, for the ASGI entry point.
+
+GET /api/events/ keeps a text/event-stream open and sends an event when
+the favorites, shopping cart or subscriptions of the user change, so
+clients refetch that list instead of polling it:
+
+    event: shopping_cart
+    id: 1700000000000
+    data: {"type": "shopping_cart"}
+
+The token goes in the Authorization header, or in ?token= for
+EventSource, which cannot send headers. "resync" means events may have
+been missed (the bus reconnected, or the client reconnected with
+Last-Event-ID): refetch everything.
+
+Events come from the invalidation bus (api.bus), which already carries
+the ids of the users whose lists changed to every worker: its listener
+thread hands them to the streams of this process, so the multi-worker
+fan-out is the bus backend (PostgreSQL NOTIFY or the event file).
+A stream holds at most one pending event per type, however slow its
+client, and the streams per worker and per user are limited (503 and
+429, with Retry-After: RETRY_AFTER seconds). A comment is sent every
+HEARTBEAT seconds to keep proxies from closing the stream; streams end
+after MAX_AGE seconds, on logout and when the user is deactivated or
+deleted, and clients reconnect after RETRY milliseconds.
+
+Served by EventStreamApplication in foodgram/asgi.py, next to Django:
+Django 3.2 iterates streaming responses synchronously.
+"""
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from api import bus
+from api.authentication import CachedTokenAuthentication
+from posts.models import Favorite, Follow, ShoppingCart
+from users.models import User
+
+EVENTS_SETTINGS = {
+    'PATH': '/api/events/',
+    'HEARTBEAT': 15,
+    'RETRY': 3000,
+    'RETRY_AFTER': 30,
+    'MAX_AGE': 60 * 60,
+    'MAX_CONNECTIONS': 5000,
+    'MAX_PER_USER': 5,
+}
+EVENTS_SETTINGS.update(getattr(settings, 'EVENTS', {}))
+
+EVENT_TYPES = {
+    Favorite._meta.label_lower: 'favorite',
+    ShoppingCart._meta.label_lower: 'shopping_cart',
+    Follow._meta.label_lower: 'follow',
+}
+RESYNC = 'resync'
+
+HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    # nginx: pass the events through as they come
+    (b'x-accel-buffering', b'no'),
+]
+HEARTBEAT = b': ping\n\n'
+
+
+def format_event(kind):
+    return (f'event: {kind}\nid: {int(time.time() * 1000)}\n'
+            f'data: {{"type": "{kind}"}}\n\n').encode()
+
+
+class Rejected(Exception):
+    def __init__(self, status, detail, retry_after=None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Subscriber:
+    """An open stream: the event types pending for it."""
+    def __init__(self, user_id, token, loop):
+        self.user_id = user_id
+        self.token = token
+        self.loop = loop
+        self.deadline = loop.time() + EVENTS_SETTINGS['MAX_AGE']
+        # dict as an ordered set, bounded by the number of event types
+        self.pending = {}
+        self.ping_due = False
+        self.wakeup = asyncio.Event()
+        self.closed = False
+
+    def push(self, kind):
+        self.pending[kind] = None
+        self.wakeup.set()
+
+    def ping(self):
+        self.ping_due = True
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+
+def push_all(subscribers, kind):
+    for subscriber in subscribers:
+        subscriber.push(kind)
+
+
+def close_all(subscribers):
+    for subscriber in subscribers:
+        subscriber.close()
+
+
+def by_loop(subscribers):
+    loops = defaultdict(list)
+    for subscriber in subscribers:
+        loops[subscriber.loop].append(subscriber)
+    return loops.items()
+
+
+class Hub:
+    """
+    Open streams of this process, by user id. Events are handed to each
+    event loop in one call, and one task per loop sends the heartbeats
+    and closes the streams past MAX_AGE, so an idle stream has no timer
+    of its own.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.count = 0
+        self.sweepers = {}
+
+    def add(self, subscriber):
+        with self.lock:
+            if self.count >= EVENTS_SETTINGS['MAX_CONNECTIONS']:
+                raise Rejected(503, 'Too many open event streams.',
+                               EVENTS_SETTINGS['RETRY_AFTER'])
+            streams = self.users.setdefault(subscriber.user_id, set())
+            if len(streams) >= EVENTS_SETTINGS['MAX_PER_USER']:
+                raise Rejected(429, 'Too many event streams of the user.',
+                               EVENTS_SETTINGS['RETRY_AFTER'])
+            streams.add(subscriber)
+            self.count += 1
+            if subscriber.loop not in self.sweepers:
+                self.sweepers[subscriber.loop] = (
+                    subscriber.loop.create_task(self.sweep(subscriber.loop)))
+
+    def remove(self, subscriber):
+        with self.lock:
+            streams = self.users.get(subscriber.user_id)
+            if streams is None or subscriber not in streams:
+                return
+            streams.discard(subscriber)
+            if not streams:
+                del self.users[subscriber.user_id]
+            self.count -= 1
+
+    def subscribers(self, user_ids=None):
+        with self.lock:
+            if user_ids is None:
+                return [subscriber for streams in self.users.values()
+                        for subscriber in streams]
+            return [subscriber for user_id in user_ids
+                    for subscriber in self.users.get(user_id, ())]
+
+    def notify(self, user_ids, kind):
+        """Send kind to the streams of the users (any thread)."""
+        if user_ids is None:
+            kind = RESYNC
+        for loop, subscribers in by_loop(self.subscribers(user_ids)):
+            loop.call_soon_threadsafe(push_all, subscribers, kind)
+
+    def close_tokens(self, keys):
+        if keys is None:
+            return
+        keys = set(keys)
+        for loop, subscribers in by_loop(
+                subscriber for subscriber in self.subscribers()
+                if subscriber.token in keys):
+            loop.call_soon_threadsafe(close_all, subscribers)
+
+    def close_inactive(self, user_ids):
+        """
+        Close the streams of the users among user_ids (all if None)
+        which are deactivated or deleted since they connected.
+        """
+        subscribers = self.subscribers(user_ids)
+        if not subscribers:
+            return
+        active = set(User.objects.filter(
+            pk__in={subscriber.user_id for subscriber in subscribers},
+            is_active=True).values_list('pk', flat=True))
+        for loop, closed in by_loop(
+                subscriber for subscriber in subscribers
+                if subscriber.user_id not in active):
+            loop.call_soon_threadsafe(close_all, closed)
+
+    async def sweep(self, loop):
+        try:
+            while True:
+                await asyncio.sleep(EVENTS_SETTINGS['HEARTBEAT'])
+                now = loop.time()
+                for subscriber in self.subscribers():
+                    if subscriber.loop is not loop:
+                        continue
+                    if subscriber.deadline <= now:
+                        subscriber.close()
+                    else:
+                        subscriber.ping()
+        finally:
+            with self.lock:
+                del self.sweepers[loop]
+
+
+hub = Hub()
+
+for label, kind in EVENT_TYPES.items():
+    bus.register(label, lambda keys, kind=kind: hub.notify(keys, kind))
+bus.register(Token._meta.label_lower, hub.close_tokens)
+bus.register(User._meta.label_lower, hub.close_inactive)
+
+
+def request_token(scope):
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin1').partition(' ')
+            if keyword.lower() == 'token' and key:
+                return key.strip()
+    return parse_qs(scope['query_string'].decode('latin1')).get(
+        'token', [None])[0]
+
+
+def authenticate(key):
+    """User of the token, None if invalid."""
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+    return user
+
+
+async def respond(send, status, detail, retry_after=None):
+    headers = [(b'content-type', b'application/json')]
+    if retry_after is not None:
+        headers.append((b'retry-after', b'%d' % retry_after))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers})
+    await send({'type': 'http.response.body',
+                'body': orjson.dumps({'detail': detail})})
+
+
+async def watch_disconnect(receive, subscriber):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscriber.close()
+
+
+async def stream(subscriber, receive, send, resync=False):
+    """Send the events of the subscriber until it is closed."""
+    watcher = subscriber.loop.create_task(
+        watch_disconnect(receive, subscriber))
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': HEADERS})
+        await send({'type': 'http.response.body', 'more_body': True,
+                    'body': b'retry: %d\n\n' % EVENTS_SETTINGS['RETRY']})
+        if resync:
+            subscriber.push(RESYNC)
+        while True:
+            await subscriber.wakeup.wait()
+            subscriber.wakeup.clear()
+            if subscriber.closed:
+                break
+            pending, subscriber.pending = subscriber.pending, {}
+            body = b''.join(map(format_event, pending))
+            if not body and subscriber.ping_due:
+                body = HEARTBEAT
+            subscriber.ping_due = False
+            if body:
+                await send({'type': 'http.response.body', 'body': body,
+                            'more_body': True})
+        if not watcher.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+
+
+class EventStreamApplication:
+    """ASGI application serving the event streams, the rest to Django."""
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http'
+                or scope['path'] != EVENTS_SETTINGS['PATH']):
+            return await self.application(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await respond(send, 405, 'Method not allowed.')
+        key = request_token(scope)
+        user = await sync_to_async(authenticate)(key) if key else None
+        if user is None:
+            return await respond(send, 401, (
+                'Invalid token.' if key else
+                'Authentication credentials were not provided.'))
+        bus.ensure_listening()
+        subscriber = Subscriber(user.pk, key, asyncio.get_running_loop())
+        try:
+            hub.add(subscriber)
+        except Rejected as error:
+            return await respond(send, error.status, error.detail,
+                                 error.retry_after)
+        try:
+            await stream(subscriber, receive, send, resync=any(
+                name == b'last-event-id' for name, _ in scope['headers']))
+        finally:
+            hub.remove(subscriber)
@@ -0,0 +1,92 @@
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework import fields, relations, serializers
+
+# Field.to_representation implementations which are a plain conversion
+# of the attribute value, so the field can be read with attrgetter.
+DIRECT_CONVERSIONS = {
+    fields.ReadOnlyField.to_representation: None,
+    fields.CharField.to_representation: str,
+    fields.IntegerField.to_representation: int,
+    fields.FloatField.to_representation: float,
+}
+SKIP = object()
+
+
+def generic_getter(field):
+    def getter(instance):
+        try:
+            attribute = field.get_attribute(instance)
+        except fields.SkipField:
+            return SKIP
+        check_for_none = (attribute.pk
+                          if isinstance(attribute, relations.PKOnlyObject)
+                          else attribute)
+        if check_for_none is None:
+            return None
+        return field.to_representation(attribute)
+    return getter
+
+
+def direct_getter(field, convert):
+    get = attrgetter('.'.join(field.source_attrs))
+    fallback = generic_getter(field)
+
+    def getter(instance):
+        try:
+            value = get(instance)
+        except (AttributeError, ObjectDoesNotExist):
+            return fallback(instance)
+        if callable(value) and fields.is_simple_callable(value):
+            return fallback(instance)
+        if value is None or convert is None:
+            return value
+        return convert(value)
+    return getter
+
+
+def compile_serializer(serializer):
+    """
+    Precompile the read path of a bound serializer into a list of
+    (field name, getter) pairs. Simple fields read the attribute directly,
+    method fields call the bound method, everything else goes through
+    the regular field get_attribute / to_representation.
+    """
+    plan = []
+    for field in serializer._readable_fields:
+        if isinstance(field, serializers.SerializerMethodField):
+            getter = getattr(field.parent, field.method_name)
+        elif (field.source != '*'
+              and type(field).to_representation in DIRECT_CONVERSIONS):
+            getter = direct_getter(
+                field, DIRECT_CONVERSIONS[type(field).to_representation])
+        else:
+            getter = generic_getter(field)
+        plan.append((field.field_name, getter))
+    return plan
+
+
+class CompiledSerializerMixin:
+    """
+    Serializer mixin with a precompiled to_representation.
+    The output is identical to the regular serializer; the field plan is
+    built once per serializer instance (i.e. once per list) instead of
+    walking the fields with the generic DRF machinery for every object.
+    Can be switched off with settings.FAST_SERIALIZERS = False.
+    """
+    _compiled_plan = None
+
+    def to_representation(self, instance):
+        if not getattr(settings, 'FAST_SERIALIZERS', True):
+            return super().to_representation(instance)
+        plan = self._compiled_plan
+        if plan is None:
+            plan = self._compiled_plan = compile_serializer(self)
+        ret = {}
+        for name, getter in plan:
+            value = getter(instance)
+            if value is not SKIP:
+                ret[name] = value
+        return ret
@@ -0,0 +1,63 @@
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+FIELDSET_PARAM = 'fieldset'
+
+
+def requested_fields(request, serializer_class):
+    """
+    Names of the serializer fields asked for with
+    ?fieldset=<preset>, ?fields=a,b and / or ?omit=c,d.
+    None means all fields.
+    """
+    if request is None:
+        return None
+    params = request.query_params
+    available = serializer_class.Meta.fields
+    fields = None
+    fieldset = params.get(FIELDSET_PARAM)
+    if fieldset:
+        presets = getattr(serializer_class, 'FIELDSETS', {})
+        if fieldset not in presets:
+            raise ValidationError({FIELDSET_PARAM: [
+                f'Unknown fieldset: {fieldset}. '
+                f'Available: {", ".join(presets)}.']})
+        fields = set(presets[fieldset])
+    for param in (FIELDS_PARAM, OMIT_PARAM):
+        value = params.get(param)
+        if not value:
+            continue
+        names = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = names.difference(available)
+        if unknown:
+            raise ValidationError({param: [
+                f'Unknown fields: {", ".join(sorted(unknown))}.']})
+        if param == FIELDS_PARAM:
+            fields = names if fields is None else fields & names
+        else:
+            fields = set(available if fields is None else fields) - names
+    return fields
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin dropping the fields not asked for in the request
+    query (see requested_fields). Only the root serializer of
+    the response (or the child of its list) is pruned; nested
+    serializers keep their fields.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if parent is not None and not (
+                isinstance(parent, serializers.ListSerializer)
+                and parent.parent is None):
+            return fields
+        requested = requested_fields(
+            self.context.get('request'), type(self))
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items()
+                if name in requested}
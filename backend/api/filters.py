@@ -1,13 +1,54 @@
+from django.db.models import F, Max, Q
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter, SearchFilter
 
-from posts.models import Recipe, User, Tag
+from api.write_behind import list_flag, pending
+from posts.models import Favorite, Recipe, ShoppingCart, User, Tag
+
+RecipeTag = Recipe.tags.through
+
+
+# Up to 2 ** 8 - 1 masks in the IN list of the tags filter.
+MAX_LISTED_MASK_BITS = 8
 
 
 class IngredientSearchFilter(SearchFilter):
     search_param = 'name'
 
 
+class AuthorStatsOrderingFilter(OrderingFilter):
+    """
+    ?ordering=-followers_count,... of users by their author stats,
+    read from the indexed AuthorStats columns. Ties are ordered by id.
+    """
+    columns = {
+        'recipes_count': 'stats__recipes_count',
+        'followers_count': 'stats__followers_count',
+        'favorites_count': 'stats__favorites_count',
+        'id': 'id',
+    }
+
+    def get_valid_fields(self, queryset, view, context={}):
+        return [(name, name) for name in self.columns]
+
+    def get_ordering(self, request, queryset, view):
+        value = request.query_params.get(self.ordering_param)
+        if not value:
+            return self.get_default_ordering(view)
+        ordering = []
+        for term in (term.strip() for term in value.split(',')):
+            column = self.columns.get(term.lstrip('-'))
+            if column is None:
+                raise ValidationError({self.ordering_param: [
+                    f'Unknown ordering field: {term}. '
+                    f'Available: {", ".join(self.columns)}.']})
+            ordering.append(('-' if term.startswith('-') else '') + column)
+        if not any(column.lstrip('-') == 'id' for column in ordering):
+            ordering.append('id')
+        return ordering
+
+
 class RecipeFilter(FilterSet):
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all())
@@ -15,6 +56,7 @@ class RecipeFilter(FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart')
@@ -25,12 +67,56 @@ class RecipeFilter(FilterSet):
         model = Recipe
         fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, tags):
+        """
+        Recipes having any of the tags, by Recipe.tag_mask: a single
+        table predicate instead of a join with DISTINCT.
+        While there are few tag bits the matching masks are listed
+        (tag_mask IN (...)), which uses the tag_mask index. Tags without
+        a bit yet (see posts.signals.assign_tag_bits) are matched by
+        their recipe_tags rows.
+        """
+        if not tags:
+            return queryset
+        wanted = 0
+        for tag in tags:
+            if tag.bit is not None:
+                wanted |= 1 << tag.bit
+        matched = Q()
+        if wanted:
+            bits = Tag.objects.aggregate(bits=Max('bit'))['bits'] + 1
+            if bits <= MAX_LISTED_MASK_BITS:
+                matched = Q(tag_mask__in=[
+                    mask for mask in range(1, 1 << bits) if mask & wanted])
+            else:
+                queryset = queryset.alias(
+                    matched_tags=F('tag_mask').bitand(wanted))
+                matched = ~Q(matched_tags=0)
+        bitless = [tag.pk for tag in tags if tag.bit is None]
+        if bitless:
+            matched |= Q(pk__in=RecipeTag.objects.filter(
+                tag__in=bitless).values('recipe_id'))
+        return queryset.filter(matched)
+
+    def filter_in_list(self, queryset, model, lookup):
+        """
+        Recipes in a list of the user; through the list flag if the list
+        has changes in the write-behind journal.
+        """
+        user = self.request.user
+        changes = pending(user.pk).get(model)
+        if not changes:
+            return queryset.filter(**{lookup: user})
+        return queryset.alias(
+            in_list=list_flag(model, user, changes)).filter(in_list=True)
+
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(favorite__author=self.request.user)
+            return self.filter_in_list(queryset, Favorite, 'favorite__author')
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(shopping_cart__author=self.request.user)
+            return self.filter_in_list(
+                queryset, ShoppingCart, 'shopping_cart__author')
         return queryset
@@ -0,0 +1,140 @@
+"""
+Idempotency-Key support for the write actions of the viewsets.
+
+A retried request carrying the same key as an earlier one of the same
+user is answered with the stored response of the first, without running
+the action again (no image decoding, validation or writes). The response
+is stored with a fingerprint of the method, path and data: reusing a key
+for a different request gets 422, and a retry arriving while the first
+request is still running gets 409. Entries live TTL seconds in
+a bounded cache shared by the workers (IDEMPOTENCY['CACHE_ALIAS']).
+Server errors are not stored, so they can be retried.
+"""
+import hashlib
+
+import orjson
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+IDEMPOTENCY_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'idempotency:',
+    'HEADER': 'Idempotency-Key',
+    'TTL': 24 * 60 * 60,
+    # how long a key stays locked by a request still running
+    'LOCK_TTL': 60,
+    'MAX_KEY_LENGTH': 255,
+}
+IDEMPOTENCY_SETTINGS.update(getattr(settings, 'IDEMPOTENCY', {}))
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def get_cache():
+    return caches[IDEMPOTENCY_SETTINGS['CACHE_ALIAS']]
+
+
+def fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.path}\n'.encode())
+    digest.update(orjson.dumps(request.data, default=str,
+                               option=orjson.OPT_SORT_KEYS))
+    return digest.hexdigest()
+
+
+class KeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = ('A request with this idempotency key '
+                      'is still in progress.')
+    default_code = 'idempotency_key_in_use'
+
+
+class KeyMismatch(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = ('This idempotency key was used '
+                      'for a different request.')
+    default_code = 'idempotency_key_mismatch'
+
+
+class Replay(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class IdempotencyMixin:
+    """
+    Viewset mixin honouring the Idempotency-Key header on the actions
+    listed in idempotent_actions, for authenticated users.
+    """
+    idempotent_actions = ()
+    _idempotency = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        key = request.headers.get(IDEMPOTENCY_SETTINGS['HEADER'])
+        if (not key or self.action not in self.idempotent_actions
+                or not request.user.is_authenticated):
+            return
+        if len(key) > IDEMPOTENCY_SETTINGS['MAX_KEY_LENGTH']:
+            raise ValidationError({IDEMPOTENCY_SETTINGS['HEADER']: [
+                f'No more than {IDEMPOTENCY_SETTINGS["MAX_KEY_LENGTH"]} '
+                f'characters.']})
+        cache_key = (f'{IDEMPOTENCY_SETTINGS["KEY_PREFIX"]}'
+                     f'{request.user.pk}:{key}')
+        request_fingerprint = fingerprint(request)
+        cache = get_cache()
+        if not cache.add(cache_key, {'fingerprint': request_fingerprint},
+                         IDEMPOTENCY_SETTINGS['LOCK_TTL']):
+            stored = cache.get(cache_key)
+            if stored is None:
+                # Expired meanwhile: handle as a new request.
+                cache.set(cache_key, {'fingerprint': request_fingerprint},
+                          IDEMPOTENCY_SETTINGS['LOCK_TTL'])
+            elif stored['fingerprint'] != request_fingerprint:
+                raise KeyMismatch()
+            elif 'status' not in stored:
+                raise KeyInUse()
+            else:
+                response = HttpResponse(
+                    stored['content'], status=stored['status'],
+                    content_type=stored['content_type'])
+                response[REPLAYED_HEADER] = 'true'
+                raise Replay(response)
+        self._idempotency = (cache_key, request_fingerprint)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            self._release_key()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if self._idempotency is None:
+            return response
+        if response.status_code >= 500:
+            self._release_key()
+            return response
+        cache_key, request_fingerprint = self._idempotency
+        self._idempotency = None
+        if hasattr(response, 'render'):
+            response.render()
+        get_cache().set(cache_key, {
+            'fingerprint': request_fingerprint,
+            'status': response.status_code,
+            'content': response.content,
+            'content_type': response.get('Content-Type'),
+        }, IDEMPOTENCY_SETTINGS['TTL'])
+        return response
+
+    def _release_key(self):
+        if self._idempotency is not None:
+            get_cache().delete(self._idempotency[0])
+            self._idempotency = None
@@ -0,0 +1,299 @@
+"""
+Bulk import of recipes from NDJSON: one recipe per line, in the
+RecipeWriteSerializer format
+{"name", "text", "cooking_time", "tags": [id], "ingredients":
+[{"id", "amount"}], "image": "data:image/...;base64,..."}.
+
+Records are validated against the tag / ingredient ids loaded once per
+import, and inserted CHUNK_SIZE at a time with bulk_create in one
+transaction per chunk. Images are not decoded during the import: the
+data URI header, the base64 encoding and the file signature are
+checked, then the base64 data is stored as a pending file (outside
+MEDIA_ROOT, which is served) and turned into the recipe image by a
+background task, which also builds the recipe documents. Until then
+the recipe has no image and is left out of the API reads (list, detail,
+subscriptions, change feed: Recipe.objects.published()); a recipe whose
+image still fails to decode there is soft-deleted.
+"""
+import base64
+import binascii
+import logging
+import os
+import re
+import time
+
+import orjson
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, transaction
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.exceptions import ValidationError
+
+from api import bus
+from api.changes import record_recipe_changes
+from api.deletion import soft_delete_recipes
+from api.documents import refresh_recipe_documents
+from posts.models import Ingredient, IngredientRecipe, Recipe, Tag
+from posts.stats import change_author_stats
+from tasks.queue import task
+
+logger = logging.getLogger(__name__)
+
+RECIPE_IMPORT_SETTINGS = {
+    'CHUNK_SIZE': 500,
+    'MAX_RECORDS': 10000,
+    'PENDING_DIR': os.path.join(settings.BASE_DIR, 'imports'),
+}
+RECIPE_IMPORT_SETTINGS.update(getattr(settings, 'RECIPE_IMPORT', {}))
+
+RecipeTag = Recipe.tags.through
+
+NAME_MAX_LENGTH = Recipe._meta.get_field('name').max_length
+SMALL_INTEGER_MAX = 32767
+
+# data:image/<type>;base64,<data>, of the types of Base64ImageField.
+DATA_URI = re.compile(r'data:image/([a-z]+);base64,(.*)', re.DOTALL)
+IMAGE_TYPES = ('png', 'jpeg', 'jpg', 'gif')
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a',
+                    b'GIF89a')
+
+
+def pending_image_path(recipe_id):
+    return os.path.join(RECIPE_IMPORT_SETTINGS['PENDING_DIR'],
+                        f'{recipe_id}.b64')
+
+
+def image_error(image):
+    """Why the data URI is not an accepted image, or None."""
+    if not isinstance(image, str) or not image:
+        return 'A base64 encoded image is required.'
+    match = DATA_URI.fullmatch(image)
+    if match is None:
+        return 'A data:image/...;base64, URI is required.'
+    if match[1] not in IMAGE_TYPES:
+        return f'Image type must be one of: {", ".join(IMAGE_TYPES)}.'
+    try:
+        data = base64.b64decode(''.join(match[2].split()), validate=True)
+    except binascii.Error:
+        return 'Invalid base64 data.'
+    if not data.startswith(IMAGE_SIGNATURES):
+        return 'The data is not a PNG, JPEG or GIF image.'
+    return None
+
+
+def _positive_integer(value):
+    return (isinstance(value, int) and not isinstance(value, bool)
+            and 0 < value <= SMALL_INTEGER_MAX)
+
+
+class RecipeImport:
+    """
+    Import of recipes of one author: add() lines (bytes or str), then
+    finish() for the report with the created ids and per-line errors.
+    """
+    def __init__(self, author, chunk_size=None):
+        self.author = author
+        self.chunk_size = chunk_size or RECIPE_IMPORT_SETTINGS['CHUNK_SIZE']
+        self.tag_bits = dict(Tag.objects.values_list('pk', 'bit'))
+        self.ingredient_ids = set(
+            Ingredient.objects.values_list('pk', flat=True))
+        self.names = set(Recipe.objects.filter(
+            author=author).values_list('name', flat=True))
+        self.chunk = []
+        self.records = 0
+        self.created = []
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def validate(self, data):
+        """Cleaned record, ValidationError with the field errors if invalid."""
+        if not isinstance(data, dict):
+            raise ValidationError(
+                {'non_field_errors': ['A JSON object is required.']})
+        errors = {}
+        name = data.get('name')
+        if not isinstance(name, str) or not name.strip():
+            errors['name'] = ['A non-empty string is required.']
+        elif len(name) > NAME_MAX_LENGTH:
+            errors['name'] = [
+                f'Ensure this field has no more than '
+                f'{NAME_MAX_LENGTH} characters.']
+        elif name in self.names:
+            errors['name'] = ['The author already has a recipe '
+                              'with this name.']
+        text = data.get('text')
+        if not isinstance(text, str) or not text.strip():
+            errors['text'] = ['A non-empty string is required.']
+        if not _positive_integer(data.get('cooking_time')):
+            errors['cooking_time'] = ['Minimum cooking time is 1.']
+        tags = data.get('tags')
+        if not isinstance(tags, list) or not tags:
+            errors['tags'] = ['At least one tag must be selected!']
+        elif len(set(map(str, tags))) != len(tags):
+            errors['tags'] = ['Tags must not be duplicated!']
+        elif not all(isinstance(tag, int) and tag in self.tag_bits
+                     for tag in tags):
+            errors['tags'] = ['Unknown tag ids.']
+        ingredients = data.get('ingredients')
+        if not isinstance(ingredients, list) or not ingredients:
+            errors['ingredients'] = [
+                'At least one ingredient must be selected!']
+        elif not all(isinstance(item, dict) for item in ingredients):
+            errors['ingredients'] = ['A list of {id, amount} is required.']
+        elif not all(isinstance(item.get('id'), int)
+                     and item['id'] in self.ingredient_ids
+                     for item in ingredients):
+            errors['ingredients'] = ['Unknown ingredient ids.']
+        elif len({item['id'] for item in ingredients}) != len(ingredients):
+            errors['ingredients'] = ['Ingredients must not be duplicated!']
+        elif not all(_positive_integer(item.get('amount'))
+                     for item in ingredients):
+            errors['amount'] = ['Amount must be greater than zero!']
+        error = image_error(data.get('image'))
+        if error:
+            errors['image'] = [error]
+        if errors:
+            raise ValidationError(errors)
+        return data
+
+    def add(self, line):
+        self.records += 1
+        if self.records > RECIPE_IMPORT_SETTINGS['MAX_RECORDS']:
+            raise ValidationError({'non_field_errors': [
+                f'No more than {RECIPE_IMPORT_SETTINGS["MAX_RECORDS"]} '
+                f'records per import.']})
+        try:
+            record = self.validate(orjson.loads(line))
+        except orjson.JSONDecodeError as error:
+            self.errors.append({'line': self.records, 'errors': {
+                'non_field_errors': [f'Invalid JSON: {error}']}})
+            return
+        except ValidationError as error:
+            self.errors.append({'line': self.records, 'errors': error.detail})
+            return
+        self.names.add(record['name'])
+        self.chunk.append((self.records, record))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the validated records of the chunk."""
+        chunk, self.chunk = self.chunk, []
+        if not chunk:
+            return
+        recipes = []
+        for _, record in chunk:
+            mask = 0
+            for tag in record['tags']:
+                if self.tag_bits[tag] is not None:
+                    mask |= 1 << self.tag_bits[tag]
+            recipes.append(Recipe(
+                author=self.author, name=record['name'], text=record['text'],
+                cooking_time=record['cooking_time'], tag_mask=mask))
+        paths = []
+        try:
+            with transaction.atomic():
+                Recipe.objects.bulk_create(recipes)
+                if recipes[0].pk is None:
+                    # No INSERT ... RETURNING (SQLite).
+                    ids = dict(Recipe.objects.filter(
+                        author=self.author,
+                        name__in=[recipe.name for recipe in recipes],
+                    ).values_list('name', 'pk'))
+                    for recipe in recipes:
+                        recipe.pk = ids[recipe.name]
+                RecipeTag.objects.bulk_create([
+                    RecipeTag(recipe_id=recipe.pk, tag_id=tag)
+                    for recipe, (_, record) in zip(recipes, chunk)
+                    for tag in record['tags']])
+                IngredientRecipe.objects.bulk_create([
+                    IngredientRecipe(recipe_id=recipe.pk,
+                                     ingredient_id=item['id'],
+                                     amount=item['amount'])
+                    for recipe, (_, record) in zip(recipes, chunk)
+                    for item in record['ingredients']])
+                os.makedirs(RECIPE_IMPORT_SETTINGS['PENDING_DIR'],
+                            exist_ok=True)
+                for recipe, (_, record) in zip(recipes, chunk):
+                    paths.append(pending_image_path(recipe.pk))
+                    with open(paths[-1], 'w') as file:
+                        file.write(record['image'])
+                recipe_ids = [recipe.pk for recipe in recipes]
+                change_author_stats('recipes_count',
+                                    {self.author.pk: len(recipe_ids)})
+                record_recipe_changes(recipe_ids)
+                bus.publish(Recipe._meta.label_lower, recipe_ids)
+                process_imported_images.enqueue(recipe_ids)
+        except (DatabaseError, OSError) as error:
+            logger.exception('Recipe import chunk failed')
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            for number, record in chunk:
+                self.names.discard(record['name'])
+                self.errors.append({'line': number, 'errors': {
+                    'non_field_errors': [f'Not saved: {error}']}})
+            return
+        self.created.extend(
+            {'line': number, 'id': recipe.pk}
+            for recipe, (number, _) in zip(recipes, chunk))
+
+    def finish(self):
+        self.flush()
+        seconds = time.perf_counter() - self.started
+        return {
+            'records': self.records,
+            'created': len(self.created),
+            'failed': len(self.errors),
+            'seconds': round(seconds, 3),
+            'records_per_second': round(
+                self.records / seconds if seconds else 0, 1),
+            'results': self.created,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+        }
+
+
+def import_recipes(lines, author, chunk_size=None):
+    """Import the NDJSON lines, skipping blank ones. Returns the report."""
+    recipe_import = RecipeImport(author, chunk_size)
+    try:
+        for line in lines:
+            if line.strip():
+                recipe_import.add(line)
+    except ValidationError as error:
+        recipe_import.errors.append(
+            {'line': recipe_import.records, 'errors': error.detail})
+    return recipe_import.finish()
+
+
+@task(priority=-5)
+def process_imported_images(recipe_ids):
+    """
+    Decode the pending images of imported recipes, which publishes
+    them (Recipe.objects.published()). The recipes whose image is
+    invalid or missing are soft-deleted instead of staying hidden.
+    """
+    field = Base64ImageField()
+    invalid = []
+    for recipe in Recipe.objects.filter(pk__in=recipe_ids, image=''):
+        path = pending_image_path(recipe.pk)
+        if not os.path.exists(path):
+            invalid.append(recipe.pk)
+            continue
+        with open(path) as file:
+            data = file.read()
+        try:
+            image = field.to_internal_value(data)
+        except (ValidationError, DjangoValidationError) as error:
+            logger.warning('Invalid image of imported recipe %s: %s',
+                           recipe.pk, error)
+            invalid.append(recipe.pk)
+        else:
+            recipe.image.save(image.name, image, save=False)
+            recipe.save(update_fields=['image'])
+        os.remove(path)
+    if invalid:
+        logger.error('Soft-deleted imported recipes without a valid '
+                     'image: %s', invalid)
+        soft_delete_recipes(invalid)
+    refresh_recipe_documents(Recipe.objects.filter(pk__in=recipe_ids))
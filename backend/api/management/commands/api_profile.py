@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils.module_loading import import_string
+
+COLD_START_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(time.perf_counter() - start, len(sys.modules))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Report cold-start time of settings profiles and per-request '
+            'middleware overhead of the current profile.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', nargs='+',
+            default=['foodgram.settings', 'foodgram.settings_api'],
+            help='Settings modules to measure cold start for.')
+        parser.add_argument(
+            '--requests', type=int, default=2000,
+            help='Requests per middleware measurement.')
+
+    def handle(self, *args, **options):
+        self.report_cold_start(options['profiles'])
+        self.report_middleware(options['requests'])
+        self.report_admin_only()
+
+    def report_cold_start(self, profiles):
+        self.stdout.write('Cold start (django.setup() + URLconf):')
+        for profile in profiles:
+            result = subprocess.run(
+                [sys.executable, '-c', COLD_START_SCRIPT],
+                env={**os.environ, 'DJANGO_SETTINGS_MODULE': profile},
+                capture_output=True, text=True)
+            if result.returncode:
+                self.stderr.write(f'  {profile}: failed\n{result.stderr}')
+                continue
+            seconds, modules = result.stdout.split()
+            self.stdout.write(
+                f'  {profile}: {float(seconds) * 1000:.1f} ms, '
+                f'{modules} modules')
+
+    def report_middleware(self, requests):
+        self.stdout.write(
+            f'Middleware overhead ({settings.SETTINGS_MODULE}), '
+            'cumulative chain, per request:')
+        factory = RequestFactory()
+        baseline = self.time_chain([], factory, requests)
+        previous = baseline
+        for index, path in enumerate(settings.MIDDLEWARE, start=1):
+            elapsed = self.time_chain(
+                settings.MIDDLEWARE[:index], factory, requests)
+            self.stdout.write(
+                f'  +{(elapsed - previous) * 1e6:7.1f} us  {path}')
+            previous = elapsed
+        self.stdout.write(
+            f'  total: {(previous - baseline) * 1e6:.1f} us')
+
+    @staticmethod
+    def time_chain(middleware, factory, requests):
+        def view(request):
+            return HttpResponse('{}', content_type='application/json')
+
+        handler = view
+        for path in reversed(middleware):
+            handler = import_string(path)(handler)
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else ''
+        request = factory.get('/api/recipes/', HTTP_HOST=host)
+        best = float('inf')
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(requests):
+                handler(request)
+            best = min(best, time.perf_counter() - start)
+        return best / requests
+
+    def report_admin_only(self):
+        from foodgram.settings_api import (ADMIN_ONLY_APPS,
+                                           ADMIN_ONLY_MIDDLEWARE)
+        middleware = [path for path in settings.MIDDLEWARE
+                      if path in ADMIN_ONLY_MIDDLEWARE]
+        apps = [app for app in settings.INSTALLED_APPS
+                if app in ADMIN_ONLY_APPS]
+        if not middleware and not apps:
+            self.stdout.write(self.style.SUCCESS(
+                'No admin-only middleware or apps on the request path.'))
+            return
+        self.stdout.write(self.style.WARNING(
+            'Not needed for token-authenticated API workers '
+            '(use foodgram.settings_api):'))
+        for name in middleware + apps:
+            self.stdout.write(f'  {name}')
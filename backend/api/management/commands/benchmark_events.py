@@ -0,0 +1,138 @@
+import asyncio
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.events import EVENTS_SETTINGS, Hub, Subscriber, stream
+
+
+def rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+class Deliveries:
+    """Events received by all the clients, until expected ones arrive."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.count = 0
+        self.expected = 0
+        self.done = loop.create_future()
+
+    def expect(self, count):
+        self.count = 0
+        self.expected = count
+        self.done = self.loop.create_future()
+
+    def received(self):
+        self.count += 1
+        if self.count == self.expected:
+            self.done.set_result(None)
+
+
+class Client:
+    """ASGI receive / send of a subscriber."""
+    def __init__(self, loop, deliveries):
+        self.disconnected = loop.create_future()
+        self.deliveries = deliveries
+        self.events = 0
+
+    async def receive(self):
+        await self.disconnected
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        body = message.get('body', b'')
+        if b'event: ' in body:
+            self.events += 1
+        if body.startswith((b'event: ', b': ping')):
+            self.deliveries.received()
+
+
+class Command(BaseCommand):
+    help = ('Load test of the event streams of one worker: memory per '
+            'open stream and time to fan an event out to all of them. '
+            'The ASGI server buffers are not included.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            rss()
+        except OSError:
+            raise CommandError('Needs /proc/self/status (Linux).')
+        asyncio.run(self.run(options['connections'], options['rounds']))
+
+    async def run(self, connections, rounds):
+        loop = asyncio.get_running_loop()
+        hub = Hub()
+        EVENTS_SETTINGS['MAX_CONNECTIONS'] = connections
+        deliveries = Deliveries(loop)
+        before = rss()
+        started = time.perf_counter()
+        clients, subscribers, tasks = [], [], []
+        for user_id in range(1, connections + 1):
+            client = Client(loop, deliveries)
+            subscriber = Subscriber(user_id, None, loop)
+            hub.add(subscriber)
+            clients.append(client)
+            subscribers.append(subscriber)
+            tasks.append(loop.create_task(
+                self.serve(hub, subscriber, client)))
+        await asyncio.sleep(0)
+        opened = time.perf_counter() - started
+        memory = rss() - before
+        self.stdout.write(
+            f'{connections} streams opened in {opened * 1000:.0f} ms, '
+            f'RSS +{memory} kB ({memory * 1024 / connections:.0f} '
+            f'bytes per stream)')
+
+        user_ids = list(range(1, connections + 1))
+        timings = []
+        for _ in range(rounds):
+            deliveries.expect(connections)
+            started = time.perf_counter()
+            # Delivered from another thread, as by the bus listener.
+            threading.Thread(
+                target=hub.notify, args=(user_ids, 'favorite')).start()
+            await deliveries.done
+            timings.append(time.perf_counter() - started)
+        if any(client.events != rounds for client in clients):
+            raise CommandError('Events lost or duplicated.')
+        median = statistics.median(timings)
+        self.stdout.write(
+            f'Fan-out to {connections} streams: median '
+            f'{median * 1000:.1f} ms, '
+            f'{connections / median:.0f} deliveries/s')
+
+        deliveries.expect(connections)
+        started = time.perf_counter()
+        for subscriber in subscribers:
+            subscriber.ping()
+        await deliveries.done
+        sweep = time.perf_counter() - started
+        self.stdout.write(
+            f'Heartbeat to {connections} streams: {sweep * 1000:.1f} ms '
+            f'every {EVENTS_SETTINGS["HEARTBEAT"]} s')
+
+        started = time.perf_counter()
+        for client in clients:
+            client.disconnected.set_result(None)
+        await asyncio.gather(*tasks)
+        self.stdout.write(
+            f'Closed in {(time.perf_counter() - started) * 1000:.0f} ms, '
+            f'{hub.count} streams left registered')
+
+    @staticmethod
+    async def serve(hub, subscriber, client):
+        try:
+            await stream(subscriber, client.receive, client.send)
+        finally:
+            hub.remove(subscriber)
@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import force_authenticate
+
+from api.views import RecipeViewSet
+from users.models import User
+
+VARIANTS = (
+    ('full', ''),
+    ('card', 'fieldset=card'),
+    ('omit text', 'omit=text'),
+    ('name,tags', 'fields=id,name,tags'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Compare payload size, queries and latency of the recipe list '
+            'with the full representation and with sparse fieldsets.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Recipes per page.')
+        parser.add_argument('--rounds', type=int, default=50)
+        parser.add_argument('--user', type=int,
+                            help='Request as this user id.')
+
+    def handle(self, *args, **options):
+        user = AnonymousUser()
+        if options['user']:
+            user = User.objects.get(pk=options['user'])
+        view = RecipeViewSet.as_view({'get': 'list'}, throttle_classes=())
+        factory = RequestFactory()
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else ''
+        baseline = None
+        for name, query in VARIANTS:
+            path = f'/api/recipes/?limit={options["limit"]}&{query}'
+
+            def get():
+                request = factory.get(path, HTTP_HOST=host)
+                force_authenticate(request, user=user)
+                response = view(request)
+                response.render()
+                return response
+
+            response = get()
+            with CaptureQueriesContext(connection) as queries:
+                get()
+            start = time.perf_counter()
+            for _ in range(options['rounds']):
+                get()
+            elapsed = (time.perf_counter() - start) / options['rounds']
+            size = len(response.content)
+            if baseline is None:
+                baseline = (size, elapsed)
+            self.stdout.write(
+                f'{name:10s} {size:8d} bytes ({size / baseline[0]:6.1%})  '
+                f'{len(queries):3d} queries  '
+                f'{elapsed * 1000:7.2f} ms ({elapsed / baseline[1]:6.1%})')
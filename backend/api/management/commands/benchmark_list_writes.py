@@ -0,0 +1,65 @@
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import write_behind
+from api.services import add_to_list, remove_from_list
+from api.write_behind import WRITE_BEHIND_SETTINGS, flush
+from posts.models import Favorite, Recipe, ShoppingCart, User
+
+
+class Command(BaseCommand):
+    help = ('Compare favorite / shopping cart toggles per second written '
+            'directly and through the write-behind journal. The toggles '
+            'are undone afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--toggles', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = list(User.objects.order_by('pk')[:options['users']])
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True)[:options['recipes']])
+        if not users or not recipe_ids:
+            raise CommandError('Needs users and recipes.')
+        rng = random.Random(options['seed'])
+        toggles = [(rng.choice((Favorite, ShoppingCart)), rng.choice(users),
+                    rng.choice(recipe_ids))
+                   for _ in range(options['toggles'])]
+
+        settings = dict(WRITE_BEHIND_SETTINGS)
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                WRITE_BEHIND_SETTINGS['ENABLED'] = False
+                self.run('direct', toggles)
+                WRITE_BEHIND_SETTINGS.update(
+                    ENABLED=True, JOURNAL=f'{directory}/lists.journal')
+                self.run('write-behind', toggles)
+            finally:
+                flush(block=True)
+                WRITE_BEHIND_SETTINGS.update(settings)
+
+    def run(self, name, toggles):
+        """The toggles, then the same toggles in reverse to undo them."""
+        for label, sequence in (('toggles', toggles),
+                                ('undo', toggles[::-1])):
+            started = time.perf_counter()
+            for model, user, recipe_id in sequence:
+                if not add_to_list(model, user, recipe_id):
+                    remove_from_list(model, user, recipe_id)
+            acknowledged = time.perf_counter() - started
+            message = (f'{name:12} {label:7} {len(sequence)} in '
+                       f'{acknowledged * 1000:8.1f} ms, '
+                       f'{len(sequence) / acknowledged:8.0f} toggles/s')
+            if write_behind.enabled():
+                started = time.perf_counter()
+                flush(block=True)
+                message += (f', all written '
+                            f'{(time.perf_counter() - started) * 1000:.1f} '
+                            f'ms later')
+            self.stdout.write(message)
@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import ORJSONRenderer
+from api.serializers import IngredientSerializer, RecipeListSerializer
+from api.services import annotate_is_subscribed, recipes_for_reading
+from posts.models import Ingredient, Recipe
+from users.models import User
+from users.serializers import UserSerializer
+
+
+class Command(BaseCommand):
+    help = ('Compare objects/sec of the regular and precompiled list '
+            'serializers, and of the stdlib and orjson renderers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100,
+                            help='Objects per serialized list.')
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--user', type=int,
+                            help='Serialize as this user id.')
+
+    def handle(self, *args, **options):
+        user = AnonymousUser()
+        if options['user']:
+            user = User.objects.get(pk=options['user'])
+        request = RequestFactory().get(
+            '/api/', HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        request.user = user
+        limit = options['limit']
+        targets = (
+            ('recipes', RecipeListSerializer,
+             recipes_for_reading(Recipe.objects.all(), user)[:limit]),
+            ('users', UserSerializer,
+             annotate_is_subscribed(User.objects.all(), user)[:limit]),
+            ('ingredients', IngredientSerializer,
+             Ingredient.objects.all()[:limit]),
+        )
+        for name, serializer_class, queryset in targets:
+            objects = list(queryset)
+            if not objects:
+                self.stdout.write(f'{name}: no rows, skipped')
+                continue
+            self.compare(name, serializer_class, objects, request,
+                         options['rounds'])
+
+    def compare(self, name, serializer_class, objects, request, rounds):
+        def serialize():
+            return serializer_class(objects, many=True,
+                                    context={'request': request}).data
+
+        with override_settings(FAST_SERIALIZERS=False):
+            regular_rate, regular_data = self.rate(
+                serialize, len(objects), rounds)
+        compiled_rate, compiled_data = self.rate(
+            serialize, len(objects), rounds)
+        stdlib = JSONRenderer().render(regular_data)
+        if ORJSONRenderer().render(compiled_data) != stdlib:
+            raise CommandError(f'{name}: outputs differ')
+        stdlib_rate, _ = self.rate(
+            lambda: JSONRenderer().render(compiled_data),
+            len(objects), rounds)
+        orjson_rate, _ = self.rate(
+            lambda: ORJSONRenderer().render(compiled_data),
+            len(objects), rounds)
+        self.stdout.write(
+            f'{name} ({len(objects)} objects, {len(stdlib)} bytes):\n'
+            f'  serializer  regular {regular_rate:10.0f} obj/s   '
+            f'compiled {compiled_rate:10.0f} obj/s   '
+            f'x{compiled_rate / regular_rate:.2f}\n'
+            f'  renderer    stdlib  {stdlib_rate:10.0f} obj/s   '
+            f'orjson   {orjson_rate:10.0f} obj/s   '
+            f'x{orjson_rate / stdlib_rate:.2f}')
+
+    @staticmethod
+    def rate(func, count, rounds):
+        result = func()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        return count * rounds / (time.perf_counter() - start), result
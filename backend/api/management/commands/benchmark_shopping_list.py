@@ -0,0 +1,93 @@
+import random
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.shopping_list import (IngredientCatalog, conversion_table,
+                               normalize_name, normalize_unit)
+from posts.models import Ingredient
+
+# Units a product of the measure may also be written in.
+VARIANTS = {'г': ('г', 'кг'), 'мл': ('мл', 'л', 'ст. л.', 'ч. л.')}
+
+
+def aggregate_by_row(ingredients, ingredient_ids, amounts):
+    """The same totals, summed row by row in a dict."""
+    table = conversion_table()
+    totals = {}
+    for pk, amount in zip(ingredient_ids, amounts):
+        name, unit = ingredients[pk]
+        key = normalize_unit(unit)
+        measure, factor = table.units.get(key, (key, 1))
+        group = (normalize_name(name), measure)
+        totals[group] = totals.get(group, 0) + amount * factor
+    return totals
+
+
+class Command(BaseCommand):
+    help = ('Time the aggregation of the shopping list on generated '
+            'carts, against summing the rows one by one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=5000,
+                            help='Cart rows.')
+        parser.add_argument('--products', type=int, default=2000,
+                            help='Products of the generated catalog.')
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        products = list(Ingredient.objects.values_list(
+            'name', 'measurement_unit')[:options['products']])
+        products += [
+            (f'product {index}', rng.choice(('г', 'мл', 'шт.', 'банка')))
+            for index in range(options['products'] - len(products))]
+        # Each product also in the other units of its measure, as
+        # separate ingredients.
+        ingredients = {}
+        for name, unit in products:
+            for variant in VARIANTS.get(unit, (unit,)):
+                ingredients[len(ingredients) + 1] = (name, variant)
+
+        started = time.perf_counter()
+        catalog = IngredientCatalog(
+            [(pk, name, unit) for pk, (name, unit) in ingredients.items()],
+            conversion_table())
+        self.stdout.write(
+            f'Catalog of {len(ingredients)} ingredients compiled in '
+            f'{(time.perf_counter() - started) * 1000:.1f} ms '
+            f'(once per process)')
+
+        ingredient_ids = rng.choices(list(ingredients), k=options['lines'])
+        amounts = [rng.randint(1, 500) for _ in ingredient_ids]
+
+        def vectorized():
+            return catalog.aggregate(
+                np.asarray(ingredient_ids, dtype=np.int64),
+                np.asarray(amounts, dtype=np.float64))
+
+        def by_row():
+            return aggregate_by_row(ingredients, ingredient_ids, amounts)
+
+        lines, expected = len(vectorized()), len(by_row())
+        self.stdout.write(
+            f'{len(ingredient_ids)} cart rows -> {lines} list lines'
+            + ('' if lines == expected else f' (row by row: {expected})'))
+        for name, function in (('NumPy group-by', vectorized),
+                               ('row by row', by_row)):
+            seconds = self.time(function, options['rounds'])
+            self.stdout.write(
+                f'  {name:15} median {seconds * 1000:8.2f} ms, '
+                f'{len(ingredient_ids) / seconds:12.0f} rows/s')
+
+    @staticmethod
+    def time(function, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
@@ -0,0 +1,176 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: the phases of a worker start, as gunicorn
+# goes through them, up to the first and a second (warm) request.
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+launched = time.time()
+
+def rss():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+phases = []
+mark = time.perf_counter()
+
+def phase(name):
+    global mark
+    now = time.perf_counter()
+    phases.append((name, (now - mark) * 1000, rss()))
+    mark = now
+
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+phase('settings')
+django.setup(set_prefix=False)
+phase('apps ready')
+from django.core.handlers.wsgi import WSGIHandler
+application = WSGIHandler()
+phase('middleware')
+from django.urls import get_resolver
+get_resolver().url_patterns
+phase('urlconf')
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1],
+    'QUERY_STRING': '', 'SERVER_NAME': sys.argv[2], 'SERVER_PORT': '80',
+    'HTTP_HOST': sys.argv[2], 'wsgi.url_scheme': 'http',
+    'wsgi.input': sys.stdin.buffer, 'wsgi.errors': sys.stderr,
+}
+statuses = []
+for name in ('first request', 'warm request'):
+    response = application(
+        dict(environ), lambda status, headers: statuses.append(status))
+    b''.join(response)
+    response.close()
+    phase(name)
+ready = time.time()
+if sys.argv[3] == '1':
+    from django.core import checks
+    checks.run_checks()
+    phase('system checks')
+print(json.dumps({'phases': phases, 'launched': launched, 'ready': ready,
+                  'statuses': statuses, 'modules': len(sys.modules)}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Report the per-module import time, app-ready time, '
+            'time-to-first-request and RSS of a cold worker start.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/tags/',
+                            help='Path of the first request.')
+        parser.add_argument('--rounds', type=int, default=5,
+                            help='Cold starts to take the median of.')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Slowest imports to list.')
+        parser.add_argument('--checks', action='store_true',
+                            help='Also time the system checks.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print one JSON line of the medians, '
+                                 'to track them between releases.')
+
+    def handle(self, *args, **options):
+        host = next((host for host in settings.ALLOWED_HOSTS
+                     if host != '*'), 'localhost')
+        argv = [options['path'], host, '1' if options['checks'] else '0']
+        runs = [self.start(argv) for _ in range(options['rounds'])]
+        summary = self.summarize(runs)
+        if options['json']:
+            self.stdout.write(json.dumps(summary))
+            return
+        _, imports = self.start(argv, importtime=True)
+        self.report_imports(imports, options['top'])
+        self.report_phases(summary)
+
+    def start(self, argv, importtime=False):
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        started = time.time()
+        result = subprocess.run(
+            command + ['-c', STARTUP_SCRIPT] + argv,
+            capture_output=True, text=True, stdin=subprocess.DEVNULL,
+            env={**os.environ,
+                 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE})
+        if result.returncode:
+            raise CommandError(f'Worker start failed:\n{result.stderr}')
+        run = json.loads(result.stdout.splitlines()[-1])
+        run['phases'].insert(
+            0, ('interpreter', (run['launched'] - started) * 1000, None))
+        run['first_request'] = (run['ready'] - started) * 1000
+        return run, result.stderr
+
+    @staticmethod
+    def summarize(runs):
+        phases = defaultdict(list)
+        rss = {}
+        for run, _ in runs:
+            for name, ms, kilobytes in run['phases']:
+                phases[name].append(ms)
+                rss[name] = kilobytes
+        first_run = runs[0][0]
+        return {
+            'settings': settings.SETTINGS_MODULE,
+            'rounds': len(runs),
+            'statuses': first_run['statuses'],
+            'modules': first_run['modules'],
+            'time_to_first_request_ms': round(statistics.median(
+                run['first_request'] for run, _ in runs), 1),
+            'rss_before_request_kb': rss['urlconf'],
+            'rss_kb': rss['warm request'],
+            'phases_ms': {name: round(statistics.median(values), 1)
+                          for name, values in phases.items()},
+        }
+
+    def report_imports(self, stderr, top):
+        # -X importtime: "import time: self [us] | cumulative | name",
+        # the name indented by the nesting level.
+        imports = []
+        packages = defaultdict(int)
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            module = name.strip()
+            packages[module.split('.')[0]] += int(own)
+            imports.append((int(cumulative), len(name) - len(name.lstrip()),
+                            module))
+        self.stdout.write(f'Slowest imports ({settings.SETTINGS_MODULE}), '
+                          'cumulative:')
+        for cumulative, level, module in sorted(imports, reverse=True)[:top]:
+            self.stdout.write(
+                f'  {cumulative / 1000:8.1f} ms  {" " * (level - 1)}{module}')
+        self.stdout.write('Import time by top-level package:')
+        for package, own in sorted(packages.items(),
+                                   key=lambda item: -item[1])[:top]:
+            self.stdout.write(f'  {own / 1000:8.1f} ms  {package}')
+
+    def report_phases(self, summary):
+        self.stdout.write(
+            f'Worker start, median of {summary["rounds"]} '
+            f'({summary["modules"]} modules):')
+        for name, ms in summary['phases_ms'].items():
+            self.stdout.write(f'  {ms:8.1f} ms  {name}')
+        self.stdout.write(
+            f'Time to first request: '
+            f'{summary["time_to_first_request_ms"]:.1f} ms '
+            f'(status {summary["statuses"][0]})\n'
+            f'RSS: {summary["rss_before_request_kb"]} kB before the first '
+            f'request, {summary["rss_kb"]} kB after')
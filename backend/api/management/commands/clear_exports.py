@@ -0,0 +1,24 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Remove generated export files older than the given age.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24)
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(settings.EXPORTS_ROOT):
+            return
+        deadline = time.time() - options['hours'] * 3600
+        removed = 0
+        with os.scandir(settings.EXPORTS_ROOT) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+        self.stdout.write(f'Removed {removed} export files.')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.changes import compact_changes, seed_changes
+
+
+class Command(BaseCommand):
+    help = ('Compact the recipe change feed: keep the latest change of '
+            'each recipe and drop old deletions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Keep deletions for this many days '
+                                 '(CHANGE_FEED["RETENTION_DAYS"]).')
+        parser.add_argument('--seed', action='store_true',
+                            help='Log the recipes without any change, '
+                                 'needed once for the existing recipes.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.stdout.write(f'Seeded {seed_changes()} recipes.')
+        superseded, expired = compact_changes(options['days'])
+        self.stdout.write(
+            f'Removed {superseded} superseded changes '
+            f'and {expired} expired deletions.')
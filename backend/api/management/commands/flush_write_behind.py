@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.write_behind import (WRITE_BEHIND_SETTINGS, flush, journal_size,
+                              segment_paths)
+
+
+class Command(BaseCommand):
+    help = ('Write the favorite and shopping cart changes of the '
+            'write-behind journal now, e.g. before turning it off.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Journal {WRITE_BEHIND_SETTINGS["JOURNAL"]}: '
+            f'{journal_size()} bytes, {len(segment_paths())} segments.')
+        written = flush(block=True)
+        self.stdout.write(f'Wrote {written} changes.')
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import import_recipes
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Import recipes from an NDJSON file, one recipe per line '
+            'in the API format.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file, - for stdin.')
+        parser.add_argument('--author', type=int, required=True,
+                            help='Author user id.')
+        parser.add_argument('--chunk', type=int,
+                            help='Recipes per transaction '
+                                 '(RECIPE_IMPORT["CHUNK_SIZE"]).')
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(pk=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user {options["author"]}.')
+        if options['path'] == '-':
+            report = import_recipes(sys.stdin.buffer, author,
+                                    options['chunk'])
+        else:
+            with open(options['path'], 'rb') as file:
+                report = import_recipes(file, author, options['chunk'])
+        for error in report['errors']:
+            self.stderr.write(f'Line {error["line"]}: {error["errors"]}')
+        self.stdout.write(
+            f'{report["created"]} created, {report["failed"]} failed '
+            f'of {report["records"]} records in {report["seconds"]}s '
+            f'({report["records_per_second"]} records/s).')
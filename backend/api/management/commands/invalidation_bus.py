@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import bus
+
+
+class Command(BaseCommand):
+    help = ('Publish a test invalidation event and / or listen to the bus, '
+            'printing events with their delivery lag.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--publish', nargs='+',
+                            metavar=('LABEL', 'KEY'),
+                            help='Send an event, e.g. posts.tag 1 2.')
+        parser.add_argument('--listen', type=float, default=0,
+                            metavar='SECONDS',
+                            help='Listen for this long, then print stats.')
+
+    def handle(self, *args, **options):
+        listener = None
+        if options['listen']:
+            listener = bus.Listener(bus.get_backend(), on_event=self.show)
+            listener.start()
+            # Let the listener subscribe before publishing.
+            time.sleep(bus.INVALIDATION_BUS_SETTINGS['POLL_INTERVAL'])
+        if options['publish']:
+            label, *keys = options['publish']
+            bus.publish(label, [int(key) if key.isdigit() else key
+                                for key in keys])
+        if listener is None:
+            return
+        time.sleep(options['listen'])
+        listener.stopped.set()
+        self.stdout.write(f'Backend: {listener.backend}')
+        for name, value in listener.stats.as_dict().items():
+            self.stdout.write(f'  {name}: {value}')
+
+    def show(self, event):
+        lag = time.time() - event['t']
+        self.stdout.write(
+            f'{event["m"]} {event["k"]} from pid {event["p"]}, '
+            f'lag {lag * 1000:.1f} ms')
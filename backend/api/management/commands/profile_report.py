@@ -0,0 +1,107 @@
+import json
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import PROFILE_SUFFIX, PROFILING_SETTINGS, read_profile
+
+
+class Command(BaseCommand):
+    help = ('Aggregate the sampled request profiles into per-view '
+            'hot-function reports, merged collapsed stacks or '
+            'speedscope files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=PROFILING_SETTINGS['DIR'],
+                            help='Directory with the profiles.')
+        parser.add_argument('--view', action='append',
+                            help='Only this <ViewSet>.<action> '
+                                 '(repeatable).')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Functions listed per view.')
+        parser.add_argument('--folded', metavar='DIR',
+                            help='Write merged <view>.folded files here.')
+        parser.add_argument('--speedscope', metavar='DIR',
+                            help='Write <view>.speedscope.json files here.')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['dir']):
+            raise CommandError(f'No profiles in {options["dir"]}.')
+        views = sorted(
+            entry.name for entry in os.scandir(options['dir'])
+            if entry.is_dir()
+            and (not options['view'] or entry.name in options['view']))
+        for view in views:
+            stacks, requests = self.merge(os.path.join(options['dir'], view))
+            if not stacks:
+                continue
+            self.report(view, stacks, requests, options['top'])
+            if options['folded']:
+                self.write_folded(options['folded'], view, stacks)
+            if options['speedscope']:
+                self.write_speedscope(options['speedscope'], view, stacks)
+
+    @staticmethod
+    def merge(directory):
+        stacks = Counter()
+        requests = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(PROFILE_SUFFIX):
+                    stacks.update(read_profile(entry.path))
+                    requests += 1
+        return stacks, requests
+
+    def report(self, view, stacks, requests, top):
+        total = sum(stacks.values())
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{view}: {requests} requests, {total} samples'))
+        for title, counter in (('self', own), ('total', inclusive)):
+            self.stdout.write(f'  top by {title} samples:')
+            for frame, count in counter.most_common(top):
+                self.stdout.write(
+                    f'    {count / total:6.1%} {count:8d}  {frame}')
+
+    @staticmethod
+    def write_folded(directory, view, stacks):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, view + PROFILE_SUFFIX),
+                  'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+    @staticmethod
+    def write_speedscope(directory, view, stacks):
+        frames = {}
+        samples = []
+        weights = []
+        for stack, count in stacks.most_common():
+            samples.append([frames.setdefault(frame, len(frames))
+                            for frame in stack.split(';')])
+            weights.append(count)
+        document = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': view,
+            'shared': {'frames': [{'name': name} for name in frames]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': view,
+                'unit': 'none',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'{view}.speedscope.json'),
+                  'w') as file:
+            json.dump(document, file)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.deletion import purge_deleted, remove_orphan_images
+
+
+class Command(BaseCommand):
+    help = ('Purge the soft-deleted recipes and users, and optionally '
+            'remove recipe images no recipe refers to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', action='store_true',
+                            help='Also remove orphaned recipe images.')
+        parser.add_argument('--hours', type=float, default=24,
+                            help='Only images older than this.')
+
+    def handle(self, *args, **options):
+        recipes = users = 0
+        done = False
+        while not done:
+            purged_recipes, purged_users, done = purge_deleted()
+            recipes += purged_recipes
+            users += purged_users
+        self.stdout.write(f'Purged {recipes} recipes and {users} users.')
+        if options['images']:
+            removed = remove_orphan_images(options['hours'] * 3600)
+            self.stdout.write(f'Removed {len(removed)} orphaned images.')
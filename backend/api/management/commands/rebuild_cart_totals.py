@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.services import expected_cart_totals
+from posts.models import CartIngredient
+
+
+class Command(BaseCommand):
+    help = ('Compare the shopping cart totals table with the carts '
+            'and rebuild the totals of users where they differ.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report the mismatches.')
+        parser.add_argument('--user', type=int, action='append',
+                            help='Limit to this user id (repeatable).')
+
+    def handle(self, *args, **options):
+        user_ids = options['user']
+        with transaction.atomic():
+            totals = CartIngredient.objects.select_for_update()
+            if user_ids is not None:
+                totals = totals.filter(user__in=user_ids)
+            stored = {(row.user_id, row.ingredient_id): row.amount
+                      for row in totals}
+            expected = expected_cart_totals(user_ids)
+            broken = sorted({
+                user_id for user_id, ingredient_id in stored.keys()
+                | expected.keys()
+                if stored.get((user_id, ingredient_id))
+                != expected.get((user_id, ingredient_id))})
+            self.stdout.write(
+                f'{len(broken)} users with mismatched totals'
+                + (f': {broken}' if broken else '.'))
+            if options['check'] or not broken:
+                return
+            CartIngredient.objects.filter(user__in=broken).delete()
+            CartIngredient.objects.bulk_create([
+                CartIngredient(user_id=user_id, ingredient_id=ingredient_id,
+                               amount=amount)
+                for (user_id, ingredient_id), amount in expected.items()
+                if user_id in broken])
+            self.stdout.write(f'Rebuilt totals of {len(broken)} users.')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.documents import rebuild_recipe_documents
+from posts.models import RecipeDocument
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed JSON documents of recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', type=int,
+                            help='Only the recipes of this user id.')
+        parser.add_argument('--missing', action='store_true',
+                            help='Only the recipes without a document '
+                                 '(at deploy).')
+
+    def handle(self, *args, **options):
+        lookups = {}
+        if options['author']:
+            lookups['author_id'] = options['author']
+        if options['missing']:
+            lookups['document__isnull'] = True
+        rebuild_recipe_documents(**lookups)
+        self.stdout.write(
+            f'{RecipeDocument.objects.count()} recipe documents.')
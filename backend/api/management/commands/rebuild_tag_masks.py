@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Recipe, Tag
+from posts.signals import update_tag_masks
+
+
+class Command(BaseCommand):
+    help = ('Assign bits to tags without one and recompute the tag masks '
+            'of all recipes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for tag in Tag.objects.filter(bit=None).order_by('pk'):
+                tag.save()
+                self.stdout.write(f'Tag {tag.slug}: bit {tag.bit}')
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        batch = options['batch']
+        for start in range(0, len(recipe_ids), batch):
+            with transaction.atomic():
+                update_tag_masks(recipe_ids[start:start + batch])
+        self.stdout.write(f'Updated tag masks of {len(recipe_ids)} recipes.')
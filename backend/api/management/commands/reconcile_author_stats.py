@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import User
+from posts.stats import refresh_author_stats
+
+
+class Command(BaseCommand):
+    help = ('Recount the author stats from the recipes, subscriptions and '
+            'favorites, and fix the rows which are missing or differ.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report the mismatches.')
+        parser.add_argument('--user', type=int, action='append',
+                            help='Limit to this user id (repeatable).')
+        parser.add_argument('--batch', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or list(User.objects.order_by(
+            'pk').values_list('pk', flat=True))
+        batch = options['batch']
+        broken = []
+        for start in range(0, len(user_ids), batch):
+            with transaction.atomic():
+                broken += refresh_author_stats(
+                    user_ids[start:start + batch], check=options['check'])
+        self.stdout.write(
+            f'{len(broken)} of {len(user_ids)} authors with missing or '
+            f'mismatched stats' + (f': {broken[:50]}' if broken else '.'))
+        if broken and not options['check']:
+            self.stdout.write('Fixed.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.throttling import get_store, shed_stats
+
+
+class Command(BaseCommand):
+    help = ('Show how many requests were rejected by the throttle (429) '
+            'and the concurrency limits (503), per action.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after printing.')
+
+    def handle(self, *args, **options):
+        stats = shed_stats()
+        if not stats:
+            self.stdout.write('No shed requests.')
+        for key, count in sorted(stats.items(), key=lambda item: -item[1]):
+            reason, action = key.split(':', 1)
+            self.stdout.write(f'{count:8d}  {reason:10s} {action}')
+        if options['reset']:
+            get_store().reset_shed()
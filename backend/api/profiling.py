@@ -0,0 +1,142 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+
+PROFILING_SETTINGS = {
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.005,
+    'DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    'HEADER': 'X-Profile',
+}
+PROFILING_SETTINGS.update(getattr(settings, 'PROFILING', {}))
+
+PROFILE_SUFFIX = '.folded'
+
+
+@lru_cache(maxsize=4096)
+def frame_name(code):
+    """module/path.py:qualname of a code object, relative to sys.path."""
+    filename = code.co_filename
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f'{filename}:{name}'.replace(';', ':')
+
+
+def collapse(frame, root=None):
+    """
+    Stack of a frame in collapsed format: root;...;leaf.
+    The walk stops at the root frame, if given.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame.f_code))
+        if frame is root:
+            break
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """
+    Statistical profiler of one thread: every interval seconds
+    records the current stack of the thread, up to the root frame.
+    Costs one sys._current_frames() call per sample, nothing in
+    the profiled thread.
+    """
+    def __init__(self, thread_id, interval, root=None):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or self._stop_event.is_set():
+                continue
+            self.stacks[collapse(frame, self.root)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.root = None
+        return self.stacks
+
+
+def wants_profile(request):
+    """
+    Profile a random SAMPLE_RATE share of requests, and requests of
+    superusers sending the profiling header.
+    """
+    if request.headers.get(PROFILING_SETTINGS['HEADER']):
+        return request.user.is_superuser
+    rate = PROFILING_SETTINGS['SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def write_profile(view_name, stacks):
+    """Store collapsed stacks under DIR/<view name>/. Returns the path."""
+    directory = os.path.join(PROFILING_SETTINGS['DIR'], view_name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f'{time.time_ns()}-{os.getpid()}{PROFILE_SUFFIX}')
+    with open(path, 'w') as file:
+        for stack, count in stacks.items():
+            file.write(f'{stack} {count}\n')
+    return path
+
+
+def read_profile(path):
+    stacks = Counter()
+    with open(path) as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+class ProfiledViewMixin:
+    """
+    Viewset mixin running a StackSampler around the handler of
+    the selected requests (see wants_profile). Each profile is written
+    to PROFILING['DIR']/<ViewSet>.<action>/ in collapsed stack format
+    (flamegraph.pl, speedscope); the profile_report command aggregates
+    them. Profiled responses carry the file name in X-Profile-File.
+    """
+    _sampler = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Started once the user is authenticated; stacks are cut at
+        # the dispatch() frame calling initial().
+        if wants_profile(request):
+            self._sampler = StackSampler(threading.get_ident(),
+                                         PROFILING_SETTINGS['INTERVAL'],
+                                         root=sys._getframe(1))
+            self._sampler.start()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if self._sampler is not None:
+            stacks = self._sampler.stop()
+            self._sampler = None
+            view_name = '{}.{}'.format(
+                type(self).__name__,
+                getattr(self, 'action', None) or request.method.lower())
+            path = write_profile(view_name, stacks)
+            response['X-Profile-File'] = os.path.relpath(
+                path, PROFILING_SETTINGS['DIR'])
+        return response
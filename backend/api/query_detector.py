@@ -0,0 +1,227 @@
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+from api import fast_serializers
+
+QUERY_DETECTOR_SETTINGS = {
+    'ENABLED': False,
+    'THRESHOLD': 3,
+    'REPORT_DIR': os.path.join(settings.BASE_DIR, 'query_reports'),
+}
+QUERY_DETECTOR_SETTINGS.update(getattr(settings, 'QUERY_DETECTOR', {}))
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER = re.compile(r'%s|\?')
+PLACEHOLDER_LIST = re.compile(r'\(\?(?:, \?)*\)')
+WHITESPACE = re.compile(r'\s+')
+
+PROJECT_ROOT = str(settings.BASE_DIR)
+# Project modules which only pass the query through.
+SKIPPED_FILES = {__file__, fast_serializers.__file__}
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """SQL with literals and placeholder lists replaced by ?."""
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def describe_stack(frame):
+    """
+    (serializer field, project code location) of the query issued
+    from frame. The field is the innermost serializer field (also as
+    the field local of the compiled serializer getters) or get_<field>
+    method of a serializer on the stack. The location falls back to
+    the skipped project modules.
+    """
+    field = location = fallback = None
+    while frame is not None and (field is None or location is None):
+        code = frame.f_code
+        if (location is None and code.co_filename.startswith(PROJECT_ROOT)
+                and 'site-packages' not in code.co_filename):
+            here = '{}:{} {}'.format(
+                os.path.relpath(code.co_filename, PROJECT_ROOT),
+                frame.f_lineno, code.co_name)
+            if code.co_filename not in SKIPPED_FILES:
+                location = here
+            elif fallback is None and code.co_filename != __file__:
+                fallback = here
+        if field is None:
+            owner = frame.f_locals.get('self')
+            if not isinstance(owner, serializers.Field):
+                owner = frame.f_locals.get('field')
+            if (isinstance(owner, serializers.BaseSerializer)
+                    and code.co_name.startswith('get_')
+                    and code.co_name not in ('get_attribute', 'get_fields')):
+                field = f'{type(owner).__name__}.{code.co_name[4:]}'
+            elif (isinstance(owner, serializers.Field)
+                    and getattr(owner, 'field_name', None)
+                    and owner.parent is not None):
+                field = f'{type(owner.parent).__name__}.{owner.field_name}'
+        frame = frame.f_back
+    return field, location or fallback
+
+
+class QueryRecorder:
+    """
+    Context manager recording the queries executed on all database
+    connections, with their fingerprint and origin:
+
+        with QueryRecorder() as recorder:
+            client.get('/api/recipes/')
+        recorder.problems()
+    """
+    def __init__(self, threshold=None):
+        self.threshold = threshold or QUERY_DETECTOR_SETTINGS['THRESHOLD']
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        field, location = describe_stack(sys._getframe(1))
+        self.queries.append({
+            'sql': sql,
+            'params': repr(params),
+            'fingerprint': fingerprint(sql),
+            'field': field,
+            'location': location,
+        })
+        return execute(sql, params, many, context)
+
+    def problems(self):
+        """
+        Fingerprints executed more than threshold times from the same
+        origin (N+1) and identical queries executed more than once
+        (duplicates).
+        """
+        groups = defaultdict(list)
+        for query in self.queries:
+            groups[(query['fingerprint'], query['field'],
+                    query['location'])].append(query)
+        found = []
+        for (sql, field, location), queries in groups.items():
+            duplicates = Counter(
+                (query['sql'], query['params']) for query in queries)
+            repeated = sum(count - 1 for count in duplicates.values())
+            if len(queries) > self.threshold:
+                kind = 'n+1'
+            elif repeated:
+                kind = 'duplicate'
+            else:
+                continue
+            found.append({
+                'kind': kind,
+                'count': len(queries),
+                'duplicates': repeated,
+                'field': field,
+                'location': location,
+                'fingerprint': sql,
+            })
+        return sorted(found, key=lambda problem: -problem['count'])
+
+    def report(self):
+        lines = [f'{len(self.queries)} queries']
+        for problem in self.problems():
+            lines.append(
+                '{kind}: {count} queries ({duplicates} duplicates) from '
+                '{field} at {location}\n    {fingerprint}'.format(
+                    **problem))
+        return '\n'.join(lines)
+
+
+class QueryDetectorMixin:
+    """
+    TestCase mixin:
+
+        with self.assertNoNPlusOne():
+            self.client.get('/api/recipes/')
+    """
+    def assertNoNPlusOne(self, threshold=None, allow_duplicates=False):
+        return _AssertNoNPlusOne(threshold, allow_duplicates)
+
+
+class _AssertNoNPlusOne(QueryRecorder):
+    def __init__(self, threshold, allow_duplicates):
+        super().__init__(threshold)
+        self.allow_duplicates = allow_duplicates
+
+    def __exit__(self, exc_type, *exc_info):
+        super().__exit__(exc_type, *exc_info)
+        if exc_type is not None:
+            return
+        problems = [problem for problem in self.problems()
+                    if problem['kind'] == 'n+1'
+                    or not self.allow_duplicates]
+        if problems:
+            raise NPlusOneError(self.report())
+
+
+def no_n_plus_one(threshold=None, allow_duplicates=False):
+    """Decorator failing a test which issues N+1 or duplicate queries."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _AssertNoNPlusOne(threshold, allow_duplicates):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class QueryDetectorMiddleware:
+    """
+    Staging middleware: records the queries of every request and
+    writes a JSON report to QUERY_DETECTOR['REPORT_DIR'] for requests
+    with N+1 or duplicate queries. Not meant for production workers:
+    every query walks the Python stack.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        problems = recorder.problems()
+        if problems:
+            self.write_report(request, response, recorder, problems)
+        return response
+
+    @staticmethod
+    def write_report(request, response, recorder, problems):
+        directory = QUERY_DETECTOR_SETTINGS['REPORT_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f'{time.time_ns()}-{os.getpid()}.json')
+        with open(path, 'w') as file:
+            json.dump({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'queries': len(recorder.queries),
+                'problems': problems,
+            }, file, indent=2)
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.exceptions import ValidationError
-from django.shortcuts import get_object_or_404
+from django.db import transaction
 
+from api.fast_serializers import CompiledSerializerMixin
+from api.fieldsets import SparseFieldsMixin
+from api.services import update_cart_totals
 from posts.models import (Recipe, Ingredient,
                           Tag, IngredientRecipe,
                           ShoppingCart, Favorite)
@@ -49,7 +52,16 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    """Serializer for the list of recipe ids used by bulk actions."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100)
+
+
+class IngredientSerializer(CompiledSerializerMixin,
+                           serializers.ModelSerializer):
     """Serializer for the Ingredient model."""
     class Meta:
         model = Ingredient
@@ -57,7 +69,8 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = '__all__',
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(CompiledSerializerMixin,
+                    serializers.ModelSerializer):
     """Serializer for the Tag model."""
     class Meta:
         model = Tag
@@ -65,7 +78,8 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = '__all__',
 
 
-class IngredientRecipeSerializer(serializers.ModelSerializer):
+class IngredientRecipeSerializer(CompiledSerializerMixin,
+                                 serializers.ModelSerializer):
     """Serializer for the intermediate model linking Recipe and Ingredient."""
     id = serializers.ReadOnlyField(
         source='ingredient.id')
@@ -79,12 +93,18 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(SparseFieldsMixin, CompiledSerializerMixin,
+                           serializers.ModelSerializer):
     """
     Serializer for reading Recipe data.
     Includes flags for whether the recipe is favorited or in the shopping cart.
     Also returns the list of ingredients with their amounts from the intermediate model.
+    Supports ?fields=, ?omit= and ?fieldset=card (api.fieldsets).
     """
+    FIELDSETS = {
+        'card': ('id', 'name', 'image', 'cooking_time', 'tags'),
+    }
+
     author = UserSerializer()
     tags = TagSerializer(
         many=True,
@@ -103,12 +123,16 @@ class RecipeListSerializer(serializers.ModelSerializer):
                   'name', 'image', 'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if not user.is_anonymous:
             return Favorite.objects.filter(recipe=obj, author=user).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if not user.is_anonymous:
             return ShoppingCart.objects.filter(recipe=obj, author=user).exists()
@@ -152,7 +176,8 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 {'ingredients': 'At least one ingredient must be selected!'})
         ingredients_list = []
         for item in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
+            # Already an Ingredient (PrimaryKeyRelatedField).
+            ingredient = item['id']
             if ingredient in ingredients_list:
                 raise ValidationError(
                     {'ingredients': 'Ingredients must not be duplicated!'})
@@ -175,6 +200,17 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             tags_list.append(tag)
         return value
 
+    def validate(self, attrs):
+        name = attrs.get('name', getattr(self.instance, 'name', None))
+        author = self.instance.author if self.instance else attrs['author']
+        recipes = Recipe.objects.filter(author=author, name=name)
+        if self.instance is not None:
+            recipes = recipes.exclude(pk=self.instance.pk)
+        if recipes.exists():
+            raise ValidationError(
+                {'name': 'The author already has a recipe with this name.'})
+        return attrs
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['ingredients'] = IngredientRecipeSerializer(
@@ -200,12 +236,18 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.recipe_ingredients.all().delete()
-        self.add_tags_ingredients(ingredients, tags, instance)
-        return super().update(instance, validated_data)
-
-
-class RecipeMiniSerializer(serializers.ModelSerializer):
+        with transaction.atomic():
+            # Keep the shopping cart totals of users having this recipe
+            # in the cart in step with the new ingredients.
+            update_cart_totals([instance.pk], -1)
+            instance.recipe_ingredients.all().delete()
+            self.add_tags_ingredients(ingredients, tags, instance)
+            update_cart_totals([instance.pk], 1)
+            return super().update(instance, validated_data)
+
+
+class RecipeMiniSerializer(CompiledSerializerMixin,
+                           serializers.ModelSerializer):
     """Serializer used for displaying recipes in FollowSerializer."""
     class Meta:
         model = Recipe
@@ -1,28 +1,364 @@
-from django.db.models import Sum
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Sum
 from datetime import date
 from django.http import HttpResponse
 
-from posts.models import IngredientRecipe
+from api import bus, write_behind
+from posts.models import (CartIngredient, Favorite, Follow,
+                          IngredientRecipe, Recipe, ShoppingCart)
+from posts.stats import change_favorites_received
+from users.models import User
+
+ADDED = 'added'
+ALREADY_ADDED = 'already_added'
+REMOVED = 'removed'
+NOT_FOUND = 'not_found'
+
+# Recipe columns left out of the query when not requested.
+LARGE_RECIPE_COLUMNS = ('text', 'image')
 
 
 def shopping_cart(self, request, author):
     """Downloading shop-list"""
-    sum_ingredients_in_recipes = IngredientRecipe.objects.filter(
-        recipe__shopping_cart__author=author
-    ).values(
-        'ingredient__name', 'ingredient__measurement_unit'
-    ).annotate(
-        amounts=Sum('amount', distinct=True)).order_by('amounts')
+    # NumPy is imported on the first download, not at worker start.
+    from api.shopping_list import aggregate, format_lines
+
+    rows = list(CartIngredient.objects.filter(user=author).values_list(
+        'ingredient_id', 'amount'))
+    ingredient_ids, amounts = zip(*rows) if rows else ((), ())
     today = date.today().strftime("%d-%m-%Y")
-    shopping_list = f'Список покупок на: {today}\n\n'
-    for ingredient in sum_ingredients_in_recipes:
-        shopping_list += (
-            f'{ingredient["ingredient__name"]} - '
-            f'{ingredient["amounts"]} '
-            f'{ingredient["ingredient__measurement_unit"]}\n'
-        )
-    shopping_list += '\n\nFoodgram (2022)'
-    filename = 'shopping_list.txt'
-    response = HttpResponse(shopping_list, content_type='text/plain')
+    shopping_list = (
+        f'Список покупок на: {today}\n\n'
+        + ''.join(format_lines(aggregate(ingredient_ids, amounts)))
+        + '\n\nFoodgram (2022)'
+    )
+    return export_response(shopping_list, 'shopping_list.txt')
+
+
+def export_response(content, filename):
+    """
+    Response with a generated text file.
+    With settings.ACCEL_REDIRECT the file is written to EXPORTS_ROOT
+    (named by content hash, so unchanged exports are reused) and
+    nginx sends it via X-Accel-Redirect.
+    """
+    if settings.ACCEL_REDIRECT:
+        data = content.encode()
+        name = hashlib.sha256(data).hexdigest() + '.txt'
+        path = os.path.join(settings.EXPORTS_ROOT, name)
+        if not os.path.exists(path):
+            os.makedirs(settings.EXPORTS_ROOT, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        response = HttpResponse(content_type='text/plain')
+        response['X-Accel-Redirect'] = settings.EXPORTS_ACCEL_URL + name
+    else:
+        response = HttpResponse(content, content_type='text/plain')
     response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
+
+
+def annotate_is_subscribed(users, user):
+    """Annotate users with is_subscribed for the current user."""
+    if user.is_anonymous:
+        return users
+    return users.annotate(is_subscribed=Exists(
+        Follow.objects.filter(user=user, author=OuterRef('pk'))))
+
+
+def recipes_for_reading(recipes, user, fields=None):
+    """
+    Recipes with everything RecipeListSerializer needs:
+    prefetched tags, ingredients and author (with is_subscribed),
+    and is_favorited / is_in_shopping_cart annotations.
+    With a set of requested fields only these are fetched.
+    """
+    def wanted(name):
+        return fields is None or name in fields
+
+    lookups = []
+    if wanted('tags'):
+        lookups.append('tags')
+    if wanted('ingredients'):
+        lookups.append('recipe_ingredients__ingredient')
+    if wanted('author'):
+        lookups.append(Prefetch('author', queryset=annotate_is_subscribed(
+            User.objects.all(), user)))
+    recipes = recipes.prefetch_related(*lookups)
+    unwanted_columns = [name for name in LARGE_RECIPE_COLUMNS
+                        if not wanted(name)]
+    if unwanted_columns:
+        recipes = recipes.defer(*unwanted_columns)
+    if user.is_anonymous:
+        return recipes
+    annotations = {}
+    flags = write_behind.list_flags(user)
+    if wanted('is_favorited'):
+        annotations['is_favorited'] = flags[Favorite]
+    if wanted('is_in_shopping_cart'):
+        annotations['is_in_shopping_cart'] = flags[ShoppingCart]
+    return recipes.annotate(**annotations)
+
+
+def _unique_ids(recipe_ids):
+    """Drop duplicated ids, keeping the order of the request."""
+    return list(dict.fromkeys(recipe_ids))
+
+
+def insert_list_rows(model, author, recipe_ids):
+    """
+    Insert recipes into a user list in one transaction, with the cart
+    totals, author stats and bus event. Returns the ids of the existing
+    recipes and of those already in the list.
+    """
+    with transaction.atomic():
+        existing = set(Recipe.objects.filter(
+            id__in=recipe_ids).values_list('id', flat=True))
+        inserted = insert_list_entries(
+            model, author.pk, [recipe_id for recipe_id in recipe_ids
+                               if recipe_id in existing])
+        if model is ShoppingCart and inserted:
+            update_cart_totals(inserted, 1, author.pk)
+        if model is Favorite:
+            change_favorites_received(inserted, 1)
+        if inserted:
+            bus.publish(model._meta.label_lower, [author.pk])
+    return existing, existing.difference(inserted)
+
+
+def delete_list_rows(model, author, recipe_ids):
+    """
+    Delete recipes from a user list with one delete, with the cart
+    totals, author stats and bus event. Returns the ids removed.
+    """
+    with transaction.atomic():
+        removed = set(delete_list_entries(model, author.pk, recipe_ids))
+        if model is ShoppingCart and removed:
+            update_cart_totals(removed, -1, author.pk)
+        if model is Favorite:
+            change_favorites_received(removed, -1)
+        if removed:
+            bus.publish(model._meta.label_lower, [author.pk])
+    return removed
+
+
+def bulk_add_recipes(model, author, recipe_ids):
+    """
+    Add several recipes to a user list (favorites, shopping cart)
+    in one transaction, or to the write-behind journal.
+    Returns per-recipe results.
+    """
+    recipe_ids = _unique_ids(recipe_ids)
+    if write_behind.enabled():
+        existing = set(Recipe.objects.filter(
+            id__in=recipe_ids).values_list('id', flat=True))
+        already = write_behind.listed(model, author.pk, existing)
+        write_behind.journal_changes(
+            model, author.pk, [recipe_id for recipe_id in recipe_ids
+                               if recipe_id in existing], 1)
+    else:
+        existing, already = insert_list_rows(model, author, recipe_ids)
+    results = []
+    for recipe_id in recipe_ids:
+        if recipe_id not in existing:
+            result = NOT_FOUND
+        elif recipe_id in already:
+            result = ALREADY_ADDED
+        else:
+            result = ADDED
+        results.append({'id': recipe_id, 'status': result})
+    return results
+
+
+def bulk_remove_recipes(model, author, recipe_ids):
+    """
+    Remove several recipes from a user list (favorites, shopping cart)
+    with one filtered delete, or through the write-behind journal.
+    Returns per-recipe results.
+    """
+    recipe_ids = _unique_ids(recipe_ids)
+    if write_behind.enabled():
+        removed = set(write_behind.journal_changes(
+            model, author.pk, recipe_ids, -1))
+    else:
+        removed = delete_list_rows(model, author, recipe_ids)
+    return [{'id': recipe_id,
+             'status': REMOVED if recipe_id in removed else NOT_FOUND}
+            for recipe_id in recipe_ids]
+
+
+def create_if_absent(model, **values):
+    """
+    Insert a row with INSERT ... ON CONFLICT DO NOTHING, relying on
+    the model unique constraints instead of a preliminary exists().
+    Values are passed by column attname (author_id=..., recipe_id=...).
+    Returns True if the row was created.
+    """
+    opts = model._meta
+    fields = [opts.get_field(name) for name in values]
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING'.format(
+        quote_name(opts.db_table),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+    params = [field.get_db_prep_save(value, connection)
+              for field, value in zip(fields, values.values())]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
+
+
+def _list_columns(model):
+    quote_name = connection.ops.quote_name
+    opts = model._meta
+    return (quote_name(opts.db_table),
+            quote_name(opts.get_field('author').column),
+            quote_name(opts.get_field('recipe').column))
+
+
+def insert_list_entries(model, author_id, recipe_ids):
+    """
+    Insert recipes into a user list with INSERT ... ON CONFLICT DO
+    NOTHING RETURNING. Returns the ids of the rows actually inserted:
+    not those already there or inserted meanwhile by a concurrent
+    request, so the totals and counters change once per row.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return []
+    table, author, recipe = _list_columns(model)
+    sql = ('INSERT INTO {table} ({author}, {recipe}) VALUES {rows} '
+           'ON CONFLICT DO NOTHING RETURNING {recipe}').format(
+        table=table, author=author, recipe=recipe,
+        rows=', '.join(['(%s, %s)'] * len(recipe_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for recipe_id in recipe_ids
+                             for value in (author_id, recipe_id)])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_list_entries(model, author_id, recipe_ids):
+    """
+    Delete recipes from a user list with DELETE ... RETURNING. Returns
+    the ids of the rows actually deleted: a row deleted meanwhile by a
+    concurrent request is not returned.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return []
+    table, author, recipe = _list_columns(model)
+    sql = ('DELETE FROM {table} WHERE {author} = %s AND {recipe} IN '
+           '({ids}) RETURNING {recipe}').format(
+        table=table, author=author, recipe=recipe,
+        ids=', '.join(['%s'] * len(recipe_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [author_id, *recipe_ids])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def add_to_list(model, author, recipe_id):
+    """
+    Add a recipe to a user list (favorites, shopping cart).
+    Returns False if it is already there.
+    """
+    if write_behind.enabled():
+        return bool(write_behind.journal_changes(
+            model, author.pk, [int(recipe_id)], 1))
+    with transaction.atomic():
+        created = create_if_absent(model, author_id=author.pk,
+                                   recipe_id=recipe_id)
+        if created and model is ShoppingCart:
+            update_cart_totals([recipe_id], 1, author.pk)
+        if created and model is Favorite:
+            change_favorites_received([recipe_id], 1)
+        if created:
+            bus.publish(model._meta.label_lower, [author.pk])
+    return created
+
+
+def remove_from_list(model, author, recipe_id):
+    """
+    Remove a recipe from a user list (favorites, shopping cart).
+    Returns False if it was not there.
+    """
+    if write_behind.enabled():
+        return bool(write_behind.journal_changes(
+            model, author.pk, [int(recipe_id)], -1))
+    with transaction.atomic():
+        deleted = delete_list_entries(model, author.pk, [recipe_id])
+        if deleted and model is ShoppingCart:
+            update_cart_totals(deleted, -1, author.pk)
+        if deleted and model is Favorite:
+            change_favorites_received([recipe_id], -1)
+        if deleted:
+            bus.publish(model._meta.label_lower, [author.pk])
+    return bool(deleted)
+
+
+def update_cart_totals(recipe_ids, sign, user_id=None):
+    """
+    Add (sign=1) or subtract (sign=-1) the ingredient amounts of recipes
+    to / from the CartIngredient totals of every user having them in
+    the shopping cart, or of user_id only.
+    For every user it must run while the ShoppingCart rows exist: after
+    inserting them, before deleting them. For user_id, recipe_ids are
+    the rows just inserted into / deleted from the cart (as returned
+    by insert_list_entries / delete_list_entries), so it runs after
+    the write and a concurrent request changing the same row does not
+    count it twice.
+    """
+    quote_name = connection.ops.quote_name
+    totals = quote_name(CartIngredient._meta.db_table)
+    recipe_ids = list(recipe_ids)
+    if user_id is None:
+        rows = (
+            'SELECT cart.author_id, item.ingredient_id, '
+            '%s * SUM(item.amount) '
+            'FROM {items} item JOIN {cart} cart '
+            'ON cart.recipe_id = item.recipe_id '
+            'WHERE item.recipe_id IN ({recipes}) '
+            'GROUP BY cart.author_id, item.ingredient_id')
+        params = [sign, *recipe_ids]
+    else:
+        rows = (
+            'SELECT %s, item.ingredient_id, %s * SUM(item.amount) '
+            'FROM {items} item '
+            'WHERE item.recipe_id IN ({recipes}) '
+            'GROUP BY item.ingredient_id')
+        params = [user_id, sign, *recipe_ids]
+    sql = (
+        'INSERT INTO {totals} (user_id, ingredient_id, amount) ' + rows
+        + ' ON CONFLICT (user_id, ingredient_id) '
+        'DO UPDATE SET amount = {totals}.amount + EXCLUDED.amount'
+    ).format(
+        totals=totals,
+        items=quote_name(IngredientRecipe._meta.db_table),
+        cart=quote_name(ShoppingCart._meta.db_table),
+        recipes=', '.join(['%s'] * len(recipe_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+    if sign < 0:
+        empty = CartIngredient.objects.filter(amount__lte=0)
+        if user_id is not None:
+            empty = empty.filter(user_id=user_id)
+        empty.delete()
+
+
+def expected_cart_totals(user_ids=None):
+    """(user_id, ingredient_id) -> amount computed from the carts."""
+    items = IngredientRecipe.objects.filter(
+        recipe__shopping_cart__isnull=False)
+    if user_ids is not None:
+        items = items.filter(recipe__shopping_cart__author__in=user_ids)
+    return {
+        (row['recipe__shopping_cart__author'], row['ingredient']):
+            row['total']
+        for row in items.values(
+            'recipe__shopping_cart__author', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by()}
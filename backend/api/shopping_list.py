@@ -0,0 +1,248 @@
+"""
+Aggregation of the shopping list across measurement units.
+
+Ingredient.measurement_unit is free text, so the same product may come
+in grams from one ingredient row and in kilograms from another. Each
+unit is converted to the base unit of its measure (grams, millilitres,
+pieces) through the conversion table, the amounts are summed per
+product and measure with a NumPy group-by, and every total is shown in
+the largest unit it makes at least one of (1500 г -> 1.5 кг). A product
+only in a unit that is not an output unit (стакан, ч. л.) stays in it.
+Units missing from the table are summed only with the same unit;
+"по вкусу" is listed once, without an amount.
+
+The string work is done once per process: the conversion table is
+compiled on first use, and the ingredient catalog holds the product,
+measure and factor of every ingredient in arrays indexed by id, so a
+cart is two integer columns (ingredient id, amount). The catalog is
+dropped on Ingredient events of the invalidation bus, and reloaded when
+a cart has an ingredient it does not know. More units can be added with
+settings.SHOPPING_LIST['UNITS'], as {unit: (measure, factor)}.
+"""
+import threading
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from api import bus
+from posts.models import Ingredient
+
+SHOPPING_LIST_SETTINGS = {
+    'UNITS': {},
+}
+SHOPPING_LIST_SETTINGS.update(getattr(settings, 'SHOPPING_LIST', {}))
+
+MASS = 'mass'
+VOLUME = 'volume'
+COUNT = 'count'
+TO_TASTE = 'to taste'
+
+# unit: (measure, amount of the base unit in one unit)
+UNITS = {
+    'мг': (MASS, 0.001),
+    'г': (MASS, 1),
+    'гр': (MASS, 1),
+    'грамм': (MASS, 1),
+    'кг': (MASS, 1000),
+    'мл': (VOLUME, 1),
+    'л': (VOLUME, 1000),
+    'капля': (VOLUME, 0.05),
+    'ч. л.': (VOLUME, 5),
+    'чайная ложка': (VOLUME, 5),
+    'ст. л.': (VOLUME, 15),
+    'столовая ложка': (VOLUME, 15),
+    'стакан': (VOLUME, 250),
+    'шт.': (COUNT, 1),
+    'штука': (COUNT, 1),
+    'десяток': (COUNT, 10),
+    'по вкусу': (TO_TASTE, 0),
+}
+
+# Units of the list, smallest first, for each measure.
+OUTPUT_UNITS = {
+    MASS: (('г', 1), ('кг', 1000)),
+    VOLUME: (('мл', 1), ('л', 1000)),
+    COUNT: (('шт.', 1),),
+    TO_TASTE: (('по вкусу', 1),),
+}
+
+
+def normalize_unit(unit):
+    """'Ч.Л.', 'ч. л.' and 'ч л' are the same unit."""
+    return ' '.join(unit.lower().replace('.', ' ').split())
+
+
+def normalize_name(name):
+    return ' '.join(name.lower().split())
+
+
+class ConversionTable:
+    """Units by their normalized spelling, with measures as codes."""
+    def __init__(self, units, output_units):
+        self.measures = list(output_units)
+        self.output_units = [output_units[measure]
+                             for measure in self.measures]
+        self.units = {
+            normalize_unit(unit): (self.measures.index(measure), factor)
+            for unit, (measure, factor) in units.items()}
+        self.listed = {normalize_unit(unit)
+                       for ladder in self.output_units for unit, _ in ladder}
+        self.to_taste = self.measures.index(TO_TASTE)
+
+
+@lru_cache(maxsize=None)
+def conversion_table():
+    return ConversionTable({**UNITS, **SHOPPING_LIST_SETTINGS['UNITS']},
+                           OUTPUT_UNITS)
+
+
+class IngredientCatalog:
+    """
+    Product, measure, factor and unit of every ingredient, in arrays
+    indexed by ingredient id. Products are numbered in the order of
+    their names; each unknown unit is a measure of its own, numbered
+    after the measures of the table.
+    """
+    def __init__(self, ingredients, table):
+        ingredients = sorted(ingredients)
+        size = ingredients[-1][0] + 1 if ingredients else 0
+        self.table = table
+        self.known = np.zeros(size, dtype=bool)
+        self.product = np.zeros(size, dtype=np.int64)
+        self.measure = np.zeros(size, dtype=np.int64)
+        self.factor = np.zeros(size, dtype=np.float64)
+        self.unit = np.zeros(size, dtype=np.int64)
+
+        products = {}
+        for _, name, _ in ingredients:
+            products.setdefault(normalize_name(name), name)
+        keys = sorted(products)
+        self.names = [products[key] for key in keys]
+        product_codes = {key: code for code, key in enumerate(keys)}
+
+        self.output_units = list(table.output_units)
+        self.units = []
+        conversions = []
+        unit_codes = {}
+        for pk, name, unit in ingredients:
+            if unit not in unit_codes:
+                unit_codes[unit] = len(self.units)
+                self.units.append(unit)
+                conversions.append(self.convert(unit))
+            code = unit_codes[unit]
+            self.known[pk] = True
+            self.product[pk] = product_codes[normalize_name(name)]
+            self.unit[pk] = code
+            self.measure[pk], self.factor[pk], _ = conversions[code]
+        self.unit_factors = np.array(
+            [factor for _, factor, _ in conversions], dtype=np.float64)
+        self.listed = np.array(
+            [listed for _, _, listed in conversions], dtype=bool)
+
+    def convert(self, unit):
+        """Measure code, factor and whether it is one of the output units."""
+        key = normalize_unit(unit)
+        if key in self.table.units:
+            measure, factor = self.table.units[key]
+            return measure, factor, key in self.table.listed
+        for code, ladder in enumerate(self.output_units):
+            if normalize_unit(ladder[0][0]) == key:
+                return code, 1, True
+        self.output_units.append(((unit, 1),))
+        return len(self.output_units) - 1, 1, True
+
+    def has(self, ingredient_ids):
+        return bool(
+            not len(ingredient_ids)
+            or ingredient_ids.max() < len(self.known)
+            and self.known[ingredient_ids].all())
+
+    def aggregate(self, ingredient_ids, amounts):
+        """
+        Sum the amounts per product and measure. Returns (name, amount,
+        unit) sorted by name; amount is None for "по вкусу".
+        """
+        if not len(ingredient_ids):
+            return []
+        measure_count = len(self.output_units)
+        keys = (self.product[ingredient_ids] * measure_count
+                + self.measure[ingredient_ids])
+        groups, first, group_index = np.unique(
+            keys, return_index=True, return_inverse=True)
+        totals = np.bincount(
+            group_index, weights=amounts * self.factor[ingredient_ids],
+            minlength=len(groups))
+        group_measures = groups % measure_count
+
+        unit_names = np.empty(len(groups), dtype=object)
+        divisors = np.ones(len(groups))
+        for code in np.unique(group_measures).tolist():
+            in_measure = group_measures == code
+            ladder = self.output_units[code]
+            unit_names[in_measure], divisors[in_measure] = ladder[0]
+            for unit, factor in ladder[1:]:
+                larger = in_measure & (totals >= factor)
+                unit_names[larger], divisors[larger] = unit, factor
+        # A product in one unit that is not an output unit stays in it.
+        units = self.unit[ingredient_ids]
+        first_unit = units[first]
+        mixed = np.bincount(
+            group_index, weights=units != first_unit[group_index],
+            minlength=len(groups)) > 0
+        kept = ~mixed & ~self.listed[first_unit]
+        unit_names[kept] = [self.units[code]
+                            for code in first_unit[kept].tolist()]
+        divisors[kept] = self.unit_factors[first_unit[kept]]
+
+        shown = np.round(totals / divisors, 2)
+        to_taste = group_measures == self.table.to_taste
+        return [
+            (self.names[product], None if taste else amount, unit)
+            for product, amount, unit, taste in zip(
+                (groups // measure_count).tolist(), shown.tolist(),
+                unit_names.tolist(), to_taste.tolist())]
+
+
+catalog_lock = threading.Lock()
+catalog = None
+
+
+def ingredient_catalog(ingredient_ids=()):
+    """The cached catalog, reloaded if it misses any of the ids."""
+    global catalog
+    with catalog_lock:
+        if catalog is None or not catalog.has(ingredient_ids):
+            catalog = IngredientCatalog(
+                Ingredient.objects.values_list(
+                    'pk', 'name', 'measurement_unit'),
+                conversion_table())
+        return catalog
+
+
+def drop_catalog(keys):
+    """Ingredient events of the invalidation bus (see api.bus)."""
+    global catalog
+    catalog = None
+
+
+bus.register(Ingredient._meta.label_lower, drop_catalog)
+
+
+def aggregate(ingredient_ids, amounts):
+    """Shopping list lines of the (ingredient id, amount) columns."""
+    ingredient_ids = np.asarray(ingredient_ids, dtype=np.int64)
+    return ingredient_catalog(ingredient_ids).aggregate(
+        ingredient_ids, np.asarray(amounts, dtype=np.float64))
+
+
+def format_amount(amount):
+    return f'{amount:.2f}'.rstrip('0').rstrip('.')
+
+
+def format_lines(items):
+    for name, amount, unit in items:
+        if amount is None:
+            yield f'{name} - {unit}\n'
+        else:
+            yield f'{name} - {format_amount(amount)} {unit}\n'
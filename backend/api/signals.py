@@ -0,0 +1,178 @@
+from django.conf import settings
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import bus
+from api.authentication import invalidate_token, invalidate_user, token_cache
+from api.changes import record_recipe_changes
+from api.documents import rebuild_recipe_documents
+from posts.models import Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import User
+
+# The user fields shown as the recipe author (UserSerializer).
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver(post_delete, sender=Token)
+def drop_deleted_token(sender, instance, **kwargs):
+    """Logout (djoser token destroy) and any other token removal."""
+    invalidate_token(instance.key)
+    bus.publish(Token._meta.label_lower, [instance.key])
+
+
+@receiver(post_save, sender=User)
+def drop_user_tokens(sender, instance, created, **kwargs):
+    """Password change, deactivation and other profile updates."""
+    if not created:
+        invalidate_user(instance.pk)
+        bus.publish(User._meta.label_lower, [instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def publish_change(sender, instance, **kwargs):
+    bus.publish(sender._meta.label_lower, [instance.pk])
+
+
+def drop_cached_tokens(keys):
+    """Token cache of the other workers (see api.bus)."""
+    if keys is None:
+        token_cache.clear()
+        return
+    for key in keys:
+        token_cache.delete(key)
+
+
+def drop_cached_users(user_ids):
+    if user_ids is None:
+        token_cache.clear()
+        return
+    for user_id in user_ids:
+        drop_cached_tokens(Token.objects.filter(
+            user_id=user_id).values_list('key', flat=True))
+
+
+bus.register(Token._meta.label_lower, drop_cached_tokens)
+bus.register(User._meta.label_lower, drop_cached_users)
+
+
+@receiver(pre_save, sender=User)
+def reload_cached_user(sender, instance, update_fields, **kwargs):
+    """
+    A user built from a token cache snapshot (api.authentication) may
+    be stale: the fields the request has not changed since are reloaded
+    before they are written back.
+    """
+    snapshot = instance.__dict__.pop('_token_snapshot', None)
+    if snapshot is None:
+        return
+    fields = [field.attname for field in User._meta.concrete_fields
+              if not field.primary_key
+              and (update_fields is None or field.name in update_fields)
+              and field.attname in snapshot
+              and instance.__dict__[field.attname] == snapshot[field.attname]]
+    if fields:
+        instance.refresh_from_db(fields=fields)
+
+
+@receiver(pre_save, sender=User)
+def note_author_change(sender, instance, update_fields, **kwargs):
+    """
+    Whether the save changes the author data shown in the recipes,
+    for the post_save receivers below (not password or login updates).
+    """
+    fields = [field for field in AUTHOR_FIELDS
+              if update_fields is None or field in update_fields]
+    stored = None
+    if fields and not instance._state.adding:
+        stored = User.all_objects.filter(pk=instance.pk).values_list(
+            *fields).first()
+    instance._author_changed = stored is not None and stored != tuple(
+        getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=User)
+def rebuild_author_documents(sender, instance, **kwargs):
+    """The author data is part of the recipe documents."""
+    if not instance._author_changed:
+        return
+    if settings.RECIPE_DOCUMENTS and instance.recipe.exists():
+        rebuild_recipe_documents.enqueue(author_id=instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+def rebuild_tag_documents(sender, instance, created, **kwargs):
+    if not created and settings.RECIPE_DOCUMENTS:
+        rebuild_recipe_documents.enqueue(tags=instance.pk)
+
+
+@receiver(post_save, sender=Ingredient)
+def rebuild_ingredient_documents(sender, instance, created, **kwargs):
+    if not created and settings.RECIPE_DOCUMENTS:
+        rebuild_recipe_documents.enqueue(ingredients=instance.pk)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def rebuild_documents_on_delete(sender, instance, **kwargs):
+    """Recipes lose the tag / ingredient (rebuilt after the delete)."""
+    if not settings.RECIPE_DOCUMENTS:
+        return
+    lookup = 'tags' if sender is Tag else 'ingredients'
+    recipe_ids = list(Recipe.objects.filter(
+        **{lookup: instance.pk}).values_list('pk', flat=True))
+    if recipe_ids:
+        rebuild_recipe_documents.enqueue(pk__in=recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def log_recipe_change(sender, instance, **kwargs):
+    record_recipe_changes([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def log_recipe_deletion(sender, instance, **kwargs):
+    record_recipe_changes([instance.pk], deleted=True)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def log_recipe_ingredients_change(sender, instance, **kwargs):
+    record_recipe_changes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def log_recipe_tags_change(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """recipe.tags.set() / add() / remove() / clear() and tag.recipe.*"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            record_recipe_changes([instance.pk])
+    elif action == 'pre_clear':
+        record_recipe_changes(instance.recipe.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        record_recipe_changes(pk_set)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def log_related_change(sender, instance, created, **kwargs):
+    """The author, tag and ingredient data shown in the recipes."""
+    if created or sender is User and not instance._author_changed:
+        return
+    lookup = {User: 'author', Tag: 'tags', Ingredient: 'ingredients'}[sender]
+    record_recipe_changes(Recipe.objects.filter(
+        **{lookup: instance.pk}).values_list('pk', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Tag)
+def log_tag_deletion(sender, instance, **kwargs):
+    """The through rows are removed without m2m_changed."""
+    record_recipe_changes(instance.recipe.values_list('pk', flat=True))
@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import TOKEN_CACHE_SETTINGS, shared_key, token_cache
+from api.tests.utils import NoThrottleMixin, create_user
+from users.models import User
+
+
+class CachedTokenAuthenticationTests(NoThrottleMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.user = create_user('user')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self, status=200):
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status)
+        return response
+
+    def set_password(self, new_password='Xq7-new-password'):
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'pass', 'new_password': new_password},
+            format='json')
+        self.assertEqual(response.status_code, 204)
+
+    def test_snapshot_without_password(self):
+        self.get_me()
+        snapshot = token_cache.get(self.token.key)
+        self.assertEqual(snapshot['username'], 'user')
+        self.assertNotIn('password', snapshot)
+
+    def test_shared_snapshot_without_password(self):
+        self.addCleanup(cache.clear)
+        with mock.patch.dict(TOKEN_CACHE_SETTINGS, CACHE_ALIAS='default'):
+            self.get_me()
+            token_cache.clear()
+            self.get_me()
+        snapshot = cache.get(shared_key(self.token.key))
+        self.assertEqual(snapshot['username'], 'user')
+        self.assertNotIn('password', snapshot)
+
+    def test_password_change_drops_cached_user(self):
+        self.get_me()
+        self.set_password()
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('Xq7-new-password'))
+        self.get_me()
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+    def test_stale_snapshot_not_written_back(self):
+        self.get_me()
+        # Changed by another worker, before its invalidation arrives.
+        User.objects.filter(pk=self.user.pk).update(
+            first_name='Fresh', email='fresh@example.com')
+        self.set_password()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Fresh')
+        self.assertEqual(self.user.email, 'fresh@example.com')
+        self.assertTrue(self.user.check_password('Xq7-new-password'))
+
+    def test_deactivation_drops_cached_user(self):
+        self.get_me()
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.get_me(status=401)
@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from unittest import mock
+
+import orjson
+from django.test import SimpleTestCase, TestCase
+
+from api import bus
+from api.bus import (INVALIDATION_BUS_SETTINGS, MAX_KEYS_PER_EVENT, BusStats,
+                     Listener, append, dispatch, publish, register)
+
+LABEL = 'posts.recipe'
+
+
+def payload(keys, label=LABEL):
+    return orjson.dumps({'m': label, 'k': keys, 't': time.time(),
+                         'p': os.getpid()}).decode()
+
+
+class BusTestMixin:
+    """An event file and handlers of the test."""
+
+    def setUp(self):
+        super().setUp()
+        bus_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bus_dir, ignore_errors=True)
+        self.path = os.path.join(bus_dir, 'invalidation.log')
+        for patcher in (
+                mock.patch.dict(INVALIDATION_BUS_SETTINGS, BACKEND='file',
+                                FILE=self.path, POLL_INTERVAL=0.01,
+                                RECONNECT_DELAY=0.01),
+                mock.patch.object(bus, 'handlers', defaultdict(list))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.received = []
+        register(LABEL, self.received.append)
+
+    def events(self):
+        with open(self.path, 'rb') as file:
+            return [orjson.loads(line) for line in file]
+
+
+class PublishTests(BusTestMixin, TestCase):
+
+    def test_sent_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            publish(LABEL, [1, 2])
+            self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(len(callbacks), 1)
+        event, = self.events()
+        self.assertEqual((event['m'], event['k'], event['p']),
+                         (LABEL, [1, 2], os.getpid()))
+
+    def test_not_sent_on_rollback(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            publish(LABEL, [1])
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_keys_split_into_events(self):
+        keys = list(range(2 * MAX_KEYS_PER_EVENT + 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            publish(LABEL, iter(keys))
+        self.assertEqual([event['k'] for event in self.events()],
+                         [keys[:MAX_KEYS_PER_EVENT],
+                          keys[MAX_KEYS_PER_EVENT:-1], keys[-1:]])
+
+
+class DispatchTests(BusTestMixin, SimpleTestCase):
+
+    def test_handlers_of_the_label(self):
+        other = []
+        register('posts.tag', other.append)
+        stats = BusStats()
+        event = dispatch(payload([1, 2]), stats)
+        self.assertEqual(event['k'], [1, 2])
+        self.assertEqual(self.received, [[1, 2]])
+        self.assertEqual(other, [])
+        self.assertEqual(stats.as_dict()['events'], 1)
+
+    def test_failing_handler(self):
+        failed = mock.Mock(side_effect=RuntimeError)
+        register(LABEL, failed)
+        register(LABEL, self.received.append)
+        with self.assertLogs('api.bus', 'ERROR'):
+            dispatch(payload([1]), BusStats())
+        failed.assert_called_once_with([1])
+        self.assertEqual(self.received, [[1], [1]])
+
+    def test_flush_all(self):
+        register('posts.tag', self.received.append)
+        stats = BusStats()
+        bus.flush_all(stats)
+        self.assertEqual(self.received, [None, None])
+        self.assertEqual(stats.flushes, 1)
+
+
+class FileListenerTests(BusTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.delivered = []
+        self.listener = Listener('file', on_event=self.delivered.append)
+        # Events appended before the listener opens the file are skipped.
+        append(payload([0]))
+        self.listener.start()
+        self.addCleanup(self.stop_listener)
+        # Ready once it receives an event of another model.
+        ready = []
+        register('posts.tag', ready.append)
+        for _ in range(100):
+            append(payload([0], label='posts.tag'))
+            time.sleep(0.02)
+            if ready:
+                break
+        self.assertEqual(self.received, [])
+
+    def stop_listener(self):
+        self.listener.stopped.set()
+        self.listener.join(1)
+
+    def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('Condition not reached')
+
+    def test_delivery(self):
+        append(payload([1]))
+        append(payload([2, 3]))
+        self.wait_for(lambda: len(self.received) == 2)
+        self.assertEqual(self.received, [[1], [2, 3]])
+        self.assertEqual([event['k'] for event in self.delivered
+                          if event['m'] == LABEL], [[1], [2, 3]])
+
+    def test_partial_line_waits(self):
+        with open(self.path, 'a') as file:
+            file.write(payload([1])[:10])
+        time.sleep(0.05)
+        self.assertEqual(self.received, [])
+        with open(self.path, 'a') as file:
+            file.write(payload([1])[10:] + '\n')
+        self.wait_for(lambda: self.received == [[1]])
+
+    def test_truncation_flushes(self):
+        with mock.patch.dict(INVALIDATION_BUS_SETTINGS, FILE_MAX_BYTES=0):
+            append(payload([1]))
+        self.assertEqual(len(self.events()), 1)
+        self.wait_for(lambda: len(self.received) == 2)
+        self.assertEqual(self.received, [None, [1]])
+        self.assertEqual(self.listener.stats.flushes, 1)
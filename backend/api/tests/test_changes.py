@@ -0,0 +1,146 @@
+import json
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.changes import compact_changes, sequence_changes
+from api.tests.utils import NoThrottleMixin, create_recipe, create_user
+from posts.models import RecipeChange, Tag
+
+
+@override_settings(RECIPE_DOCUMENTS=False)
+class ChangeFeedTests(NoThrottleMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.tag = Tag.objects.create(name='breakfast', slug='breakfast')
+        self.recipes = [create_recipe(self.author, f'Recipe {index}',
+                                      [self.tag])
+                        for index in range(5)]
+
+    def feed(self, cursor=0, limit=None, status=200):
+        url = f'/api/recipes/changes/?cursor={cursor}'
+        if limit:
+            url += f'&limit={limit}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status)
+        if status != 200:
+            return response.json()
+        lines = [json.loads(line) for line in b''.join(
+            response.streaming_content).splitlines()]
+        return lines[:-1], lines[-1]
+
+    def test_cursor(self):
+        # Two rows per recipe: the save and the tags.
+        changes, end = self.feed(limit=6)
+        self.assertEqual([change['id'] for change in changes],
+                         [recipe.pk for recipe in self.recipes[:3]])
+        self.assertEqual([change['op'] for change in changes],
+                         ['upsert'] * 3)
+        self.assertEqual(end, {'next_cursor': changes[-1]['cursor'],
+                               'has_more': True})
+        changes, end = self.feed(end['next_cursor'])
+        self.assertEqual([change['id'] for change in changes],
+                         [recipe.pk for recipe in self.recipes[3:]])
+        self.assertFalse(end['has_more'])
+        cursor = end['next_cursor']
+        self.assertEqual(self.feed(cursor), ([], end))
+        self.recipes[0].name = 'Renamed'
+        self.recipes[0].save()
+        changes, end = self.feed(cursor)
+        self.assertEqual([(change['id'], change['recipe']['name'])
+                          for change in changes],
+                         [(self.recipes[0].pk, 'Renamed')])
+        self.assertEqual(end['next_cursor'], changes[0]['cursor'])
+
+    def test_change_committed_out_of_id_order(self):
+        """A row with a lower id numbered later is still sent."""
+        latest = RecipeChange.objects.latest('id')
+        late = RecipeChange.objects.create(
+            id=latest.id + 10, recipe_id=self.recipes[1].pk)
+        _, end = self.feed()
+        RecipeChange.objects.create(id=late.id - 1,
+                                    recipe_id=self.recipes[2].pk)
+        changes, end = self.feed(end['next_cursor'])
+        self.assertEqual([change['id'] for change in changes],
+                         [self.recipes[2].pk])
+        late.refresh_from_db()
+        self.assertGreater(changes[0]['cursor'], late.position)
+
+    def test_numbering(self):
+        RecipeChange.objects.update(position=None)
+        count = RecipeChange.objects.count()
+        self.assertEqual(sequence_changes(), count)
+        self.assertEqual(sequence_changes(), 0)
+        self.assertEqual(
+            list(RecipeChange.objects.order_by('id').values_list(
+                'position', flat=True)),
+            list(range(1, count + 1)))
+
+    def test_delete(self):
+        _, end = self.feed()
+        recipe = self.recipes[0]
+        response = self.client.delete(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 204)
+        changes, _ = self.feed(end['next_cursor'])
+        self.assertEqual(changes, [{'cursor': changes[0]['cursor'],
+                                    'id': recipe.pk, 'op': 'delete'}])
+
+    def test_change_then_delete_sends_the_delete(self):
+        _, end = self.feed()
+        recipe = self.recipes[0]
+        recipe.name = 'Renamed'
+        recipe.save()
+        self.client.delete(f'/api/recipes/{recipe.pk}/')
+        changes, _ = self.feed(end['next_cursor'])
+        self.assertEqual([(change['id'], change['op']) for change in changes],
+                         [(recipe.pk, 'delete')])
+        changes, _ = self.feed()
+        self.assertNotIn(recipe.pk, [change['id'] for change in changes
+                                     if change['op'] == 'upsert'])
+
+    def test_compacted_deletions_expire_cursors(self):
+        _, start = self.feed()
+        recipe = self.recipes[0]
+        self.client.delete(f'/api/recipes/{recipe.pk}/')
+        # Each recipe keeps its last row: the deletion becomes the horizon.
+        self.assertEqual(compact_changes(retention_days=0),
+                         (len(self.recipes) + 1, 0))
+        data = self.feed(start['next_cursor'], status=410)
+        self.assertEqual(data['horizon'], RecipeChange.objects.get(
+            kind=RecipeChange.HORIZON).position)
+        changes, end = self.feed()
+        self.assertEqual(sorted(change['id'] for change in changes),
+                         sorted(recipe.pk for recipe in self.recipes[1:]))
+        self.assertEqual(self.feed(end['next_cursor']), ([], end))
+
+    def test_author_changes(self):
+        _, end = self.feed()
+        cursor = end['next_cursor']
+        self.author.set_password('new-pass')
+        self.author.save()
+        self.author.is_staff = True
+        self.author.save(update_fields=['is_staff'])
+        self.author.save(update_fields=['last_login'])
+        self.assertEqual(self.feed(cursor), ([], end))
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        changes, _ = self.feed(cursor)
+        self.assertEqual(
+            {change['recipe']['author']['first_name'] for change in changes},
+            {'Renamed'})
+        self.assertEqual(len(changes), len(self.recipes))
+
+    def test_author_documents(self):
+        with mock.patch('api.signals.rebuild_recipe_documents.enqueue') as \
+                enqueue, override_settings(RECIPE_DOCUMENTS=True):
+            self.author.set_password('new-pass')
+            self.author.save()
+            enqueue.assert_not_called()
+            self.author.email = 'renamed@example.com'
+            self.author.save(update_fields=['email'])
+            enqueue.assert_called_once_with(author_id=self.author.pk)
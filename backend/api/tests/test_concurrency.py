@@ -0,0 +1,180 @@
+"""
+Concurrent toggles of the favorites, shopping carts and subscriptions.
+
+Each request runs in a thread of its own, with its own database
+connection, all released at once by a barrier: on PostgreSQL they
+overlap on the row locks of the unique constraints. Whatever the
+interleaving, there must be no server error, at most one row per pair,
+and the cart totals and author stats must match the rows.
+"""
+import threading
+from unittest import mock, skipIf
+
+from django.db import connection
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+
+from api.services import expected_cart_totals
+from posts.models import (AuthorStats, CartIngredient, Favorite, Follow,
+                          Ingredient, IngredientRecipe, Recipe, ShoppingCart)
+from users.models import User
+
+THREADS = 8
+ROUNDS = 5
+
+
+class ConcurrentToggleTests(TransactionTestCase):
+
+    def setUp(self):
+        # Every thread spends tokens of the same user bucket.
+        throttle = mock.patch('api.throttling.CostThrottle.allow_request',
+                              return_value=True)
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user', password='pass',
+            first_name='User', last_name='User')
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author', password='pass',
+            first_name='Author', last_name='Author')
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f'Recipe {index}', text='Text',
+                cooking_time=10, image='recipes/images/recipe.png')
+            for index in range(3)]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ingredient {index}',
+                                      measurement_unit='г')
+            for index in range(3)]
+        for index, recipe in enumerate(self.recipes):
+            for ingredient in ingredients[index:]:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=100)
+
+    def run_parallel(self, requests):
+        """
+        Send the (method, url, data) requests of the user at once, one
+        per thread. Returns the status codes, in the order of requests.
+        """
+        barrier = threading.Barrier(len(requests))
+        codes = [None] * len(requests)
+
+        def send(index, method, url, data):
+            client = APIClient()
+            client.raise_request_exception = False
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                codes[index] = getattr(client, method)(
+                    url, data, format='json').status_code
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send, args=(index, *request))
+                   for index, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertNotIn(None, codes)
+        self.assertFalse([code for code in codes if code >= 500], codes)
+        return codes
+
+    def stats(self):
+        return AuthorStats.objects.get(user=self.author)
+
+    def assert_cart_totals(self):
+        totals = {(row.user_id, row.ingredient_id): row.amount
+                  for row in CartIngredient.objects.all()}
+        self.assertEqual(totals, expected_cart_totals())
+
+    def assert_one_succeeds(self, method, url):
+        """The same request from every thread: one succeeds, others fail."""
+        codes = self.run_parallel([(method, url, None)] * THREADS)
+        success, failure = (201, 400) if method == 'post' else (204, 404)
+        self.assertEqual(sorted(codes),
+                         [success] + [failure] * (THREADS - 1))
+
+    def test_favorite(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.pk}/favorite/'
+        self.assert_one_succeeds('post', url)
+        self.assertEqual(Favorite.objects.filter(recipe=recipe).count(), 1)
+        self.assertEqual(self.stats().favorites_count, 1)
+        self.assert_one_succeeds('delete', url)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(self.stats().favorites_count, 0)
+
+    def test_shopping_cart(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.pk}/shopping_cart/'
+        self.assert_one_succeeds('post', url)
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.assert_cart_totals()
+        self.assert_one_succeeds('delete', url)
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(CartIngredient.objects.exists())
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assert_one_succeeds('post', url)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(self.stats().followers_count, 1)
+        self.assert_one_succeeds('delete', url)
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(self.stats().followers_count, 0)
+
+    def test_mixed_adds_and_removes(self):
+        recipe = self.recipes[0]
+        urls = (f'/api/recipes/{recipe.pk}/favorite/',
+                f'/api/recipes/{recipe.pk}/shopping_cart/',
+                f'/api/users/{self.author.pk}/subscribe/')
+        for _ in range(ROUNDS):
+            self.run_parallel([
+                (method, url, None)
+                for url in urls for method in ('post', 'delete')
+                for _ in range(THREADS // 2)])
+            favorites = Favorite.objects.count()
+            follows = Follow.objects.count()
+            self.assertLessEqual(favorites, 1)
+            self.assertLessEqual(ShoppingCart.objects.count(), 1)
+            self.assertLessEqual(follows, 1)
+            self.assertEqual(self.stats().favorites_count, favorites)
+            self.assertEqual(self.stats().followers_count, follows)
+            self.assert_cart_totals()
+
+    @skipIf(connection.vendor == 'sqlite',
+            'SQLite fails a transaction upgrading its read lock to write '
+            'while another one writes ("database is locked")')
+    def test_bulk_actions(self):
+        recipe_ids = [recipe.pk for recipe in self.recipes]
+        for url in ('/api/recipes/bulk_favorite/',
+                    '/api/recipes/bulk_shopping_cart/'):
+            # Overlapping lists, added and removed at once.
+            requests = [
+                (method, url, {'recipes': recipe_ids[index % 2:]})
+                for index in range(THREADS)
+                for method in ('post', 'delete')]
+            for _ in range(ROUNDS):
+                codes = self.run_parallel(requests)
+                self.assertEqual(set(codes), {200})
+                self.assertEqual(
+                    self.stats().favorites_count, Favorite.objects.count())
+                self.assert_cart_totals()
+            codes = self.run_parallel(
+                [('delete', url, {'recipes': recipe_ids})] * THREADS)
+            self.assertEqual(set(codes), {200})
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(CartIngredient.objects.exists())
+        self.assertEqual(self.stats().favorites_count, 0)
+
+    def test_non_numeric_id(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for url in ('/api/users/abc/subscribe/',
+                    '/api/recipes/abc/favorite/',
+                    '/api/recipes/abc/shopping_cart/'):
+            for method in ('post', 'delete'):
+                self.assertEqual(getattr(client, method)(url).status_code,
+                                 404)
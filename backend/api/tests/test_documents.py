@@ -0,0 +1,95 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.documents import (build_documents, refresh_recipe_documents,
+                           store_documents)
+from api.tests.utils import create_ingredients, create_recipe, create_user
+from posts.models import (Favorite, Follow, Recipe, RecipeDocument,
+                          ShoppingCart, Tag)
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class RecipeDocumentTests(TestCase):
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        breakfast = Tag.objects.create(name='breakfast', slug='breakfast')
+        lunch = Tag.objects.create(name='lunch', slug='lunch',
+                                   color=Tag.ORANGE)
+        flour, milk = create_ingredients('Flour', 'Milk')
+        self.pancakes = create_recipe(
+            self.author, 'Pancakes', [breakfast, lunch],
+            {flour: 200, milk: 300})
+        self.soup = create_recipe(self.author, 'Soup', [lunch], {milk: 500})
+        Favorite.objects.create(author=self.viewer, recipe=self.pancakes)
+        ShoppingCart.objects.create(author=self.viewer, recipe=self.soup)
+        Follow.objects.create(user=self.viewer, author=self.author)
+        self.clients = {'anonymous': APIClient(), 'viewer': APIClient()}
+        self.clients['viewer'].force_authenticate(self.viewer)
+        self.urls = ('/api/recipes/', f'/api/recipes/{self.pancakes.pk}/',
+                     '/api/recipes/?tags=breakfast',
+                     '/api/recipes/?is_favorited=1',
+                     '/api/recipes/?is_in_shopping_cart=1')
+
+    def get(self, client, url, documents):
+        with override_settings(RECIPE_DOCUMENTS=documents):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assert_same_as_serializer(self):
+        for name, client in self.clients.items():
+            for url in self.urls:
+                with self.subTest(client=name, url=url):
+                    self.assertEqual(self.get(client, url, True),
+                                     self.get(client, url, False))
+
+    def test_same_output_without_documents(self):
+        self.assertFalse(RecipeDocument.objects.exists())
+        self.assert_same_as_serializer()
+
+    def test_same_output_with_documents(self):
+        refresh_recipe_documents(Recipe.objects.all())
+        self.assertEqual(RecipeDocument.objects.count(), 2)
+        self.assert_same_as_serializer()
+        data = self.get(self.clients['viewer'],
+                        f'/api/recipes/{self.pancakes.pk}/', True)
+        self.assertTrue(data['is_favorited'])
+        self.assertFalse(data['is_in_shopping_cart'])
+        self.assertTrue(data['author']['is_subscribed'])
+        self.assertTrue(data['image'].startswith('http://testserver/'))
+
+    def test_reads_do_not_write(self):
+        for url in self.urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.get(self.clients['viewer'], url, True)
+            self.assertFalse([query['sql'] for query in queries
+                              if query['sql'].startswith(WRITES)])
+        self.assertFalse(RecipeDocument.objects.exists())
+
+    def test_store_replaces_documents(self):
+        """A concurrent rebuild stored the row first: no conflict."""
+        RecipeDocument.objects.create(recipe=self.pancakes, body=b'{}')
+        documents = build_documents(Recipe.objects.all())
+        store_documents(documents.values())
+        store_documents(documents.values())
+        self.assertEqual(RecipeDocument.objects.count(), 2)
+        stored = RecipeDocument.objects.get(recipe=self.pancakes)
+        self.assertEqual(bytes(stored.body),
+                         documents[self.pancakes.pk].body)
+        self.assertEqual(stored.splices, documents[self.pancakes.pk].splices)
+
+    def test_rebuild_missing(self):
+        refresh_recipe_documents(Recipe.objects.filter(pk=self.soup.pk))
+        call_command('rebuild_recipe_documents', '--missing',
+                     stdout=StringIO())
+        self.assertEqual(
+            set(RecipeDocument.objects.values_list('recipe_id', flat=True)),
+            {self.pancakes.pk, self.soup.pk})
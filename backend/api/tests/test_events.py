@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import orjson
+from django.test import TestCase
+
+from api import bus
+from api.events import (EVENTS_SETTINGS, EventStreamApplication, Subscriber,
+                        hub)
+from api.tests.utils import create_user
+from users.models import User
+
+
+class EventStreamTests(TestCase):
+    """
+    The streams run on an event loop of their own thread, as under the
+    ASGI server; saves and bus events come from the test thread, as from
+    the bus listener thread.
+    """
+
+    def setUp(self):
+        self.user = create_user('user')
+        self.application = EventStreamApplication(None)
+        # The token cache and bus listener are not under test here.
+        for target, value in (('api.events.authenticate', self.user),
+                              ('api.bus.ensure_listening', None)):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.stop_loop, thread)
+        self.disconnect = asyncio.Event()
+
+    def stop_loop(self, thread):
+        self.loop.call_soon_threadsafe(self.disconnect.set)
+        self.run_in_loop(asyncio.sleep(0.05))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        thread.join()
+        self.loop.close()
+
+    def run_in_loop(self, coroutine, timeout=1):
+        return asyncio.run_coroutine_threadsafe(
+            coroutine, self.loop).result(timeout)
+
+    def open_stream(self):
+        """
+        Future of a GET /api/events/ request and the ASGI messages sent
+        for it.
+        """
+        messages = []
+
+        async def receive():
+            await self.disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET',
+                 'path': EVENTS_SETTINGS['PATH'], 'query_string': b'',
+                 'headers': [(b'authorization', b'Token key')]}
+        return asyncio.run_coroutine_threadsafe(
+            self.application(scope, receive, send), self.loop), messages
+
+    def wait_for_streams(self, count):
+        for _ in range(100):
+            if len(hub.subscribers([self.user.pk])) == count:
+                return
+            time.sleep(0.01)
+        self.fail(f'{count} streams expected')
+
+    def deliver_user_event(self):
+        """The users.user bus event of a user save, as the listener does."""
+        bus.dispatch(orjson.dumps({
+            'm': User._meta.label_lower, 'k': [self.user.pk],
+            't': time.time(), 'p': 0}), bus.BusStats())
+
+    def test_limits_send_retry_after(self):
+        for setting, status in (('MAX_PER_USER', 429),
+                                ('MAX_CONNECTIONS', 503)):
+            with self.subTest(setting=setting), \
+                    mock.patch.dict(EVENTS_SETTINGS, {setting: 1}):
+                self.open_stream()
+                self.wait_for_streams(1)
+                rejected, messages = self.open_stream()
+                rejected.result(1)
+                start, _ = messages
+                self.assertEqual(start['status'], status)
+                self.assertIn(
+                    (b'retry-after',
+                     str(EVENTS_SETTINGS['RETRY_AFTER']).encode()),
+                    start['headers'])
+                self.assertEqual(len(hub.subscribers()), 1)
+                self.loop.call_soon_threadsafe(self.disconnect.set)
+                self.wait_for_streams(0)
+                self.disconnect = asyncio.Event()
+
+    def test_deactivation_closes_streams(self):
+        streams = [self.open_stream() for _ in range(2)]
+        self.wait_for_streams(2)
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.deliver_user_event()
+        self.run_in_loop(asyncio.sleep(0.05))
+        self.assertEqual(len(hub.subscribers([self.user.pk])), 2)
+        self.user.is_active = False
+        self.user.save()
+        self.deliver_user_event()
+        for future, messages in streams:
+            future.result(1)
+            self.assertEqual(messages[-1],
+                             {'type': 'http.response.body', 'body': b''})
+        self.assertEqual(hub.subscribers(), [])
+
+    def test_unknown_users_skip_the_query(self):
+        subscriber = Subscriber(self.user.pk, 'key', self.loop)
+        with mock.patch.object(hub, 'subscribers', return_value=[]), \
+                self.assertNumQueries(0):
+            hub.close_inactive([self.user.pk])
+        with mock.patch.object(hub, 'subscribers',
+                               return_value=[subscriber]), \
+                self.assertNumQueries(1):
+            hub.close_inactive(None)
+        self.run_in_loop(asyncio.sleep(0.05))
+        self.assertFalse(subscriber.closed)
@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.idempotency import (IDEMPOTENCY_SETTINGS, REPLAYED_HEADER,
+                             fingerprint)
+from api.tests.utils import (PNG, NoThrottleMixin, TempMediaMixin,
+                             create_ingredients, create_user)
+from posts.models import Recipe, Tag
+
+URL = '/api/recipes/'
+KEY = 'c0ffee'
+
+
+class IdempotencyTests(NoThrottleMixin, TempMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A per-process cache: the configured one outlives the test data.
+        patcher = mock.patch.dict(IDEMPOTENCY_SETTINGS,
+                                  CACHE_ALIAS='default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.author = create_user('author')
+        tag = Tag.objects.create(name='breakfast', slug='breakfast')
+        flour, = create_ingredients('Flour')
+        self.data = {
+            'name': 'Pancakes', 'text': 'Text', 'cooking_time': 10,
+            'tags': [tag.pk], 'ingredients': [{'id': flour.pk, 'amount': 100}],
+            'image': PNG}
+
+    def post(self, data=None, user=None, key=KEY):
+        client = APIClient()
+        client.force_authenticate(user or self.author)
+        return client.post(URL, data or self.data, format='json',
+                           **{'HTTP_IDEMPOTENCY_KEY': key})
+
+    def test_replay(self):
+        first = self.post()
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn(REPLAYED_HEADER, first)
+        replay = self.post()
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay[REPLAYED_HEADER], 'true')
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(Recipe.objects.filter(name='Pancakes').count(), 1)
+
+    def test_client_error_is_replayed(self):
+        data = {**self.data, 'cooking_time': 0}
+        first = self.post(data)
+        self.assertEqual(first.status_code, 400)
+        replay = self.post(data)
+        self.assertEqual(replay.status_code, 400)
+        self.assertEqual(replay[REPLAYED_HEADER], 'true')
+        self.assertEqual(replay.json(), first.json())
+
+    def test_different_body(self):
+        self.assertEqual(self.post().status_code, 201)
+        response = self.post({**self.data, 'name': 'Waffles'})
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Recipe.objects.filter(name='Waffles').exists())
+
+    def test_in_flight(self):
+        # The lock entry of a first request still running.
+        request = SimpleNamespace(method='POST', path=URL, data=self.data)
+        cache_key = (f'{IDEMPOTENCY_SETTINGS["KEY_PREFIX"]}'
+                     f'{self.author.pk}:{KEY}')
+        cache.set(cache_key, {'fingerprint': fingerprint(request)})
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_keys_of_other_users(self):
+        self.assertEqual(self.post().status_code, 201)
+        other = create_user('other')
+        response = self.post(user=other)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn(REPLAYED_HEADER, response)
+        response = self.post({**self.data, 'name': 'Waffles'}, user=other,
+                             key='other')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('author__username', 'name')),
+            [('author', 'Pancakes'), ('other', 'Pancakes'),
+             ('other', 'Waffles')])
+
+    def test_server_error_is_not_stored(self):
+        with mock.patch('api.views.RecipeViewSet.perform_create',
+                        side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.post()
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn(REPLAYED_HEADER, response)
+
+    def test_key_too_long(self):
+        response = self.post(
+            key='k' * (IDEMPOTENCY_SETTINGS['MAX_KEY_LENGTH'] + 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
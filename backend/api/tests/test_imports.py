@@ -0,0 +1,129 @@
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.imports import RECIPE_IMPORT_SETTINGS
+from api.tests.utils import (PNG, NoThrottleMixin, TempMediaMixin,
+                             create_ingredients, create_recipe, create_user)
+from posts.models import Follow, Recipe, Tag
+from tasks.queue import run_batch
+
+# The signature of a PNG, but not a decodable image.
+BROKEN_PNG = 'data:image/png;base64,iVBORw0KGgoAAAAA'
+
+
+class RecipeImportTests(NoThrottleMixin, TempMediaMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pending_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pending_dir, ignore_errors=True)
+        patcher = mock.patch.dict(RECIPE_IMPORT_SETTINGS,
+                                  {'PENDING_DIR': self.pending_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.author = create_user('author')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.tag = Tag.objects.create(name='breakfast', slug='breakfast')
+        self.flour, = create_ingredients('Flour')
+        create_recipe(self.author, 'Soup', [self.tag])
+
+    def record(self, name, **fields):
+        return json.dumps({
+            'name': name, 'text': 'Text', 'cooking_time': 10,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.flour.pk, 'amount': 100}],
+            'image': PNG, **fields})
+
+    def post(self, *lines):
+        response = self.client.post(
+            '/api/recipes/import/', '\n'.join(lines).encode(),
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def recipe_names(self, client=None):
+        response = (client or self.client).get('/api/recipes/')
+        return {recipe['name'] for recipe in response.json()['results']}
+
+    def test_report(self):
+        report = self.post(
+            self.record('Pancakes'),
+            '{"name": ',
+            '',
+            self.record('Soup'),
+            self.record('Porridge', tags=[self.tag.pk + 100]),
+            self.record('Pancakes'),
+            self.record('Waffles', image='not an image'),
+            self.record('Omelette'))
+        self.assertEqual(report['records'], 7)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(report['failed'], 5)
+        created = dict(Recipe.objects.filter(
+            name__in=['Pancakes', 'Omelette']).values_list('name', 'pk'))
+        self.assertEqual(report['results'], [
+            {'line': 1, 'id': created['Pancakes']},
+            {'line': 7, 'id': created['Omelette']}])
+        errors = {error['line']: error['errors'] for error in report['errors']}
+        self.assertEqual(sorted(errors), [2, 3, 4, 5, 6])
+        self.assertTrue(errors[2]['non_field_errors'][0].startswith(
+            'Invalid JSON'))
+        self.assertEqual(errors[3], {
+            'name': ['The author already has a recipe with this name.']})
+        self.assertEqual(errors[4], {'tags': ['Unknown tag ids.']})
+        self.assertEqual(errors[5], errors[3])
+        self.assertEqual(list(errors[6]), ['image'])
+
+    def test_empty_body(self):
+        response = self.client.post('/api/recipes/import/', b'',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+    def test_anonymous(self):
+        response = APIClient().post(
+            '/api/recipes/import/', self.record('Pancakes').encode(),
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 401)
+
+    def test_hidden_until_image_processed(self):
+        recipe_id = self.post(self.record('Pancakes'))['results'][0]['id']
+        viewer = create_user('viewer')
+        Follow.objects.create(user=viewer, author=self.author)
+        viewer_client = APIClient()
+        viewer_client.force_authenticate(viewer)
+        detail = f'/api/recipes/{recipe_id}/'
+
+        def subscription_recipes():
+            response = viewer_client.get('/api/users/subscriptions/')
+            return {recipe['name']
+                    for recipe in response.json()['results'][0]['recipes']}
+
+        def feed_ids():
+            response = viewer_client.get('/api/recipes/changes/')
+            lines = b''.join(response.streaming_content).splitlines()
+            return {line['id'] for line in map(json.loads, lines)
+                    if 'recipe' in line}
+
+        self.assertEqual(self.recipe_names(), {'Soup'})
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        self.assertEqual(subscription_recipes(), {'Soup'})
+        self.assertNotIn(recipe_id, feed_ids())
+        self.assertEqual(run_batch(10), 1)
+        self.assertEqual(self.recipe_names(), {'Soup', 'Pancakes'})
+        response = self.client.get(detail)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['image'])
+        self.assertEqual(subscription_recipes(), {'Soup', 'Pancakes'})
+        self.assertIn(recipe_id, feed_ids())
+
+    def test_undecodable_image_deletes_recipe(self):
+        report = self.post(self.record('Pancakes', image=BROKEN_PNG))
+        self.assertEqual(report['created'], 1)
+        run_batch(10)
+        self.assertFalse(Recipe.objects.filter(name='Pancakes').exists())
+        self.assertTrue(Recipe.all_objects.filter(name='Pancakes').exists())
@@ -0,0 +1,139 @@
+import importlib
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from rest_framework import serializers
+
+from api.query_detector import (QUERY_DETECTOR_SETTINGS, NPlusOneError,
+                                QueryDetectorMiddleware, QueryDetectorMixin,
+                                QueryRecorder, fingerprint)
+from api.tests.utils import create_recipe, create_user
+from foodgram import settings as base_settings
+from foodgram import settings_api
+from posts.models import Recipe, Tag
+
+MIDDLEWARE = 'api.query_detector.QueryDetectorMiddleware'
+
+
+class AuthorNameSerializer(serializers.ModelSerializer):
+    author_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'author_name')
+
+    def get_author_name(self, obj):
+        return obj.author.username
+
+
+def serialize_recipes():
+    """One author query per recipe without select_related."""
+    return AuthorNameSerializer(
+        Recipe.objects.order_by('pk'), many=True).data
+
+
+def load_tags_twice():
+    for _ in range(2):
+        list(Tag.objects.filter(slug='breakfast'))
+
+
+class QueryDetectorTests(QueryDetectorMixin, TestCase):
+
+    def setUp(self):
+        Tag.objects.create(name='breakfast', slug='breakfast')
+        for index in range(5):
+            create_recipe(create_user(f'author{index}'), f'Recipe {index}')
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 'x' AND b IN (1, 2)\n"
+                        "AND c = %s"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?')
+
+    def test_n_plus_one(self):
+        with QueryRecorder() as recorder:
+            serialize_recipes()
+        self.assertEqual(len(recorder.queries), 6)
+        problem, = recorder.problems()
+        self.assertEqual(problem['kind'], 'n+1')
+        self.assertEqual(problem['count'], 5)
+        self.assertEqual(problem['duplicates'], 0)
+        self.assertEqual(problem['field'], 'AuthorNameSerializer.author_name')
+        self.assertIn('test_query_detector.py', problem['location'])
+        self.assertIn('get_author_name', problem['location'])
+        self.assertIn('users_user', problem['fingerprint'])
+        report = recorder.report()
+        self.assertTrue(report.startswith('6 queries\nn+1: 5 queries'))
+
+    def test_duplicate(self):
+        with QueryRecorder() as recorder:
+            load_tags_twice()
+        problem, = recorder.problems()
+        self.assertEqual(problem['kind'], 'duplicate')
+        self.assertEqual(problem['count'], 2)
+        self.assertEqual(problem['duplicates'], 1)
+        self.assertIn('load_tags_twice', problem['location'])
+
+    def test_assert_no_n_plus_one(self):
+        with self.assertRaises(NPlusOneError):
+            with self.assertNoNPlusOne():
+                serialize_recipes()
+        with self.assertRaises(NPlusOneError):
+            with self.assertNoNPlusOne():
+                load_tags_twice()
+        with self.assertNoNPlusOne(allow_duplicates=True):
+            load_tags_twice()
+        with self.assertNoNPlusOne(threshold=5):
+            serialize_recipes()
+        with self.assertNoNPlusOne():
+            AuthorNameSerializer(Recipe.objects.select_related('author'),
+                                 many=True).data
+
+    def test_middleware_report(self):
+        report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, report_dir, ignore_errors=True)
+
+        def view(request):
+            serialize_recipes()
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/recipes/?page=2')
+        with mock.patch.dict(QUERY_DETECTOR_SETTINGS,
+                             REPORT_DIR=report_dir):
+            QueryDetectorMiddleware(lambda request: HttpResponse())(request)
+            self.assertEqual(os.listdir(report_dir), [])
+            QueryDetectorMiddleware(view)(request)
+        name, = os.listdir(report_dir)
+        with open(os.path.join(report_dir, name)) as file:
+            report = json.load(file)
+        self.assertEqual(report['method'], 'GET')
+        self.assertEqual(report['path'], '/api/recipes/?page=2')
+        self.assertEqual(report['status'], 200)
+        self.assertEqual(report['queries'], 6)
+        self.assertEqual([problem['kind'] for problem in report['problems']],
+                         ['n+1'])
+
+
+class QueryDetectorSettingsTests(TestCase):
+
+    def reload_settings(self):
+        importlib.reload(base_settings)
+        importlib.reload(settings_api)
+
+    def test_middleware_in_both_settings(self):
+        self.addCleanup(self.reload_settings)
+        with mock.patch.dict(os.environ, QUERY_DETECTOR='True'):
+            self.reload_settings()
+        for module in (base_settings, settings_api):
+            with self.subTest(module=module.__name__):
+                self.assertEqual(module.MIDDLEWARE[0], MIDDLEWARE)
+        with mock.patch.dict(os.environ, QUERY_DETECTOR='False'):
+            self.reload_settings()
+        for module in (base_settings, settings_api):
+            with self.subTest(module=module.__name__):
+                self.assertNotIn(MIDDLEWARE, module.MIDDLEWARE)
@@ -0,0 +1,59 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.tests.utils import (PNG, TempMediaMixin, create_ingredients,
+                             create_user)
+from posts.models import Recipe, Tag
+
+
+class RecipeNameTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.tag = Tag.objects.create(name='lunch', slug='lunch')
+        self.ingredient, = create_ingredients('Flour')
+
+    def post(self, name):
+        return self.client.post('/api/recipes/', {
+            'name': name, 'text': 'Text', 'cooking_time': 5, 'image': PNG,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 100}]},
+            format='json')
+
+    def test_duplicate_name(self):
+        self.assertEqual(self.post('Same').status_code, 201)
+        response = self.post('Same')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.json())
+        other = APIClient()
+        other.force_authenticate(create_user('other'))
+        self.client = other
+        self.assertEqual(self.post('Same').status_code, 201)
+
+    def test_name_of_deleted_recipe(self):
+        """Soft-deleted recipes free their names before being purged."""
+        self.post('Same')
+        deleted = Recipe.objects.get(name='Same')
+        response = self.client.delete(f'/api/recipes/{deleted.pk}/')
+        self.assertEqual(response.status_code, 204)
+        response = self.post('Same')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            Recipe.all_objects.filter(name='Same').count(), 2)
+        self.assertNotEqual(Recipe.objects.get(name='Same').pk, deleted.pk)
+
+    def test_rename(self):
+        self.post('First')
+        self.post('Second')
+        first = Recipe.objects.get(name='First').pk
+        data = {'name': 'Second', 'text': 'Text', 'cooking_time': 5,
+                'image': PNG, 'tags': [self.tag.pk],
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 50}]}
+        response = self.client.patch(f'/api/recipes/{first}/', data,
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/recipes/{first}/',
+                                     {**data, 'name': 'First'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
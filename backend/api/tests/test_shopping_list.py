@@ -0,0 +1,123 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api import shopping_list
+from api.shopping_list import (IngredientCatalog, conversion_table,
+                               format_lines)
+from api.tests.utils import (NoThrottleMixin, create_ingredients,
+                             create_recipe, create_user)
+
+
+class AggregateTests(SimpleTestCase):
+
+    def aggregate(self, *rows):
+        """Lines of the (name, unit, amount) rows, one ingredient each."""
+        ingredients = [(pk, name, unit)
+                       for pk, (name, unit, _) in enumerate(rows, 1)]
+        catalog = IngredientCatalog(ingredients, conversion_table())
+        return catalog.aggregate(
+            np.arange(1, len(rows) + 1),
+            np.array([amount for _, _, amount in rows], dtype=np.float64))
+
+    def test_mass(self):
+        self.assertEqual(
+            self.aggregate(('Мука', 'г', 500), ('Мука', 'кг', 2)),
+            [('Мука', 2.5, 'кг')])
+        self.assertEqual(
+            self.aggregate(('Мука', 'г', 300), ('Мука', 'гр', 200)),
+            [('Мука', 500, 'г')])
+
+    def test_volume(self):
+        self.assertEqual(
+            self.aggregate(('Молоко', 'л', 1), ('Молоко', 'ст. л.', 2)),
+            [('Молоко', 1.03, 'л')])
+        self.assertEqual(
+            self.aggregate(('Молоко', 'стакан', 1), ('Молоко', 'мл', 100)),
+            [('Молоко', 350, 'мл')])
+
+    def test_unit_and_name_spelling(self):
+        # Two spellings of a unit are two units: listed in the output unit.
+        self.assertEqual(
+            self.aggregate(('Сахар', 'Ч.Л.', 1), ('сахар ', 'ч л', 2)),
+            [('Сахар', 15, 'мл')])
+        self.assertEqual(
+            self.aggregate(('Сахар', 'ч. л.', 1), ('Сахар', 'ч. л.', 2)),
+            [('Сахар', 3, 'ч. л.')])
+
+    def test_measures_are_not_mixed(self):
+        self.assertEqual(
+            self.aggregate(('Яйца', 'шт.', 2), ('Яйца', 'г', 100),
+                           ('Яйца', 'десяток', 1)),
+            [('Яйца', 100, 'г'), ('Яйца', 12, 'шт.')])
+
+    def test_unit_outside_the_table(self):
+        self.assertEqual(
+            self.aggregate(('Укроп', 'пучок', 1), ('Укроп', 'Пучок', 2),
+                           ('Укроп', 'г', 10)),
+            [('Укроп', 10, 'г'), ('Укроп', 3, 'пучок')])
+
+    def test_to_taste(self):
+        self.assertEqual(
+            self.aggregate(('Соль', 'по вкусу', 1), ('Соль', 'по вкусу', 1),
+                           ('Перец', 'г', 5)),
+            [('Перец', 5, 'г'), ('Соль', None, 'по вкусу')])
+
+    def test_format_lines(self):
+        self.assertEqual(
+            ''.join(format_lines([('Мука', 2.5, 'кг'), ('Мука', 500.0, 'г'),
+                                  ('Соль', None, 'по вкусу')])),
+            'Мука - 2.5 кг\nМука - 500 г\nСоль - по вкусу\n')
+
+    def test_empty(self):
+        self.assertEqual(self.aggregate(), [])
+
+
+@override_settings(ACCEL_REDIRECT=False)
+class ShoppingListDownloadTests(NoThrottleMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Dropped by bus events on commit, which tests never reach.
+        patcher = mock.patch.object(shopping_list, 'catalog', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = create_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        author = create_user('author')
+        grams, = create_ingredients('Мука')
+        kilograms, = create_ingredients('Мука', unit='кг')
+        salt, = create_ingredients('Соль', unit='по вкусу')
+        self.recipes = [
+            create_recipe(author, 'Блины', ingredients={grams: 500}),
+            create_recipe(author, 'Хлеб', ingredients={kilograms: 2,
+                                                       salt: 1})]
+
+    def download(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        # Between the title and its blank line and the footer.
+        return response.content.decode().splitlines()[2:-3]
+
+    def test_download(self):
+        for recipe in self.recipes:
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.download(),
+                         ['Мука - 2.5 кг', 'Соль - по вкусу'])
+        self.client.delete(
+            f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        self.assertEqual(self.download(), ['Мука - 500 г'])
+
+    def test_new_ingredient_reloads_the_catalog(self):
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        self.assertEqual(self.download(), ['Мука - 500 г'])
+        sugar, = create_ingredients('Сахар')
+        recipe = create_recipe(self.recipes[0].author, 'Пирог',
+                               ingredients={sugar: 200})
+        self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertEqual(self.download(), ['Мука - 500 г', 'Сахар - 200 г'])
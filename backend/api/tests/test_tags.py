@@ -0,0 +1,88 @@
+from django.core.management.sql import emit_post_migrate_signal
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.tests.utils import (PNG, TempMediaMixin, create_ingredients,
+                             create_recipe, create_user)
+from posts.models import Recipe, Tag
+from posts.signals import update_tag_masks
+
+
+class TagFilterTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.tags = {
+            name: Tag.objects.create(name=name, slug=name, color=color)
+            for name, color in (('breakfast', Tag.GREEN),
+                                ('lunch', Tag.ORANGE),
+                                ('dinner', Tag.PURPLE))}
+        tags = self.tags
+        self.recipes = {
+            'omelette': create_recipe(self.author, 'Omelette',
+                                      [tags['breakfast']]),
+            'soup': create_recipe(self.author, 'Soup', [tags['lunch']]),
+            'pancakes': create_recipe(self.author, 'Pancakes',
+                                      [tags['breakfast'], tags['dinner']]),
+            'bread': create_recipe(self.author, 'Bread'),
+        }
+
+    def filtered(self, *slugs):
+        """Names of the recipes listed with ?tags=<slug>&..."""
+        query = '&'.join(f'tags={slug}' for slug in slugs)
+        response = self.client.get(f'/api/recipes/?{query}&limit=100')
+        self.assertEqual(response.status_code, 200)
+        return {recipe['name'] for recipe in response.json()['results']}
+
+    def test_any_of_the_tags(self):
+        self.assertEqual(self.filtered('breakfast'), {'Omelette', 'Pancakes'})
+        self.assertEqual(self.filtered('breakfast', 'lunch'),
+                         {'Omelette', 'Soup', 'Pancakes'})
+        self.assertEqual(self.filtered('dinner'), {'Pancakes'})
+
+    def test_many_tag_bits(self):
+        """More bits than listed masks: filtered by a bitwise AND."""
+        for index in range(10):
+            Tag.objects.create(name=f'tag{index}', slug=f'tag{index}',
+                               color=f'#{index:06d}')
+        self.assertEqual(self.filtered('breakfast', 'lunch'),
+                         {'Omelette', 'Soup', 'Pancakes'})
+        self.assertEqual(self.filtered('tag9'), set())
+
+    def test_tags_without_bit(self):
+        """Tags created before the masks or loaded raw from fixtures."""
+        Tag.objects.filter(slug__in=('breakfast', 'lunch')).update(bit=None)
+        update_tag_masks(Recipe.objects.values_list('pk', flat=True))
+        self.assertEqual(self.filtered('breakfast'), {'Omelette', 'Pancakes'})
+        self.assertEqual(self.filtered('lunch', 'dinner'),
+                         {'Soup', 'Pancakes'})
+        ingredient, = create_ingredients('Flour')
+        response = self.client.post('/api/recipes/', {
+            'name': 'Porridge', 'text': 'Text', 'cooking_time': 5,
+            'image': PNG, 'tags': [self.tags['breakfast'].pk],
+            'ingredients': [{'id': ingredient.pk, 'amount': 100}]},
+            format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.filtered('breakfast'),
+                         {'Omelette', 'Pancakes', 'Porridge'})
+
+    def test_backfill_after_migrate(self):
+        Tag.objects.update(bit=None)
+        Recipe.objects.update(tag_mask=0)
+        emit_post_migrate_signal(0, False, 'default')
+        self.assertFalse(Tag.objects.filter(bit=None).exists())
+        for recipe in Recipe.objects.prefetch_related('tags'):
+            self.assertEqual(recipe.tag_mask, sum(
+                1 << tag.bit for tag in recipe.tags.all()))
+        self.assertEqual(self.filtered('breakfast', 'lunch'),
+                         {'Omelette', 'Soup', 'Pancakes'})
+
+    def test_fixture_tag_gets_bit(self):
+        tag = Tag(name='snack', slug='snack', color='#000001')
+        tag.save_base(raw=True)
+        self.assertIsNotNone(tag.bit)
+        self.assertEqual(Tag.objects.get(slug='snack').bit, tag.bit)
+        self.assertEqual(
+            len(set(Tag.objects.values_list('bit', flat=True))), 4)
@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from api import services, write_behind
+from api.tests.utils import NoThrottleMixin, create_recipe, create_user
+from api.write_behind import (WRITE_BEHIND_SETTINGS, JournalIndex, append,
+                              coalesce, flush, pending, segment_paths)
+from posts.models import Favorite, ShoppingCart
+
+
+class CoalesceTests(SimpleTestCase):
+
+    def test_last_change_wins(self):
+        self.assertEqual(
+            coalesce([b'f 1 10 +1\nf 1 10 -1\nf 1 10 +1\n', b'c 2 10 +1\n']),
+            {(b'f', 1, 10): 1, (b'c', 2, 10): 1})
+
+    def test_cancel(self):
+        chunks = [b'f 1 10 +1\nf 1 11 -1\n', b'f 1 10 -1\nc 1 10 +1\n']
+        self.assertEqual(coalesce(chunks),
+                         {(b'f', 1, 10): -1, (b'f', 1, 11): -1,
+                          (b'c', 1, 10): 1})
+        self.assertEqual(coalesce(chunks, cancel=True),
+                         {(b'f', 1, 11): -1, (b'c', 1, 10): 1})
+
+    def test_user(self):
+        self.assertEqual(coalesce([b'f 1 10 +1\nf 2 10 +1\n'], user_id=2),
+                         {(b'f', 2, 10): 1})
+
+    def test_header_torn_and_damaged_lines(self):
+        with self.assertLogs('api.write_behind', 'ERROR'):
+            self.assertEqual(
+                coalesce([b'# 1 2\nf 1 10 +1\nf 1\nf 1 11 +1']),
+                {(b'f', 1, 10): 1})
+
+
+class WriteBehindTests(NoThrottleMixin, TestCase):
+    """
+    The flusher thread is not started: the tests flush, as it would, in
+    the test transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir, ignore_errors=True)
+        for patcher in (
+                mock.patch.dict(WRITE_BEHIND_SETTINGS, ENABLED=True,
+                                JOURNAL=os.path.join(journal_dir, 'journal'),
+                                FSYNC=False),
+                mock.patch.object(write_behind, 'journal_index',
+                                  JournalIndex()),
+                mock.patch('api.write_behind.ensure_flushing')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = create_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        author = create_user('author')
+        self.recipes = [create_recipe(author, f'Recipe {index}')
+                        for index in range(3)]
+
+    def favorite(self, recipe, method='post'):
+        return getattr(self.client, method)(
+            f'/api/recipes/{recipe.pk}/favorite/')
+
+    def favorited(self):
+        response = self.client.get('/api/recipes/', {'is_favorited': 1})
+        self.assertEqual(response.status_code, 200)
+        return {recipe['id'] for recipe in response.json()['results']}
+
+    def test_flush_writes_the_journal(self):
+        for recipe in self.recipes[:2]:
+            self.assertEqual(self.favorite(recipe).status_code, 201)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(pending(self.user.pk),
+                         {Favorite: {recipe.pk: 1
+                                     for recipe in self.recipes[:2]}})
+        self.assertEqual(self.favorited(),
+                         {recipe.pk for recipe in self.recipes[:2]})
+        self.assertEqual(flush(block=True), 2)
+        self.assertEqual(
+            set(Favorite.objects.values_list('author', 'recipe')),
+            {(self.user.pk, recipe.pk) for recipe in self.recipes[:2]})
+        self.assertEqual(pending(self.user.pk), {})
+        self.assertEqual(segment_paths(), [])
+        self.assertEqual(flush(block=True), 0)
+
+    def test_undone_changes_cancel_out(self):
+        self.favorite(self.recipes[0])
+        self.assertEqual(self.favorite(self.recipes[0]).status_code, 400)
+        self.assertEqual(self.favorite(self.recipes[0], 'delete').status_code,
+                         204)
+        self.assertEqual(self.favorited(), set())
+        self.assertEqual(flush(block=True), 0)
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_removal(self):
+        Favorite.objects.create(author=self.user, recipe=self.recipes[0])
+        self.favorite(self.recipes[0], 'delete')
+        self.favorite(self.recipes[1])
+        self.assertEqual(self.favorited(), {self.recipes[1].pk})
+        self.assertEqual(flush(block=True), 2)
+        self.assertEqual(
+            list(Favorite.objects.values_list('recipe', flat=True)),
+            [self.recipes[1].pk])
+
+    def test_batches(self):
+        other = create_user('other')
+        append(ShoppingCart, self.user.pk,
+               [(recipe.pk, 1) for recipe in self.recipes])
+        append(ShoppingCart, other.pk, [(self.recipes[0].pk, 1)])
+        with mock.patch.dict(WRITE_BEHIND_SETTINGS, BATCH_SIZE=1):
+            self.assertEqual(flush(block=True), 4)
+        self.assertEqual(ShoppingCart.objects.filter(author=self.user).count(),
+                         3)
+        self.assertTrue(ShoppingCart.objects.filter(author=other).exists())
+
+    def test_bad_change_is_dropped(self):
+        other = create_user('other')
+        append(Favorite, self.user.pk, [(self.recipes[0].pk, 1)])
+        append(Favorite, other.pk, [(self.recipes[1].pk, 1)])
+        insert_list_rows = services.insert_list_rows
+
+        def insert(model, author, recipe_ids):
+            if author.pk == other.pk:
+                # As for a user purged after the change was journaled.
+                raise IntegrityError
+            return insert_list_rows(model, author, recipe_ids)
+
+        with mock.patch('api.services.insert_list_rows', insert), \
+                self.assertLogs('api.write_behind', 'ERROR'):
+            self.assertEqual(flush(block=True), 2)
+        self.assertEqual(
+            list(Favorite.objects.values_list('author', 'recipe')),
+            [(self.user.pk, self.recipes[0].pk)])
+        self.assertEqual(segment_paths(), [])
+
+    def test_segment_of_a_crashed_flush(self):
+        append(Favorite, self.user.pk, [(self.recipes[0].pk, 1)])
+        write_behind.rotate()
+        segment, = segment_paths()
+        # Applied, but not removed before the crash.
+        with open(segment, 'rb') as file:
+            write_behind.apply(file.read())
+        append(Favorite, self.user.pk, [(self.recipes[1].pk, 1)])
+        self.assertEqual(pending(self.user.pk),
+                         {Favorite: {recipe.pk: 1
+                                     for recipe in self.recipes[:2]}})
+        self.assertEqual(flush(block=True), 2)
+        self.assertEqual(segment_paths(), [])
+        self.assertEqual(Favorite.objects.count(), 2)
+
+    def test_torn_write(self):
+        append(Favorite, self.user.pk, [(self.recipes[0].pk, 1)])
+        with open(WRITE_BEHIND_SETTINGS['JOURNAL'], 'ab') as journal:
+            journal.write(b'f %d %d' % (self.user.pk, self.recipes[1].pk))
+        self.assertEqual(pending(self.user.pk),
+                         {Favorite: {self.recipes[0].pk: 1}})
+        append(Favorite, self.user.pk, [(self.recipes[2].pk, 1)])
+        with self.assertLogs('api.write_behind', 'ERROR'):
+            self.assertEqual(flush(block=True), 2)
+        self.assertEqual(
+            set(Favorite.objects.values_list('recipe', flat=True)),
+            {self.recipes[0].pk, self.recipes[2].pk})
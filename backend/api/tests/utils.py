@@ -0,0 +1,67 @@
+"""Helpers shared by the api tests."""
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import override_settings
+
+from posts.models import Ingredient, IngredientRecipe, Recipe
+from users.models import User
+
+# 1x1 PNG, as sent by the frontend.
+PNG = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAA'
+       'AC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=')
+
+
+def create_user(username, **fields):
+    return User.objects.create_user(
+        email=f'{username}@example.com', username=username, password='pass',
+        first_name=username.title(), last_name='User', **fields)
+
+
+def create_recipe(author, name, tags=(), ingredients=(), **fields):
+    """A recipe with the tags and {ingredient: amount} ingredients."""
+    fields = {'text': 'Text', 'cooking_time': 10,
+              'image': 'recipes/images/recipe.png', **fields}
+    recipe = Recipe.objects.create(author=author, name=name, **fields)
+    recipe.tags.set(tags)
+    for ingredient, amount in dict(ingredients).items():
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=amount)
+    return recipe
+
+
+def create_ingredients(*names, unit='г'):
+    return [Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name in names]
+
+
+class TempMediaMixin:
+    """MEDIA_ROOT in a temporary directory removed after the tests."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class NoThrottleMixin:
+    """
+    Requests are not throttled: the buckets are kept in THROTTLING['STORE'],
+    which outlives the test database, by user id.
+    """
+
+    def setUp(self):
+        throttle = mock.patch('api.throttling.CostThrottle.allow_request',
+                              return_value=True)
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        super().setUp()
@@ -0,0 +1,265 @@
+"""
+Cost-aware throttling and load shedding.
+
+The token buckets and the shed counters live in a SQLite file of the
+host (THROTTLING['STORE']) shared by its worker processes. A request
+takes its tokens with one INSERT ... ON CONFLICT DO UPDATE ...
+RETURNING, atomic under the database write lock: concurrent requests
+of a client cannot spend the same tokens, and no bucket is evicted
+while it is not full. The file is not synced (synchronous=OFF), so a
+crash of the host may only refill some buckets.
+"""
+import fcntl
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_SETTINGS = {
+    'STORE': os.path.join(tempfile.gettempdir(), 'foodgram-throttle',
+                          'buckets.sqlite3'),
+    # scope -> (bucket capacity, tokens refilled per second)
+    'BUCKETS': {'user': (60, 1.0), 'anon': (30, 0.5)},
+    # view action -> tokens per request, 1 by default
+    'COSTS': {},
+    # list pages past every DEEP_PAGE pages cost one more token
+    'DEEP_PAGE': 10,
+    # every megabyte of request body costs one more token
+    'BODY_COST_BYTES': 1024 * 1024,
+    # view action -> requests run at once on this host
+    'CONCURRENCY': {},
+    'LOCK_DIR': os.path.join(tempfile.gettempdir(), 'foodgram-slots'),
+    'RETRY_AFTER': 1,
+    # full buckets are deleted every PRUNE_EVERY requests of a process
+    'PRUNE_EVERY': 1000,
+}
+THROTTLING_SETTINGS.update(getattr(settings, 'THROTTLING', {}))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (
+    key TEXT PRIMARY KEY, tokens REAL NOT NULL, stamp REAL NOT NULL,
+    full_at REAL NOT NULL, allowed INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS bucket_full_at ON bucket (full_at);
+CREATE TABLE IF NOT EXISTS shed (
+    key TEXT PRIMARY KEY, count INTEGER NOT NULL);
+"""
+
+# Tokens of the bucket refilled up to :now, in the upsert below.
+REFILLED = 'min(:capacity, tokens + max(0, :now - stamp) * :refill)'
+
+TAKE_SQL = f"""
+INSERT INTO bucket (key, tokens, stamp, full_at, allowed)
+VALUES (:key, :capacity - :cost, :now, :full_at, 1)
+ON CONFLICT (key) DO UPDATE SET
+    allowed = {REFILLED} >= :cost,
+    tokens = {REFILLED}
+        - CASE WHEN {REFILLED} >= :cost THEN :cost ELSE 0 END,
+    stamp = :now,
+    full_at = :full_at
+RETURNING allowed, tokens
+"""
+
+
+class BucketStore:
+    """The SQLite store, one connection per process and thread."""
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None,
+                check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(SCHEMA)
+            local.connection, local.pid, local.requests = (
+                connection, os.getpid(), 0)
+        return local.connection
+
+    def take(self, key, capacity, refill, cost):
+        """
+        Take cost tokens of the bucket if it has them. Returns whether
+        it had, and the tokens left.
+        """
+        connection = self.connection()
+        now = time.time()
+        # fetchall(): the upsert holds the write lock until its
+        # RETURNING rows are all read.
+        (allowed, tokens), = connection.execute(TAKE_SQL, {
+            'key': key, 'capacity': capacity, 'refill': refill,
+            'cost': cost, 'now': now,
+            'full_at': now + capacity / refill}).fetchall()
+        self.local.requests += 1
+        if self.local.requests % THROTTLING_SETTINGS['PRUNE_EVERY'] == 0:
+            # A bucket full again is the same as no bucket.
+            connection.execute('DELETE FROM bucket WHERE full_at < ?', (now,))
+        return bool(allowed), tokens
+
+    def count_shed(self, key):
+        self.connection().execute(
+            'INSERT INTO shed (key, count) VALUES (?, 1) '
+            'ON CONFLICT (key) DO UPDATE SET count = count + 1', (key,))
+
+    def shed_counts(self):
+        return dict(self.connection().execute(
+            'SELECT key, count FROM shed'))
+
+    def reset_shed(self):
+        self.connection().execute('DELETE FROM shed')
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = BucketStore(THROTTLING_SETTINGS['STORE'])
+    return _store
+
+
+def get_action(request, view):
+    return getattr(view, 'action', None) or request.method.lower()
+
+
+def record_shed(reason, action):
+    """
+    Count a rejected request per reason (throttled / overloaded) and
+    action.
+    """
+    logger.warning('Request shed: %s %s', reason, action)
+    get_store().count_shed(f'{reason}:{action}')
+
+
+def shed_stats():
+    return get_store().shed_counts()
+
+
+class CostThrottle(BaseThrottle):
+    """
+    Token bucket per user (per IP for anonymous requests), refilled
+    continuously. Each request takes the cost of its view action
+    (THROTTLING['COSTS']), raised for deep list pages and large bodies
+    such as base64 images. Rejected requests get 429 with Retry-After.
+    """
+    def __init__(self):
+        self.retry_after = None
+
+    def get_cost(self, request, view):
+        cost = THROTTLING_SETTINGS['COSTS'].get(get_action(request, view), 1)
+        page = request.query_params.get('page', '')
+        if page.isdigit():
+            cost += int(page) // THROTTLING_SETTINGS['DEEP_PAGE']
+        length = request.META.get('CONTENT_LENGTH') or ''
+        if length.isdigit():
+            cost += int(length) // THROTTLING_SETTINGS['BODY_COST_BYTES']
+        return cost
+
+    def allow_request(self, request, view):
+        if request.user.is_authenticated:
+            scope, ident = 'user', request.user.pk
+        else:
+            scope, ident = 'anon', self.get_ident(request)
+        capacity, refill = THROTTLING_SETTINGS['BUCKETS'][scope]
+        cost = min(self.get_cost(request, view), capacity)
+        allowed, tokens = get_store().take(
+            f'{scope}:{ident}', capacity, refill, cost)
+        if not allowed:
+            self.retry_after = (cost - tokens) / refill
+            record_shed('throttled', get_action(request, view))
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, try again later.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait):
+        super().__init__()
+        # DRF exception_handler turns wait into Retry-After.
+        self.wait = wait
+
+
+class SlotLimiter:
+    """
+    At most `slots` holders at once across all worker processes of the
+    host: a slot is an exclusive non-blocking flock on one of `slots`
+    lock files, released by the kernel if the process dies.
+    """
+    def __init__(self, name, slots):
+        self.paths = [
+            os.path.join(THROTTLING_SETTINGS['LOCK_DIR'], f'{name}.{slot}')
+            for slot in range(slots)]
+
+    def acquire(self):
+        """Returns the open lock file of the slot, or None if all busy."""
+        os.makedirs(THROTTLING_SETTINGS['LOCK_DIR'], exist_ok=True)
+        for path in self.paths:
+            file = open(path, 'a')
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                continue
+            return file
+        return None
+
+    @staticmethod
+    def release(file):
+        fcntl.flock(file, fcntl.LOCK_UN)
+        file.close()
+
+
+limiters = {}
+
+
+def get_limiter(action):
+    slots = THROTTLING_SETTINGS['CONCURRENCY'].get(action)
+    if not slots:
+        return None
+    if action not in limiters:
+        limiters[action] = SlotLimiter(action, slots)
+    return limiters[action]
+
+
+class LoadSheddingMixin:
+    """
+    Viewset mixin limiting how many requests of the heavy actions
+    (THROTTLING['CONCURRENCY']) run at once; the rest are rejected at
+    once with 503 and Retry-After instead of queueing for a worker.
+    """
+    _slot = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        action = get_action(request, self)
+        limiter = get_limiter(action)
+        if limiter is None:
+            return
+        self._slot = limiter.acquire()
+        if self._slot is None:
+            record_shed('overloaded', action)
+            raise Overloaded(THROTTLING_SETTINGS['RETRY_AFTER'])
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._slot is not None:
+            SlotLimiter.release(self._slot)
+            self._slot = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -6,20 +6,41 @@ from rest_framework.permissions import AllowAny
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 
 from posts.models import (Recipe, Tag, Ingredient,
                           Favorite, ShoppingCart, User)
 from api.serializers import (RecipeListSerializer, TagSerializer,
                              IngredientSerializer, FavoriteSerializer,
-                             ShoppingCartSerializer, RecipeWriteSerializer)
-from api.services import shopping_cart
+                             ShoppingCartSerializer, RecipeWriteSerializer,
+                             RecipeIdsSerializer)
+from api.changes import (CONTENT_TYPE, feed_horizon, feed_params,
+                         sequence_changes, stream_changes)
+from api.documents import (documents_enabled, recipes_for_documents,
+                           refresh_recipe_documents, render_recipe_list,
+                           render_recipes, splice_results)
+from api.deletion import purge_deleted_task, soft_delete_recipes
+from api.fieldsets import requested_fields
+from api.idempotency import IdempotencyMixin
+from api.imports import import_recipes
+from api.profiling import ProfiledViewMixin
+from api.throttling import LoadSheddingMixin
+from api.write_behind import flush, pending
+from api.services import (shopping_cart, bulk_add_recipes,
+                          bulk_remove_recipes, add_to_list,
+                          remove_from_list, recipes_for_reading)
 from api.permissions import IsOwnerOrAdminOrReadOnly
 from api.filters import IngredientSearchFilter, RecipeFilter
 from api.paginations import ApiPagination
 
 
-class TagViewSet(mixins.ListModelMixin,
+def json_response(body):
+    return HttpResponse(body, content_type='application/json')
+
+
+class TagViewSet(ProfiledViewMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     """Operations with Tag model"""
@@ -28,7 +49,8 @@ class TagViewSet(mixins.ListModelMixin,
     permission_classes = (AllowAny, )
 
 
-class IngredientViewSet(mixins.ListModelMixin,
+class IngredientViewSet(ProfiledViewMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     """Operations with Ingredient model"""
@@ -39,49 +61,101 @@ class IngredientViewSet(mixins.ListModelMixin,
     search_fields = ('^name',)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ProfiledViewMixin, LoadSheddingMixin, IdempotencyMixin,
+                    viewsets.ModelViewSet):
     """Recipe model viewset: [GET, POST, DELETE, PATCH]."""
     queryset = Recipe.objects.all()
+    # Ids only: a non-numeric id is a 404, not a 500 of the lookups.
+    lookup_value_regex = r'\d+'
+    idempotent_actions = ('create', 'partial_update',
+                          'favorite', 'shopping_cart')
     permission_classes = (IsOwnerOrAdminOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     pagination_class = ApiPagination
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        recipes = super().get_queryset()
+        if self.request.method in SAFE_METHODS:
+            recipes = recipes.published()
+            if documents_enabled(self.request):
+                return recipes_for_documents(recipes, self.request.user)
+            return recipes_for_reading(
+                recipes, self.request.user,
+                requested_fields(self.request, RecipeListSerializer))
+        return recipes
+
+    def list(self, request, *args, **kwargs):
+        """Served from the precomputed recipe documents if enabled."""
+        if not documents_enabled(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return json_response(render_recipe_list(queryset, request))
+        return json_response(splice_results(
+            self.paginator.get_paginated_response([]).data,
+            render_recipe_list(page, request)))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not documents_enabled(request):
+            return super().retrieve(request, *args, **kwargs)
+        return json_response(
+            render_recipes([self.get_object()], request)[0])
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        refresh_recipe_documents(
+            Recipe.objects.filter(pk=serializer.instance.pk))
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        refresh_recipe_documents(
+            Recipe.objects.filter(pk=serializer.instance.pk))
+
+    def perform_destroy(self, instance):
+        """Soft delete, the rows are purged in the background."""
+        soft_delete_recipes([instance.pk])
+        purge_deleted_task.enqueue()
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeListSerializer
         return RecipeWriteSerializer
 
-    @action(detail=True,
-            methods=['post', 'delete'],
-            permission_classes=[IsAuthenticated])
-    def favorite(self, request, *args, **kwargs):
+    def update_list(self, request, model, serializer_class, removed_message):
         """
-        Retrieve / Add / Remove a recipe
-        from the current user's favorites.
+        Add / Remove a recipe to / from one of the user's lists.
+        Relies on the unique constraint of the list model, so each
+        action issues a single write query.
         """
-        recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
-        user = self.request.user
+        user = request.user
         if request.method == 'POST':
-            if Favorite.objects.filter(author=user,
-                                       recipe=recipe).exists():
+            recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
+            if not add_to_list(model, user, recipe.pk):
                 return Response({'errors': 'Recipe already added!'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            serializer = FavoriteSerializer(data=request.data)
-            if serializer.is_valid(raise_exception=True):
-                serializer.save(author=user, recipe=recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(serializer.errors,
-                            status=status.HTTP_400_BAD_REQUEST)
-        if not Favorite.objects.filter(author=user,
-                                       recipe=recipe).exists():
+            serializer = serializer_class(model(author=user, recipe=recipe))
+            return Response(serializer.data,
+                            status=status.HTTP_201_CREATED)
+        if not remove_from_list(model, user, self.kwargs.get('pk')):
             return Response({'errors': 'Object not found'},
                             status=status.HTTP_404_NOT_FOUND)
-        Favorite.objects.get(recipe=recipe).delete()
-        return Response('Recipe successfully removed from favorites.',
+        return Response(removed_message,
                         status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated])
+    def favorite(self, request, *args, **kwargs):
+        """
+        Retrieve / Add / Remove a recipe
+        from the current user's favorites.
+        """
+        return self.update_list(
+            request, Favorite, FavoriteSerializer,
+            'Recipe successfully removed from favorites.')
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
@@ -90,27 +164,71 @@ class RecipeViewSet(viewsets.ModelViewSet):
         Retrieve / Add / Remove a recipe
         from the current user's shopping cart.
         """
-        recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
-        user = self.request.user
+        return self.update_list(
+            request, ShoppingCart, ShoppingCartSerializer,
+            'Recipe successfully removed from the shopping cart.')
+
+    def bulk_update_list(self, request, model):
+        """Add / Remove several recipes from one of the user's lists."""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
         if request.method == 'POST':
-            if ShoppingCart.objects.filter(author=user,
-                                           recipe=recipe).exists():
-                return Response({'errors': 'Recipe already added!'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            serializer = ShoppingCartSerializer(data=request.data)
-            if serializer.is_valid(raise_exception=True):
-                serializer.save(author=user, recipe=recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(serializer.errors,
+            results = bulk_add_recipes(model, request.user, recipe_ids)
+        else:
+            results = bulk_remove_recipes(model, request.user, recipe_ids)
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated])
+    def bulk_favorite(self, request):
+        """Add / Remove a list of recipes to / from the user's favorites."""
+        return self.bulk_update_list(request, Favorite)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated])
+    def bulk_shopping_cart(self, request):
+        """
+        Add / Remove a list of recipes
+        to / from the user's shopping cart.
+        """
+        return self.bulk_update_list(request, ShoppingCart)
+
+    @action(detail=False,
+            methods=['post'],
+            url_path='import',
+            permission_classes=[IsAuthenticated])
+    def import_recipes(self, request):
+        """
+        Import the current user's recipes from an NDJSON body,
+        one recipe per line (see api.imports).
+        """
+        if request.stream is None:
+            return Response({'errors': 'No recipes to import.'},
                             status=status.HTTP_400_BAD_REQUEST)
-        if not ShoppingCart.objects.filter(author=user,
-                                           recipe=recipe).exists():
-            return Response({'errors': 'Object not found'},
-                            status=status.HTTP_404_NOT_FOUND)
-        ShoppingCart.objects.get(recipe=recipe).delete()
-        return Response('Recipe successfully removed from the shopping cart.',
-                        status=status.HTTP_204_NO_CONTENT)
+        return Response(import_recipes(request.stream, request.user),
+                        status=status.HTTP_200_OK)
+
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=[AllowAny])
+    def changes(self, request):
+        """
+        NDJSON stream of the recipe changes after ?cursor=
+        for sync clients (see api.changes).
+        """
+        cursor, limit = feed_params(request)
+        sequence_changes()
+        horizon = feed_horizon()
+        if 0 < cursor < horizon:
+            return Response(
+                {'errors': 'Cursor expired, sync again from cursor 0.',
+                 'horizon': horizon},
+                status=status.HTTP_410_GONE)
+        return StreamingHttpResponse(
+            stream_changes(cursor, limit, request), content_type=CONTENT_TYPE)
 
     @action(detail=False,
             methods=['get'],
@@ -121,6 +239,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         with aggregated data.
         """
         author = User.objects.get(id=self.request.user.pk)
+        if pending(author.pk).get(ShoppingCart):
+            # The cart totals are updated when the changes are written.
+            flush(block=True)
         if author.shopping_cart.exists():
             return shopping_cart(self, request, author)
         return Response('Shopping cart is empty.',
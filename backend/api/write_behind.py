@@ -0,0 +1,457 @@
+"""
+Write-behind of the favorites and shopping carts (optional).
+
+With WRITE_BEHIND['ENABLED'] adding or removing a recipe does not write
+the row in the request: the change is appended to a journal file of the
+host and fsync'ed, then acknowledged; concurrent writers share an fsync
+(group commit). A flusher thread of the workers
+applies the journal every FLUSH_INTERVAL seconds, in transactions of up
+to BATCH_SIZE changes. Only the last change of a recipe in a user list
+is written, and none if it undoes the first one: an add and a remove
+between two flushes cancel out. Rows are written by
+api.services.insert_list_rows / delete_list_rows, so the cart totals,
+the author stats and the bus events (caches, event streams) follow at
+the flush.
+
+Until then the is_favorited / is_in_shopping_cart flags and filters of
+the user overlay the pending changes read from the journal (parsed
+incrementally into an index of the process), so users see their own
+writes; the shopping list download flushes first. The
+workers of a host share the journal, and the requests of a user must
+reach the same host (sticky sessions) to see their writes before the
+flush.
+
+The journal is rotated into segment files under a lock held for the
+whole flush; the segments left by a crashed flush are applied by the
+next one. A segment is applied as "in the list" / "not in the list"
+per recipe, so applying it again does not change anything.
+"""
+import fcntl
+import glob
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import (DataError, IntegrityError, close_old_connections,
+                       transaction)
+from django.db.models import BooleanField, Case, Exists, OuterRef, Value, When
+
+from posts.models import Favorite, ShoppingCart
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_SETTINGS = {
+    'ENABLED': False,
+    'JOURNAL': '/tmp/foodgram-journal/lists.journal',
+    'FLUSH_INTERVAL': 0.2,
+    'BATCH_SIZE': 2000,
+    'FSYNC': True,
+}
+WRITE_BEHIND_SETTINGS.update(getattr(settings, 'WRITE_BEHIND', {}))
+
+# Journal lines: b'<model code> <user id> <recipe id> <+1 | -1>\n'
+CODES = {Favorite: b'f', ShoppingCart: b'c'}
+MODELS = {code: model for model, code in CODES.items()}
+SEGMENT_SUFFIX = '.segment'
+
+
+def enabled():
+    return WRITE_BEHIND_SETTINGS['ENABLED']
+
+
+def journal_size():
+    try:
+        return os.path.getsize(WRITE_BEHIND_SETTINGS['JOURNAL'])
+    except FileNotFoundError:
+        return 0
+
+
+def segment_paths():
+    return sorted(glob.glob(
+        glob.escape(WRITE_BEHIND_SETTINGS['JOURNAL']) + '.*'
+        + SEGMENT_SUFFIX))
+
+
+@contextmanager
+def locked_journal(lock):
+    """The journal file, locked; reopened if it was rotated meanwhile."""
+    path = WRITE_BEHIND_SETTINGS['JOURNAL']
+    while True:
+        file = open(path, 'a+b')
+        fcntl.flock(file, lock)
+        try:
+            if os.fstat(file.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        file.close()
+    try:
+        yield file
+    finally:
+        file.close()
+
+
+def append(model, user_id, changes):
+    """
+    Journal (recipe id, +1 / -1) changes of a user list. Returns once
+    they are fsync'ed, by group commit (see sync).
+    """
+    data = b''.join(
+        b'%s %d %d %+d\n' % (CODES[model], user_id, recipe_id, sign)
+        for recipe_id, sign in changes)
+    os.makedirs(os.path.dirname(WRITE_BEHIND_SETTINGS['JOURNAL']),
+                exist_ok=True)
+    with locked_journal(fcntl.LOCK_EX) as file:
+        if not file.seek(0, os.SEEK_END):
+            # Tells this journal from a later one reusing its inode.
+            data = b'# %d %d\n' % (time.time_ns(), os.getpid()) + data
+        else:
+            # After a write torn by a crash, start on a new line.
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                data = b'\n' + data
+        file.write(data)
+        file.flush()
+        end = file.tell()
+        # Kept open to fsync it, even if it is rotated meanwhile.
+        descriptor = os.dup(file.fileno())
+        fcntl.flock(file, fcntl.LOCK_UN)
+    try:
+        if WRITE_BEHIND_SETTINGS['FSYNC']:
+            sync(descriptor, end)
+    finally:
+        os.close(descriptor)
+    ensure_flushing()
+
+
+def sync(descriptor, end):
+    """
+    Group commit: make the journal durable up to the end offset.
+    Writers append without syncing, then wait on the sync lock while
+    another writer fsyncs. That writer fsyncs everything written so far
+    and records the synced inode and offset in the lock file: the
+    writers it covered return without an fsync of their own, the
+    others elect the next writer. An fsync costs the same for one write
+    as for a batch.
+    """
+    inode = os.fstat(descriptor).st_ino
+    lock = os.open(WRITE_BEHIND_SETTINGS['JOURNAL'] + '.sync',
+                   os.O_RDWR | os.O_CREAT, 0o644)
+
+    def synced():
+        synced = os.pread(lock, 64, 0).split()
+        return (len(synced) == 2 and int(synced[0]) == inode
+                and int(synced[1]) >= end)
+
+    try:
+        # Shared: all the waiters see the result of the fsync at once.
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        if synced():
+            return
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if synced():
+            return
+        size = os.fstat(descriptor).st_size
+        os.fsync(descriptor)
+        os.pwrite(lock, b'%d %d' % (inode, size) + b' ' * 24, 0)
+    finally:
+        os.close(lock)
+
+
+def parse(data):
+    """(model code, user id, recipe id, sign) of the journal lines."""
+    lines = data.split(b'\n')
+    # An unterminated last line is a write that was never acknowledged.
+    for line in lines[:-1]:
+        if line.startswith(b'#'):
+            continue
+        try:
+            code, user_id, recipe_id, sign = line.split()
+            yield code, int(user_id), int(recipe_id), int(sign)
+        except ValueError:
+            logger.error('Skipped a damaged journal line: %r', line)
+
+
+def coalesce(chunks, user_id=None, cancel=False):
+    """
+    {(model code, user id, recipe id): +1 / -1}, the last change of each
+    recipe. Changes are journaled only if they change the list, so a
+    last change undoing the first one restores the state before them:
+    with cancel, such recipes are left out.
+    """
+    first, last = {}, {}
+    for chunk in chunks:
+        for code, user, recipe_id, sign in parse(chunk):
+            if user_id is None or user == user_id:
+                first.setdefault((code, user, recipe_id), sign)
+                last[code, user, recipe_id] = sign
+    return {key: sign for key, sign in last.items()
+            if not cancel or sign == first[key]}
+
+
+def _open(path):
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+
+class FileIndex:
+    """Last change of each recipe of each user in one journal file."""
+    def __init__(self):
+        self.header = None
+        self.offset = 0
+        self.tail = b''
+        self.users = defaultdict(dict)
+
+    def read(self, file, size):
+        """Parse the lines appended since the last read."""
+        file.seek(self.offset)
+        data = self.tail + file.read(size - self.offset)
+        self.offset = size
+        if self.header is None and data.startswith(b'#'):
+            self.header = data[:data.find(b'\n') + 1] or None
+        # A line still being written is parsed at the next read.
+        lines = data.rfind(b'\n') + 1
+        self.tail = data[lines:]
+        for code, user_id, recipe_id, sign in parse(data[:lines]):
+            self.users[user_id][code, recipe_id] = sign
+
+    def is_file(self, file, size):
+        """Whether the file is still the one indexed (inodes are reused)."""
+        if size < self.offset:
+            return False
+        return self.header is None or os.pread(
+            file.fileno(), len(self.header), 0) == self.header
+
+
+class JournalIndex:
+    """
+    Pending changes per user, kept by the process: the journal and the
+    segments are parsed incrementally, from the offset reached at the
+    previous read, and indexed by inode (a rotated journal keeps its
+    inode as a segment). Files applied and removed are dropped.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def open_files(self):
+        """
+        The segments and the journal, oldest first. The journal is
+        opened first: rotated meanwhile, it is one of the segments (the
+        same inode, indexed once); a segment applied and removed
+        meanwhile is in the tables.
+        """
+        journal = _open(WRITE_BEHIND_SETTINGS['JOURNAL'])
+        segments = [_open(path) for path in segment_paths()]
+        return [file for file in segments + [journal] if file is not None]
+
+    def pending(self, user_id):
+        changes = {}
+        with self.lock:
+            files = self.open_files()
+            indexed = {}
+            try:
+                for file in files:
+                    stat = os.fstat(file.fileno())
+                    if stat.st_ino in indexed:
+                        continue
+                    index = self.files.get(stat.st_ino)
+                    if index is None or not index.is_file(file, stat.st_size):
+                        index = FileIndex()
+                    if stat.st_size > index.offset:
+                        index.read(file, stat.st_size)
+                    indexed[stat.st_ino] = index
+                    changes.update(index.users.get(user_id, {}))
+            finally:
+                for file in files:
+                    file.close()
+            self.files = indexed
+        return changes
+
+
+journal_index = JournalIndex()
+
+
+def pending(user_id):
+    """{model: {recipe id: +1 / -1}} changes of the user not yet written."""
+    if not enabled():
+        return {}
+    if not (journal_size() or segment_paths()):
+        return {}
+    changes = defaultdict(dict)
+    for (code, recipe_id), sign in journal_index.pending(user_id).items():
+        changes[MODELS[code]][recipe_id] = sign
+    return changes
+
+
+def list_flag(model, user, changes=None):
+    """
+    Whether the recipe is in the user list, for annotations: Exists(),
+    overridden for the recipes with pending changes.
+    """
+    flag = Exists(model.objects.filter(author=user, recipe=OuterRef('pk')))
+    if not changes:
+        return flag
+    whens = []
+    for sign in (1, -1):
+        recipe_ids = [recipe_id for recipe_id, change in changes.items()
+                      if change == sign]
+        if recipe_ids:
+            whens.append(When(pk__in=recipe_ids, then=Value(sign > 0)))
+    return Case(*whens, default=flag, output_field=BooleanField())
+
+
+def list_flags(user):
+    """list_flag of the favorites and the shopping cart."""
+    changes = pending(user.pk)
+    return {model: list_flag(model, user, changes.get(model))
+            for model in CODES}
+
+
+def listed(model, user_id, recipe_ids):
+    """Ids of the recipes in the user list, pending changes included."""
+    changes = pending(user_id).get(model, {})
+    rows = model.objects.filter(
+        author_id=user_id,
+        recipe_id__in=[recipe_id for recipe_id in recipe_ids
+                       if recipe_id not in changes])
+    return set(rows.values_list('recipe_id', flat=True)) | {
+        recipe_id for recipe_id in recipe_ids if changes.get(recipe_id) == 1}
+
+
+def journal_changes(model, user_id, recipe_ids, sign):
+    """
+    Journal adding (sign=1) / removing (sign=-1) recipes to / from a
+    user list, skipping those already in / not in it. Returns the ids
+    of the journaled changes.
+    """
+    present = listed(model, user_id, recipe_ids)
+    changed = [recipe_id for recipe_id in recipe_ids
+               if (recipe_id in present) != (sign > 0)]
+    if changed:
+        append(model, user_id, [(recipe_id, sign) for recipe_id in changed])
+    return changed
+
+
+def rotate():
+    """Move the journal to a new segment, if it has changes."""
+    path = WRITE_BEHIND_SETTINGS['JOURNAL']
+    if not journal_size():
+        return
+    with locked_journal(fcntl.LOCK_EX) as file:
+        if os.fstat(file.fileno()).st_size:
+            os.rename(path, f'{path}.{time.time_ns()}{SEGMENT_SUFFIX}')
+
+
+def apply(data):
+    """Write the changes of a segment. Returns the number of changes."""
+    # Imported here: api.services reads the pending changes.
+    from api.services import delete_list_rows, insert_list_rows
+
+    groups = defaultdict(list)
+    changes = coalesce([data], cancel=True)
+    for (code, user_id, recipe_id), sign in changes.items():
+        groups[MODELS[code], user_id, sign].append(recipe_id)
+    batches, batch, size = [], [], 0
+    for group in groups.items():
+        batch.append(group)
+        size += len(group[1])
+        if size >= WRITE_BEHIND_SETTINGS['BATCH_SIZE']:
+            batches.append(batch)
+            batch, size = [], 0
+    batches.append(batch)
+
+    def write(batch):
+        with transaction.atomic():
+            for (model, user_id, sign), recipe_ids in batch:
+                write_rows = (insert_list_rows if sign > 0
+                              else delete_list_rows)
+                write_rows(model, User(pk=user_id), recipe_ids)
+
+    for batch in batches:
+        try:
+            write(batch)
+        except (DataError, IntegrityError):
+            # One bad change (e.g. of a purged user) must not hold back
+            # the others: retry them one list at a time. Other errors
+            # (database down) keep the segment for the next flush.
+            logger.exception('Write-behind batch failed, retrying by list')
+            for group in batch:
+                try:
+                    write([group])
+                except (DataError, IntegrityError):
+                    logger.exception('Dropped write-behind changes: %s',
+                                     group)
+    return sum(len(recipe_ids) for recipe_ids in groups.values())
+
+
+def flush(block=False):
+    """
+    Apply the journal. Returns the number of changes written, or None
+    if another process is flushing (and not block).
+    """
+    path = WRITE_BEHIND_SETTINGS['JOURNAL']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return None
+        rotate()
+        written = 0
+        for segment in segment_paths():
+            with open(segment, 'rb') as file:
+                written += apply(file.read())
+            os.remove(segment)
+        return written
+
+
+class Flusher(threading.Thread):
+    """Daemon thread applying the journal every FLUSH_INTERVAL seconds."""
+    def __init__(self):
+        super().__init__(daemon=True, name='write-behind')
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(WRITE_BEHIND_SETTINGS['FLUSH_INTERVAL']):
+            try:
+                flush()
+            except Exception:
+                logger.exception('Write-behind flush failed')
+            finally:
+                close_old_connections()
+
+
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def ensure_flushing():
+    """Start the flusher of this process (see api.bus.ensure_listening)."""
+    global _flusher, _flusher_pid
+    if _flusher_pid == os.getpid():
+        return _flusher
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher = Flusher()
+            _flusher.start()
+            _flusher_pid = os.getpid()
+    return _flusher
+
+
+class WriteBehindMiddleware:
+    """Starts the flusher, so a restarted host applies what is left."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        ensure_flushing()
+        return self.get_response(request)
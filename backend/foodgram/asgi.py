@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are ready: serves /api/events/ (api.events).
+from api.events import EventStreamApplication  # noqa: E402
+
+application = EventStreamApplication(django_application)
@@ -48,10 +48,12 @@ INSTALLED_APPS = [
     'django_filters',
     'posts',
     'api',
-    'users'
+    'users',
+    'tasks',
 ]
 
 MIDDLEWARE = [
+    'api.bus.InvalidationBusMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +63,38 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Cache invalidation events between workers (api.bus): PostgreSQL
+# LISTEN/NOTIFY, or a polled event file with other databases.
+INVALIDATION_BUS = {
+    'BACKEND': os.getenv('INVALIDATION_BUS_BACKEND', 'auto'),
+    'CHANNEL': 'foodgram_invalidation',
+    'FILE': os.getenv('INVALIDATION_BUS_FILE',
+                      '/tmp/foodgram-invalidation.log'),
+    'POLL_INTERVAL': 0.5,
+    'LAG_WARNING': 1.0,
+}
+
+# N+1 / duplicate query reports (api.query_detector), staging only.
+QUERY_DETECTOR = {
+    'ENABLED': os.getenv('QUERY_DETECTOR', 'False') == 'True',
+    'THRESHOLD': 3,
+    'REPORT_DIR': os.path.join(BASE_DIR, 'query_reports'),
+}
+if QUERY_DETECTOR['ENABLED']:
+    MIDDLEWARE.insert(0, 'api.query_detector.QueryDetectorMiddleware')
+
+# Write-behind of favorites and shopping carts through a journal file
+# of the host (api.write_behind); the workers of a host share it.
+WRITE_BEHIND = {
+    'ENABLED': os.getenv('WRITE_BEHIND', 'False') == 'True',
+    'JOURNAL': os.getenv('WRITE_BEHIND_JOURNAL',
+                         os.path.join(BASE_DIR, 'journal', 'lists.journal')),
+    'FLUSH_INTERVAL': 0.2,
+    'BATCH_SIZE': 2000,
+}
+if WRITE_BEHIND['ENABLED']:
+    MIDDLEWARE.insert(1, 'api.write_behind.WriteBehindMiddleware')
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -94,6 +128,12 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT')
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # The concurrency tests (api/tests/test_concurrency.py) query from
+    # threads: an in-memory test database fails them with "database
+    # table is locked".
+    DATABASES['default']['TEST'] = {
+        'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
 
 
 
@@ -141,6 +181,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Generated files (shopping lists). With ACCEL_REDIRECT Django only
+# authorizes the download and nginx sends the file (X-Accel-Redirect).
+ACCEL_REDIRECT = os.getenv('ACCEL_REDIRECT', 'False') == 'True'
+EXPORTS_ROOT = os.path.join(BASE_DIR, 'exports')
+EXPORTS_ACCEL_URL = '/protected/exports/'
+
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
@@ -149,8 +195,136 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
+
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.CostThrottle',
+    ],
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('IDEMPOTENCY_CACHE_DIR',
+                              '/tmp/foodgram-idempotency'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Idempotency-Key header on the write actions (api.idempotency).
+IDEMPOTENCY = {
+    'CACHE_ALIAS': 'idempotency',
+    'TTL': 24 * 60 * 60,
+    'LOCK_TTL': 60,
+}
+
+# Server-sent events of the per-user lists, served under ASGI
+# (api.events, foodgram/asgi.py).
+EVENTS = {
+    'HEARTBEAT': 15,
+    'MAX_AGE': 60 * 60,
+    'MAX_CONNECTIONS': int(os.getenv('EVENTS_MAX_CONNECTIONS', 5000)),
+    'MAX_PER_USER': 5,
+    'RETRY_AFTER': 30,
+}
+
+# Cost-aware throttling and load shedding (api.throttling). Buckets
+# and shed counters are kept in a SQLite file shared by the workers
+# of the host.
+THROTTLING = {
+    'STORE': os.path.join(os.getenv('THROTTLE_DIR', '/tmp/foodgram-throttle'),
+                          'buckets.sqlite3'),
+    'BUCKETS': {'user': (120, 2.0), 'anon': (60, 1.0)},
+    'COSTS': {
+        'download_shopping_cart': 10,
+        'create': 5,
+        'update': 5,
+        'partial_update': 5,
+        'subscriptions': 2,
+        'changes': 5,
+        'import_recipes': 20,
+    },
+    'DEEP_PAGE': 10,
+    'CONCURRENCY': {
+        'download_shopping_cart': 4,
+        'create': 4,
+        'update': 4,
+        'partial_update': 4,
+        'import_recipes': 2,
+    },
+    'RETRY_AFTER': 1,
+}
+
+# Database-backed background task queue (tasks app).
+TASK_QUEUE = {
+    'BACKOFF_BASE': 5,
+    'BACKOFF_MAX': 3600,
+    'STALE_AFTER': 600,
+}
+
+# Precompiled read path of the list serializers (api.fast_serializers).
+FAST_SERIALIZERS = True
+
+# Serve recipe reads from precomputed JSON documents (api.documents).
+# Author / tag / ingredient edits rebuild them through the task queue.
+RECIPE_DOCUMENTS = os.getenv('RECIPE_DOCUMENTS', 'True') == 'True'
+
+# Bulk NDJSON recipe import (api.imports). Images are decoded
+# by the task queue from the pending files in PENDING_DIR, which must
+# not be served: keep it outside MEDIA_ROOT (nginx serves /media/).
+RECIPE_IMPORT = {
+    'CHUNK_SIZE': 500,
+    'MAX_RECORDS': 10000,
+    'PENDING_DIR': os.path.join(BASE_DIR, 'imports'),
+}
+
+# Soft deletion of users and recipes (api.deletion): rows are hidden
+# at once and purged by the task queue PURGE_AFTER seconds later.
+SOFT_DELETE = {
+    'PURGE_AFTER': int(os.getenv('SOFT_DELETE_PURGE_AFTER', 0)),
+    'BATCH_SIZE': 200,
+    'MAX_BATCHES': 50,
+}
+
+# Change feed of the recipes for sync clients (api.changes).
+# Compacted by manage.py compact_recipe_changes.
+CHANGE_FEED = {
+    'PAGE_SIZE': 1000,
+    'MAX_PAGE_SIZE': 10000,
+    'RETENTION_DAYS': 30,
+}
+
+# Sampling profiler of the API views (api.profiling). Superusers can
+# profile a request with the X-Profile header; SAMPLE_RATE profiles
+# a share of all requests. Reports: manage.py profile_report.
+PROFILING = {
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', 0)),
+    'INTERVAL': 0.005,
+    'DIR': os.path.join(BASE_DIR, 'profiles'),
+    'HEADER': 'X-Profile',
+}
+
+# Token -> user snapshots cache used by CachedTokenAuthentication.
+# CACHE_ALIAS names an entry of CACHES shared between workers (optional).
+TOKEN_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 60,
+    'CACHE_ALIAS': None,
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -0,0 +1,71 @@
+"""
+Lean settings profile for API-only workers.
+
+The API authenticates with tokens only, so the admin stack
+(sessions, CSRF, messages, clickjacking, template context processors)
+is dropped from the request path. Admin keeps running from
+foodgram.settings in a separate process / URL mount.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=foodgram.settings_api \
+        gunicorn foodgram.wsgi:application
+"""
+import os
+
+from .settings import *  # noqa: F401, F403
+from .settings import INSTALLED_APPS, REST_FRAMEWORK
+
+DEBUG = os.getenv('DEBUG', 'False') == 'True'
+
+SECRET_KEY = os.getenv('SECRET_KEY', SECRET_KEY)  # noqa: F405
+
+API_ONLY = True
+
+# Middleware and apps needed only by the admin / session based views.
+ADMIN_ONLY_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+)
+ADMIN_ONLY_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS
+                  if app not in ADMIN_ONLY_APPS]
+
+MIDDLEWARE = [
+    'api.bus.InvalidationBusMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+# Same order as in foodgram.settings.
+if QUERY_DETECTOR['ENABLED']:  # noqa: F405
+    MIDDLEWARE.insert(0, 'api.query_detector.QueryDetectorMiddleware')
+if WRITE_BEHIND['ENABLED']:  # noqa: F405
+    MIDDLEWARE.insert(1, 'api.write_behind.WriteBehindMiddleware')
+
+ROOT_URLCONF = 'foodgram.urls_api'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [],
+        },
+    },
+]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+    ],
+}
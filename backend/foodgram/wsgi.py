@@ -10,7 +10,13 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+# Import the URLconf (and with it the views) now instead of on the first
+# request: with gunicorn --preload this is done once in the master and
+# shared by the forked workers.
+get_resolver().url_patterns
@@ -1,50 +1,178 @@
 from django.contrib import admin
-
-from .models import (Favorite, Follow, Ingredient, IngredientRecipe,
-                     Recipe, ShoppingCart, Tag,)
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Count, Q
+from django.forms.models import BaseInlineFormSet
+
+from api.deletion import purge_deleted_task, soft_delete_recipes
+from api.documents import refresh_recipe_documents
+from api.paginations import EstimatedCountPaginator
+from .models import (AuthorStats, CartIngredient, Favorite, Follow,
+                     Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag,)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin for tables that grow with the number of users:
+    estimated counts instead of COUNT(*) on every changelist
+    and prefix-only search.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Case-sensitive prefix search (LIKE 'term%'), which is served by
+        the pattern_ops indexes of the indexed / unique search fields,
+        unlike the UPPER(...) LIKE of the default istartswith.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        query = Q()
+        for field in self.search_fields:
+            query |= Q(**{f'{field.lstrip("^")}__startswith': search_term})
+        return queryset.filter(query), False
+
+
+class SoftDeleteAdmin(LargeTableAdmin):
+    """
+    Base admin for soft-deleted models (api.deletion): deletes only
+    mark the rows, and the confirmation page lists the selected
+    objects instead of collecting all the related rows.
+    """
+    def soft_delete(self, objs):
+        raise NotImplementedError
+
+    def delete_model(self, request, obj):
+        self.soft_delete([obj])
+        purge_deleted_task.enqueue()
+
+    def delete_queryset(self, request, queryset):
+        self.soft_delete(list(queryset))
+        purge_deleted_task.enqueue()
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        return ([str(obj) for obj in objs],
+                {self.model._meta.verbose_name_plural: len(objs)},
+                set(), [])
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """
+    AutocompleteSelect rendering the selected option from the object
+    already loaded with the inline row (preloaded, set by the formset)
+    instead of a query per row.
+    """
+    preloaded = None
+
+    def optgroups(self, name, value, attr=None):
+        obj = self.preloaded
+        if obj is None or [str(v) for v in value] != [str(obj.pk)]:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name, obj.pk, self.choices.field.label_from_instance(obj), True,
+            len(options)))
+        return [(None, options, 0)]
+
+
+class IngredientsFormSet(BaseInlineFormSet):
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        if form.instance.ingredient_id is not None:
+            # The widget is wrapped by RelatedFieldWidgetWrapper.
+            widget = form.fields['ingredient'].widget.widget
+            widget.preloaded = form.instance.ingredient
 
 
 class IngredientsInline(admin.TabularInline):
     model = IngredientRecipe
-    extra = 3
+    formset = IngredientsFormSet
+    extra = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'ingredient':
+            kwargs['widget'] = PreloadedAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
-class FollowAdmin(admin.ModelAdmin):
+
+class FollowAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
-    list_filter = ('author',)
-    search_fields = ('user',)
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    search_fields = ('^user__username', '^author__username')
 
 
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdmin):
     list_display = ('author', 'recipe')
-    list_filter = ('author',)
-    search_fields = ('author',)
+    list_select_related = ('author', 'recipe')
+    autocomplete_fields = ('author', 'recipe')
+    search_fields = ('^author__username', '^recipe__name')
 
 
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(LargeTableAdmin):
     list_display = ('author', 'recipe')
-    list_filter = ('author',)
-    search_fields = ('author',)
+    list_select_related = ('author', 'recipe')
+    autocomplete_fields = ('author', 'recipe')
+    search_fields = ('^author__username', '^recipe__name')
+
+
+class CartIngredientAdmin(LargeTableAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_select_related = ('user', 'ingredient')
+    autocomplete_fields = ('user', 'ingredient')
+    search_fields = ('^user__username',)
+
+
+class AuthorStatsAdmin(LargeTableAdmin):
+    list_display = ('user', 'recipes_count', 'followers_count',
+                    'favorites_count')
+    list_select_related = ('user',)
+    readonly_fields = ('recipes_count', 'followers_count', 'favorites_count')
+    autocomplete_fields = ('user',)
+    search_fields = ('^user__username',)
 
 
-class IngredientRecipeAdmin(admin.ModelAdmin):
+class IngredientRecipeAdmin(LargeTableAdmin):
     list_display = ('id', 'recipe', 'ingredient', 'amount',)
-    list_filter = ('recipe', 'ingredient')
-    search_fields = ('name',)
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
+    search_fields = ('^recipe__name', '^ingredient__name')
 
 
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(SoftDeleteAdmin):
     list_display = ('id', 'author', 'name', 'pub_date', 'in_favorite', )
-    search_fields = ('name',)
-    list_filter = ('pub_date', 'author', 'name', 'tags')
-    filter_horizontal = ('ingredients',)
+    list_select_related = ('author',)
+    search_fields = ('^name',)
+    list_filter = ('pub_date', 'tags')
+    autocomplete_fields = ('author',)
     empty_value_display = '-empty-'
     inlines = [IngredientsInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorite_count=Count('favorite', distinct=True))
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_recipe_documents(Recipe.objects.filter(pk=form.instance.pk))
+
+    def soft_delete(self, objs):
+        soft_delete_recipes([obj.pk for obj in objs])
+
     def in_favorite(self, obj):
-        return obj.favorite.all().count()
+        return obj.favorite_count
 
     in_favorite.short_description = 'Favourite recipe'
+    in_favorite.admin_order_field = 'favorite_count'
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -53,10 +181,10 @@ class TagAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
 
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableAdmin):
     list_display = ('name', 'measurement_unit')
-    list_filter = ('name',)
-    search_fields = ('name',)
+    list_filter = ('measurement_unit',)
+    search_fields = ('^name',)
 
 
 admin.site.register(Recipe, RecipeAdmin)
@@ -66,3 +194,5 @@ admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(ShoppingCart, ShoppingCartAdmin)
+admin.site.register(CartIngredient, CartIngredientAdmin)
+admin.site.register(AuthorStats, AuthorStatsAdmin)
@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
 from django.db.models import Q, F
@@ -8,7 +9,7 @@ from users.models import User
 
 class Ingredient(models.Model):
     """Ingredients for recipes"""
-    name = models.TextField(blank=True)
+    name = models.TextField(blank=True, db_index=True)
     measurement_unit = models.TextField(blank=True)
 
     class Meta:
@@ -42,6 +43,12 @@ class Tag(models.Model):
         verbose_name='Unique slug',
         max_length=200, unique=True,
         help_text='Unique slug')
+    bit = models.PositiveSmallIntegerField(
+        verbose_name='Bit in recipe tag masks',
+        unique=True, null=True, editable=False)
+
+    # Recipe.tag_mask is a signed 64-bit integer.
+    MAX_BITS = 63
 
     class Meta:
         verbose_name = "Tag"
@@ -50,6 +57,36 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.bit = self.free_bit()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def free_bit(cls):
+        used = set(cls.objects.exclude(bit=None).values_list('bit', flat=True))
+        for bit in range(cls.MAX_BITS):
+            if bit not in used:
+                return bit
+        raise ValidationError(
+            f'No more than {cls.MAX_BITS} tags are supported.')
+
+
+class ActiveManager(models.Manager):
+    """Default manager leaving out soft-deleted rows (api.deletion)."""
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def published(self):
+        """
+        Without the imported recipes whose image is not decoded yet
+        (api.imports): every other recipe is saved with an image.
+        """
+        return self.exclude(image='')
+
 
 class Recipe(models.Model):
     """
@@ -88,18 +125,95 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         verbose_name='Publication date',
         auto_now_add=True)
+    tag_mask = models.BigIntegerField(
+        verbose_name='Tag bits',
+        default=0, db_index=True, editable=False,
+        help_text='OR of the bits of the recipe tags, '
+                  'kept in sync by posts.signals')
+    deleted_at = models.DateTimeField(
+        verbose_name='Deleted at',
+        null=True, blank=True, db_index=True, editable=False,
+        help_text='Hidden until purged by api.deletion')
+
+    objects = ActiveManager.from_queryset(RecipeQuerySet)()
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ['-id']
         default_related_name = 'recipe'
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
+        # Soft-deleted recipes free their names.
         constraints = [
             models.UniqueConstraint(
                 fields=['name', 'author'],
+                condition=Q(deleted_at=None),
                 name='unique_recipe')]
 
 
+class RecipeDocument(models.Model):
+    """
+    Precomputed viewer-independent JSON of a recipe, with the offsets
+    of the viewer dependent parts (api.documents).
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        primary_key=True,
+        related_name='document',
+        on_delete=models.CASCADE,
+        verbose_name='Recipe')
+    body = models.BinaryField(verbose_name='JSON document')
+    splices = models.JSONField(
+        default=list,
+        verbose_name='Offsets of the viewer dependent values')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Recipe document'
+        verbose_name_plural = 'Recipe documents'
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class RecipeChange(models.Model):
+    """
+    Change log of the recipes served by the change feed (api.changes).
+    The position, numbered in commit order after the commit, is the
+    feed cursor; recipe_id is kept after the recipe is deleted.
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    HORIZON = 'horizon'
+    KINDS = (
+        (UPSERT, 'Created or changed'),
+        (DELETE, 'Deleted'),
+        (HORIZON, 'Older deletions compacted'),
+    )
+
+    recipe_id = models.BigIntegerField(
+        verbose_name='Recipe id',
+        db_index=True)
+    kind = models.CharField(
+        verbose_name='Change',
+        max_length=7,
+        choices=KINDS,
+        default=UPSERT)
+    created_at = models.DateTimeField(auto_now_add=True)
+    position = models.BigIntegerField(
+        verbose_name='Feed position',
+        null=True, unique=True, editable=False,
+        help_text='Set by api.changes.sequence_changes once committed')
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Recipe change'
+        verbose_name_plural = 'Recipe changes'
+
+    def __str__(self):
+        return f'{self.pk} {self.kind} {self.recipe_id}'
+
+
 class IngredientRecipe(models.Model):
     """
     Ingredients for a recipe.
@@ -164,6 +278,69 @@ class ShoppingCart(models.Model):
         return f'{self.recipe}'
 
 
+class CartIngredient(models.Model):
+    """
+    Summed ingredient amounts of a user's shopping cart.
+    Maintained by deltas when recipes enter / leave the cart
+    or cart recipes are edited (api.services.update_cart_totals).
+    Unique constraints on:
+      user, ingredient.
+    """
+    user = models.ForeignKey(
+        User,
+        related_name='cart_ingredients',
+        on_delete=models.CASCADE,
+        verbose_name='User')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='cart_totals',
+        on_delete=models.CASCADE,
+        verbose_name='Ingredient')
+    amount = models.IntegerField(
+        verbose_name='Total amount')
+
+    class Meta:
+        verbose_name = 'Shopping list total'
+        verbose_name_plural = 'Shopping list totals'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_cart_ingredient')]
+
+    def __str__(self):
+        return f'{self.ingredient} {self.amount}'
+
+
+class AuthorStats(models.Model):
+    """
+    Counters of an author for profile pages and ordering users:
+    active recipes, followers, and favorites of the recipes.
+    Kept by deltas and recounted by reconcile_author_stats
+    (posts.stats).
+    """
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+        verbose_name='Author')
+    recipes_count = models.IntegerField(
+        verbose_name='Recipes',
+        default=0, db_index=True)
+    followers_count = models.IntegerField(
+        verbose_name='Followers',
+        default=0, db_index=True)
+    favorites_count = models.IntegerField(
+        verbose_name='Favorites received',
+        default=0, db_index=True)
+
+    class Meta:
+        verbose_name = 'Author stats'
+        verbose_name_plural = 'Author stats'
+
+    def __str__(self):
+        return f'{self.user_id}'
+
+
 class Favorite(models.Model):
     """
     User's favorites list.
@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete,
+                                      post_migrate, post_save, pre_delete)
+from django.dispatch import receiver
+
+from .models import AuthorStats, Favorite, Follow, Recipe, Tag, User
+from .stats import (change_author_stats, change_favorites_received,
+                    refresh_author_stats)
+
+RecipeTag = Recipe.tags.through
+
+
+def update_tag_masks(recipe_ids):
+    """Recompute Recipe.tag_mask of the recipes from their tags."""
+    masks = dict.fromkeys(recipe_ids, 0)
+    if not masks:
+        return masks
+    # Tags without a bit yet are matched by the join (api.filters).
+    for recipe_id, bit in RecipeTag.objects.filter(
+            recipe_id__in=masks, tag__bit__isnull=False).values_list(
+                'recipe_id', 'tag__bit'):
+        masks[recipe_id] |= 1 << bit
+    Recipe.objects.bulk_update(
+        [Recipe(pk=pk, tag_mask=mask) for pk, mask in masks.items()],
+        ['tag_mask'])
+    return masks
+
+
+def assign_tag_bits():
+    """
+    Give a bit to the tags without one (created before the tag masks or
+    loaded raw from fixtures) and recompute the masks of their recipes.
+    """
+    with transaction.atomic():
+        tags = list(Tag.objects.select_for_update().filter(
+            bit=None).order_by('pk'))
+        for tag in tags:
+            tag.bit = Tag.free_bit()
+            Tag.objects.filter(pk=tag.pk).update(bit=tag.bit)
+        update_tag_masks(set(RecipeTag.objects.filter(
+            tag__in=tags).values_list('recipe_id', flat=True)))
+    return tags
+
+
+@receiver(post_migrate)
+def backfill_tag_bits(sender, **kwargs):
+    """The tags and masks of the recipes existing before the masks."""
+    if sender.name == 'posts':
+        assign_tag_bits()
+
+
+@receiver(post_save, sender=Tag)
+def assign_fixture_tag_bit(sender, instance, raw=False, **kwargs):
+    """Fixtures are saved raw, without Tag.save() assigning the bit."""
+    if raw and instance.bit is None:
+        assign_tag_bits()
+        instance.refresh_from_db(fields=['bit'])
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """recipe.tags.set() / add() / remove() / clear() and tag.recipe.*"""
+    if reverse and action == 'pre_clear':
+        instance._cleared_recipe_ids = list(
+            instance.recipe.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.tag_mask = update_tag_masks([instance.pk])[instance.pk]
+    elif action == 'post_clear':
+        update_tag_masks(instance.__dict__.pop('_cleared_recipe_ids', []))
+    else:
+        update_tag_masks(pk_set)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_recipes(sender, instance, **kwargs):
+    instance._deleted_recipe_ids = list(
+        instance.recipe.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def drop_deleted_tag_bit(sender, instance, **kwargs):
+    """The bit can be reused by a new tag, so clear it everywhere."""
+    update_tag_masks(instance.__dict__.pop('_deleted_recipe_ids', []))
+
+
+# Author stats of the rows written through the ORM; the API paths
+# writing with plain SQL change them themselves (posts.stats).
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.deleted_at is None:
+        change_author_stats('recipes_count', {instance.author_id: 1})
+
+
+@receiver(post_delete, sender=Recipe)
+def recount_deleted_recipe_author(sender, instance, **kwargs):
+    # After the commit: the author may be deleted in the same cascade.
+    author_id = instance.author_id
+    transaction.on_commit(lambda: refresh_author_stats([author_id]))
+
+
+@receiver(post_save, sender=Favorite)
+def count_created_favorite(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_favorites_received([instance.recipe_id], 1)
+
+
+@receiver(post_save, sender=Follow)
+def count_created_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_author_stats('followers_count', {instance.author_id: 1})
@@ -0,0 +1,115 @@
+"""
+Maintenance of AuthorStats.
+
+The counters follow the rows the API shows: recipes_count counts the
+active recipes of the author, followers_count the follows by active
+users, favorites_count the favorites by active users of the active
+recipes. Single adds and removes (new recipe, favorite, subscription)
+change them by deltas with an upsert; soft deletions and imports
+recount the authors they touch. Writes the deltas miss (favorites and
+subscriptions deleted outside the API, rows predating the table) are
+fixed by reconcile_author_stats.
+"""
+from django.db import connection
+from django.db.models import Count
+
+from .models import AuthorStats, Favorite, Follow, Recipe, User
+
+COUNTERS = ('recipes_count', 'followers_count', 'favorites_count')
+
+
+def _upsert_sql(column, rows_sql):
+    quote_name = connection.ops.quote_name
+    table = quote_name(AuthorStats._meta.db_table)
+    return (
+        'INSERT INTO {table} (user_id, {columns}) {rows} '
+        'ON CONFLICT (user_id) '
+        'DO UPDATE SET {column} = {table}.{column} + EXCLUDED.{column}'
+    ).format(table=table, rows=rows_sql, column=quote_name(column),
+             columns=', '.join(map(quote_name, COUNTERS)))
+
+
+def change_author_stats(column, deltas):
+    """Add {author id: delta} to a counter, creating missing rows."""
+    deltas = [(pk, delta) for pk, delta in deltas.items() if delta]
+    if not deltas:
+        return
+    values = ', '.join(
+        '(%s, {})'.format(', '.join(
+            '%s' if counter == column else '0' for counter in COUNTERS))
+        for _ in deltas)
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql(column, f'VALUES {values}'),
+                       [value for row in deltas for value in row])
+
+
+def change_favorites_received(recipe_ids, sign):
+    """
+    Count one favorite more (sign=1) or less (sign=-1) for each of the
+    recipes, on their authors. The recipes are the favorites actually
+    inserted / deleted (the RETURNING rows of the write, see
+    api.services.insert_list_entries), not those a SELECT saw before
+    it: a concurrent request may have written them meanwhile.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    quote_name = connection.ops.quote_name
+    counts = ', '.join(
+        '%s * COUNT(*)' if counter == 'favorites_count' else '0'
+        for counter in COUNTERS)
+    rows = (
+        'SELECT author_id, {counts} FROM {recipes} '
+        'WHERE id IN ({ids}) AND deleted_at IS NULL '
+        'GROUP BY author_id'
+    ).format(counts=counts, recipes=quote_name(Recipe._meta.db_table),
+             ids=', '.join(['%s'] * len(recipe_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql('favorites_count', rows),
+                       [sign] + recipe_ids)
+
+
+def count_author_stats(author_ids):
+    """{author id: [recipes, followers, favorites]} counted from the rows."""
+    counts = {pk: [0, 0, 0] for pk in User.objects.filter(
+        pk__in=author_ids).values_list('pk', flat=True)}
+    if not counts:
+        return counts
+    queries = (
+        Recipe.objects.filter(author_id__in=counts).values_list('author_id'),
+        Follow.objects.filter(
+            author_id__in=counts, user__deleted_at=None,
+        ).values_list('author_id'),
+        Favorite.objects.filter(
+            recipe__author_id__in=counts, recipe__deleted_at=None,
+            author__deleted_at=None,
+        ).values_list('recipe__author_id'),
+    )
+    for index, query in enumerate(queries):
+        for author_id, count in query.annotate(
+                count=Count('pk')).order_by():
+            counts[author_id][index] = count
+    return counts
+
+
+def refresh_author_stats(author_ids, check=False):
+    """
+    Recount the stats of the authors. Returns the ids of the authors
+    whose row was missing or wrong; with check, nothing is written.
+    """
+    counts = count_author_stats(author_ids)
+    current = AuthorStats.objects.in_bulk(list(counts))
+    created, updated = [], []
+    for pk, values in counts.items():
+        stats = current.get(pk)
+        if stats is None:
+            created.append(AuthorStats(user_id=pk, **dict(
+                zip(COUNTERS, values))))
+        elif [getattr(stats, counter) for counter in COUNTERS] != values:
+            for counter, value in zip(COUNTERS, values):
+                setattr(stats, counter, value)
+            updated.append(stats)
+    if not check:
+        AuthorStats.objects.bulk_create(created, ignore_conflicts=True)
+        AuthorStats.objects.bulk_update(updated, COUNTERS)
+    return sorted(stats.user_id for stats in created + updated)
@@ -0,0 +1,94 @@
+"""
+Query counts of the admin pages of the large tables: the changelists
+and the recipe change form must issue the same number of queries
+whatever the number of rows (no per-row or per-option queries).
+"""
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from posts.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                          Recipe, ShoppingCart, Tag)
+from users.models import User
+
+CHANGELISTS = ('recipe', 'favorite', 'shoppingcart', 'follow')
+
+
+class AdminQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin', password='pass',
+            first_name='Admin', last_name='Admin')
+        self.client.force_login(self.admin)
+        self.recipe = Recipe.objects.create(
+            author=self.admin, name='Recipe', text='Text', cooking_time=10,
+            image='recipes/images/recipe.png')
+        # At most Tag.MAX_BITS tags: not a growing table.
+        self.recipe.tags.set(
+            Tag.objects.create(name=name, slug=name, color=color)
+            for name, color in (('breakfast', Tag.GREEN),
+                                ('dinner', Tag.ORANGE)))
+        self.users = 0
+
+    @staticmethod
+    def bulk_create(model, objs):
+        """bulk_create, returning the rows with their pks (on SQLite too)."""
+        objs = model.objects.bulk_create(objs)
+        return list(model.objects.order_by('-pk')[:len(objs)])[::-1]
+
+    def add_rows(self, count):
+        """
+        Add count users, each with a recipe and an ingredient of the
+        edited recipe, following and adding to lists the next user's
+        recipe.
+        """
+        start, self.users = self.users, self.users + count
+        users = self.bulk_create(User, (
+            User(email=f'user{index}@example.com', username=f'user{index}',
+                 first_name='User', last_name='User')
+            for index in range(start, self.users)))
+        recipes = self.bulk_create(Recipe, (
+            Recipe(author=user, name=f'Recipe {user.username}', text='Text',
+                   cooking_time=10, image='recipes/images/recipe.png')
+            for user in users))
+        ingredients = self.bulk_create(Ingredient, (
+            Ingredient(name=f'Ingredient {index}', measurement_unit='г')
+            for index in range(start, self.users)))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=self.recipe, ingredient=ingredient,
+                             amount=100)
+            for ingredient in ingredients)
+        pairs = list(zip(users, recipes[1:] + [self.recipe]))
+        Favorite.objects.bulk_create(
+            Favorite(author=user, recipe=recipe) for user, recipe in pairs)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(author=user, recipe=recipe)
+            for user, recipe in pairs)
+        Follow.objects.bulk_create(
+            Follow(user=user, author=recipe.author)
+            for user, recipe in pairs)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def assert_constant_queries(self, url):
+        """The query count of url with few rows holds with thousands."""
+        self.add_rows(10)
+        self.get(url)  # Fills the process caches (content types).
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        for count in (1000, 2000):
+            self.add_rows(count)
+            with self.assertNumQueries(len(queries)):
+                self.get(url)
+
+    def test_changelists(self):
+        for model in CHANGELISTS:
+            with self.subTest(model=model):
+                self.assert_constant_queries(f'/admin/posts/{model}/')
+
+    def test_recipe_change_form(self):
+        self.assert_constant_queries(
+            f'/admin/posts/recipe/{self.recipe.pk}/change/')
@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from posts.admin import LargeTableAdmin
+from .models import Task
+
+
+class TaskAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts',
+                    'run_at', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('^name',)
+    readonly_fields = ('created_at', 'started_at', 'finished_at',
+                       'last_error')
+
+
+admin.site.register(Task, TaskAdmin)
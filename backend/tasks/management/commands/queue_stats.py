@@ -0,0 +1,12 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tasks.queue import queue_stats
+
+
+class Command(BaseCommand):
+    help = 'Print task queue depth and latency metrics as JSON.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(queue_stats(), indent=2))
@@ -0,0 +1,100 @@
+import logging
+import multiprocessing
+import signal
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections
+
+from tasks.queue import purge_finished, requeue_stale, run_batch
+
+logger = logging.getLogger(__name__)
+
+
+def worker_loop(batch_size, poll_interval):
+    # Ctrl-C reaches the whole process group, only the parent handles
+    # it. SIGTERM from the parent stops the worker after its batch.
+    # Not a shared Event: a worker killed while waiting on it could
+    # leave its lock held and the parent blocked in set().
+    terminated = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: terminated.append(True))
+    while not terminated:
+        close_old_connections()
+        try:
+            ran = run_batch(batch_size)
+        except DatabaseError:
+            logger.exception('Could not claim tasks')
+            ran = 0
+        if not ran:
+            time.sleep(poll_interval)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run background task workers in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--batch', type=int, default=10,
+                            help='Tasks claimed per query.')
+        parser.add_argument('--poll-interval', type=float, default=1,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--keep-done-hours', type=float, default=24,
+                            help='Finished tasks are kept this long.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run due tasks in this process and exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ran = 0
+            while True:
+                batch = run_batch(options['batch'])
+                if not batch:
+                    break
+                ran += batch
+            self.stdout.write(f'Ran {ran} tasks.')
+            return
+
+        def start_worker():
+            # Forked workers must not share the parent's connection.
+            connections.close_all()
+            worker = multiprocessing.Process(
+                target=worker_loop,
+                args=(options['batch'], options['poll_interval']),
+                daemon=True)
+            worker.start()
+            return worker
+
+        workers = [start_worker() for _ in range(options['processes'])]
+        terminated = []
+        signal.signal(signal.SIGTERM, lambda *args: terminated.append(True))
+        self.stdout.write(f'Started {len(workers)} workers.')
+        keep_done = timedelta(hours=options['keep_done_hours'])
+        next_maintenance = 0
+        try:
+            while not terminated:
+                for index, worker in enumerate(workers):
+                    if not worker.is_alive():
+                        # Killed running a task, e.g. out of memory.
+                        logger.error('Worker %s exited with code %s, '
+                                     'restarting it', worker.pid,
+                                     worker.exitcode)
+                        workers[index] = start_worker()
+                if time.monotonic() >= next_maintenance:
+                    requeued, failed = requeue_stale()
+                    if failed:
+                        logger.error('%s stale tasks failed after their '
+                                     'last attempt', failed)
+                    purge_finished(keep_done)
+                    close_old_connections()
+                    next_maintenance = time.monotonic() + 60
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        self.stdout.write('Workers stopped.')
@@ -0,0 +1,69 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """
+    Background task stored in the database.
+    Workers claim queued tasks with SELECT ... FOR UPDATE SKIP LOCKED,
+    higher priority first.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    name = models.CharField(
+        verbose_name='Task function',
+        max_length=255)
+    args = models.JSONField(
+        verbose_name='Arguments',
+        default=list)
+    kwargs = models.JSONField(
+        verbose_name='Keyword arguments',
+        default=dict)
+    status = models.CharField(
+        verbose_name='Status',
+        max_length=10,
+        choices=STATUS,
+        default=QUEUED)
+    priority = models.SmallIntegerField(
+        verbose_name='Priority',
+        default=0)
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Attempts',
+        default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Max attempts',
+        default=5)
+    run_at = models.DateTimeField(
+        verbose_name='Run not before',
+        default=timezone.now)
+    created_at = models.DateTimeField(
+        verbose_name='Enqueued at',
+        auto_now_add=True)
+    started_at = models.DateTimeField(
+        verbose_name='Started at',
+        null=True, blank=True)
+    finished_at = models.DateTimeField(
+        verbose_name='Finished at',
+        null=True, blank=True)
+    last_error = models.TextField(
+        verbose_name='Last error',
+        blank=True)
+
+    class Meta:
+        verbose_name = 'Task'
+        verbose_name_plural = 'Tasks'
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at'],
+                         name='task_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} [{self.status}]'
@@ -0,0 +1,181 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+TASK_QUEUE_SETTINGS = {
+    'BACKOFF_BASE': 5,
+    'BACKOFF_MAX': 3600,
+    'STALE_AFTER': 600,
+}
+TASK_QUEUE_SETTINGS.update(getattr(settings, 'TASK_QUEUE', {}))
+
+REGISTRY = {}
+
+
+def task(priority=0, max_attempts=5):
+    """
+    Register a function as a background task:
+
+        @task(priority=10)
+        def rebuild_cart(user_id):
+            ...
+
+        rebuild_cart.enqueue(user.pk)
+
+    Arguments must be JSON serializable.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        REGISTRY[name] = func
+
+        @wraps(func)
+        def enqueue_task(*args, **kwargs):
+            return enqueue(name, args, kwargs, priority=priority,
+                           max_attempts=max_attempts)
+
+        func.task_name = name
+        func.enqueue = enqueue_task
+        return func
+    return decorator
+
+
+def enqueue(name, args=(), kwargs=None, priority=0, max_attempts=5,
+            delay=None):
+    """
+    Store a task. Inside a transaction it becomes visible to workers
+    only when the transaction commits.
+    """
+    run_at = timezone.now()
+    if delay:
+        run_at += timedelta(seconds=delay)
+    return Task.objects.create(
+        name=name, args=list(args), kwargs=kwargs or {},
+        priority=priority, max_attempts=max_attempts, run_at=run_at)
+
+
+def get_task_function(name):
+    if name not in REGISTRY:
+        # Importing the module registers its tasks.
+        import_string(name)
+    return REGISTRY[name]
+
+
+def claim(batch_size=1):
+    """Lock and mark as running the next queued tasks."""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(Task.objects.select_for_update(skip_locked=True).filter(
+            status=Task.QUEUED, run_at__lte=now
+        ).order_by('-priority', 'run_at')[:batch_size])
+        if jobs:
+            Task.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=Task.RUNNING, started_at=now,
+                attempts=F('attempts') + 1)
+    for job in jobs:
+        job.status = Task.RUNNING
+        job.started_at = now
+        job.attempts += 1
+    return jobs
+
+
+def backoff(attempts):
+    """Exponential backoff with jitter, in seconds."""
+    delay = min(TASK_QUEUE_SETTINGS['BACKOFF_BASE'] * 2 ** (attempts - 1),
+                TASK_QUEUE_SETTINGS['BACKOFF_MAX'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+def execute(job):
+    """Run a claimed task and record the result."""
+    try:
+        get_task_function(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Task %s (%s) failed', job.pk, job.name)
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Task.QUEUED
+            job.run_at = timezone.now() + timedelta(
+                seconds=backoff(job.attempts))
+        else:
+            job.status = Task.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Task.DONE
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'run_at', 'finished_at',
+                            'last_error'])
+
+
+def run_batch(batch_size=1):
+    """Claim and execute up to batch_size tasks. Returns how many ran."""
+    jobs = claim(batch_size)
+    for job in jobs:
+        execute(job)
+    return len(jobs)
+
+
+def requeue_stale():
+    """
+    Give back tasks of workers which died while running them. A task
+    which has used up its attempts fails instead, as it may be what
+    kills the workers. Returns the (requeued, failed) counts.
+    """
+    now = timezone.now()
+    stale = Task.objects.filter(
+        status=Task.RUNNING, started_at__lt=now - timedelta(
+            seconds=TASK_QUEUE_SETTINGS['STALE_AFTER']))
+    with transaction.atomic():
+        failed = stale.filter(attempts__gte=F('max_attempts')).update(
+            status=Task.FAILED, finished_at=now,
+            last_error='The worker died or the task ran longer than '
+                       'STALE_AFTER on every attempt.')
+        requeued = stale.update(status=Task.QUEUED, run_at=now)
+    return requeued, failed
+
+
+def purge_finished(older_than):
+    deadline = timezone.now() - older_than
+    return Task.objects.filter(
+        status=Task.DONE, finished_at__lt=deadline).delete()[0]
+
+
+def queue_stats(window=timedelta(minutes=15)):
+    """
+    Queue depth and latency metrics:
+    tasks per status, age of the oldest due task, average wait
+    (enqueue -> start) and run time of tasks finished within window.
+    """
+    now = timezone.now()
+    depth = dict(Task.objects.values_list('status').annotate(Count('pk')))
+    oldest = Task.objects.filter(
+        status=Task.QUEUED, run_at__lte=now
+    ).aggregate(oldest=Min('run_at'))['oldest']
+    finished = Task.objects.filter(
+        status=Task.DONE, finished_at__gte=now - window
+    ).aggregate(
+        wait=Avg(F('started_at') - F('created_at')),
+        run=Avg(F('finished_at') - F('started_at')),
+        count=Count('pk'))
+    return {
+        'depth': {status: depth.get(status, 0)
+                  for status, _ in Task.STATUS},
+        'oldest_due_seconds': (
+            (now - oldest).total_seconds() if oldest else 0),
+        'finished_in_window': finished['count'],
+        'avg_wait_seconds': (
+            finished['wait'].total_seconds() if finished['wait'] else 0),
+        'avg_run_seconds': (
+            finished['run'].total_seconds() if finished['run'] else 0),
+    }
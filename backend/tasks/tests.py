@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from tasks.models import Task
+from tasks.queue import (TASK_QUEUE_SETTINGS, claim, requeue_stale,
+                         run_batch, task)
+
+CALLS = []
+
+
+@task(max_attempts=2)
+def record_call(value):
+    CALLS.append(value)
+
+
+@task(max_attempts=2)
+def fail():
+    raise ValueError('Task failed')
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        CALLS.clear()
+
+    def make_due(self):
+        Task.objects.update(run_at=timezone.now())
+
+    def make_stale(self):
+        Task.objects.filter(status=Task.RUNNING).update(
+            started_at=timezone.now() - timedelta(
+                seconds=TASK_QUEUE_SETTINGS['STALE_AFTER'] + 1))
+
+    def test_run(self):
+        record_call.enqueue(1)
+        self.assertEqual(run_batch(10), 1)
+        self.assertEqual(CALLS, [1])
+        job = Task.objects.get()
+        self.assertEqual((job.status, job.attempts), (Task.DONE, 1))
+
+    def test_retry_until_max_attempts(self):
+        fail.enqueue()
+        run_batch()
+        job = Task.objects.get()
+        self.assertEqual((job.status, job.attempts), (Task.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(run_batch(), 0)
+        self.make_due()
+        run_batch()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.FAILED, 2))
+        self.assertIn('Task failed', job.last_error)
+
+    def test_requeue_stale(self):
+        """A task killing its worker is retried, then fails."""
+        record_call.enqueue(1)
+        claim()
+        self.assertEqual(requeue_stale(), (0, 0))
+        self.make_stale()
+        self.assertEqual(requeue_stale(), (1, 0))
+        job = Task.objects.get()
+        self.assertEqual((job.status, job.attempts), (Task.QUEUED, 1))
+        claim()
+        self.make_stale()
+        self.assertEqual(requeue_stale(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(run_batch(), 0)
+        self.assertEqual(CALLS, [])
@@ -1,16 +1,23 @@
 from django.contrib import admin
+
+from api.deletion import soft_delete_user
+from posts.admin import SoftDeleteAdmin
 from .models import User
 
 
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(SoftDeleteAdmin):
     """
     Admin-zone user
     """
     list_display = ('id', 'username', 'first_name',
                     'last_name', 'email', 'role', 'admin')
-    search_fields = ('username', 'email')
-    list_filter = ('username', 'email',)
+    search_fields = ('^username', '^email')
+    list_filter = ('role', 'is_active')
     empty_value_display = '-empty-'
 
+    def soft_delete(self, objs):
+        for user in objs:
+            soft_delete_user(user)
+
 
-admin.site.register(User, UserAdmin)
\ No newline at end of file
+admin.site.register(User, UserAdmin)
@@ -1,6 +1,14 @@
-from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.contrib.auth.models import (AbstractUser, Group, Permission,
+                                        UserManager)
 from django.db import models
 
+
+class ActiveUserManager(UserManager):
+    """Default manager leaving out soft-deleted users (api.deletion)."""
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
+
+
 class User(AbstractUser):
     """
     Customized user model.
@@ -23,6 +31,10 @@ class User(AbstractUser):
         verbose_name='User role'
     )
     password = models.CharField(max_length=150, verbose_name='Password')
+    deleted_at = models.DateTimeField(
+        verbose_name='Deleted at',
+        null=True, blank=True, db_index=True, editable=False,
+        help_text='Hidden until purged by api.deletion')
 
     groups = models.ManyToManyField(
         Group,
@@ -41,6 +53,9 @@ class User(AbstractUser):
         related_query_name='custom_user',
     )
 
+    objects = ActiveUserManager()
+    all_objects = UserManager()
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'password', 'first_name', 'last_name']
 
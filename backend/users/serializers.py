@@ -1,13 +1,13 @@
 from rest_framework import serializers
-from rest_framework import status
-from rest_framework.exceptions import ValidationError
+from rest_framework.validators import UniqueValidator
 
+from api.fast_serializers import CompiledSerializerMixin
 from posts.models import Follow, Recipe
 from users.models import User
-import api.serializers
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(CompiledSerializerMixin,
+                     serializers.ModelSerializer):
     """
     Serializer User
     """
@@ -17,10 +17,22 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'password', 'is_subscribed')
-        extra_kwargs = {'password': {'write_only': True},
-                        'is_subscribed': {'read_only': True}}
+        # Soft-deleted users keep their email and username until purged,
+        # so uniqueness is checked against all users, not User.objects.
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'is_subscribed': {'read_only': True},
+            'email': {'validators': [UniqueValidator(
+                queryset=User.all_objects.all(),
+                message='A user with that email already exists.')]},
+            'username': {'validators': [UniqueValidator(
+                queryset=User.all_objects.all(),
+                message='A user with that username already exists.')]},
+        }
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if not user.is_anonymous:
             return Follow.objects.filter(user=user, author=obj).exists()
@@ -30,6 +42,24 @@ class UserSerializer(serializers.ModelSerializer):
         return User.objects.create_user(**validated_data)
 
 
+class AuthorSerializer(UserSerializer):
+    """
+    User with the author stats, for the user endpoints (the recipe
+    author stays a UserSerializer, so recipe documents do not change
+    with the counters).
+    """
+    recipes_count = serializers.IntegerField(
+        source='stats.recipes_count', read_only=True, default=0)
+    followers_count = serializers.IntegerField(
+        source='stats.followers_count', read_only=True, default=0)
+    favorites_count = serializers.IntegerField(
+        source='stats.favorites_count', read_only=True, default=0)
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + (
+            'recipes_count', 'followers_count', 'favorites_count')
+
+
 class FollowSerializer(serializers.ModelSerializer):
     """Serializer  Follow."""
     email = serializers.ReadOnlyField(source='author.email')
@@ -57,25 +87,15 @@ class FollowSerializer(serializers.ModelSerializer):
     def get_recipes(self, obj):
         request = self.context.get('request')
         limit = request.GET.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=obj.author)
+        recipes = Recipe.objects.filter(author=obj.author).published()
         if limit and limit.isdigit():
             recipes = recipes[:int(limit)]
-        return api.serializers.RecipeMiniSerializer(recipes, many=True).data
+        # api.serializers imports this module for UserSerializer.
+        from api.serializers import RecipeMiniSerializer
+        return RecipeMiniSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
+        stats = getattr(obj.author, 'stats', None)
+        if stats is not None:
+            return stats.recipes_count
         return Recipe.objects.filter(author=obj.author).count()
-
-    def validate(self, data):
-        author = self.context.get('author')
-        user = self.context.get('request').user
-        if Follow.objects.filter(
-                author=author,
-                user=user).exists():
-            raise ValidationError(
-                detail='You already are followed',
-                code=status.HTTP_400_BAD_REQUEST)
-        if user == author:
-            raise ValidationError(
-                detail='You cannot be followed by yourself',
-                code=status.HTTP_400_BAD_REQUEST)
-        return data
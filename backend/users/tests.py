@@ -0,0 +1,38 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.deletion import soft_delete_user
+from users.models import User
+
+
+class RegistrationTests(TestCase):
+
+    def setUp(self):
+        self.deleted = User.objects.create_user(
+            email='deleted@example.com', username='deleted',
+            password='pass', first_name='Deleted', last_name='User')
+        soft_delete_user(self.deleted)
+        self.data = {
+            'email': 'new@example.com', 'username': 'new',
+            'password': 'Xq7-registration', 'first_name': 'New',
+            'last_name': 'User'}
+
+    def test_email_of_soft_deleted_user(self):
+        """Taken until the user is purged: 400, not an IntegrityError."""
+        response = APIClient().post(
+            '/api/users/', {**self.data, 'email': 'deleted@example.com'},
+            format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+
+    def test_username_of_soft_deleted_user(self):
+        response = APIClient().post(
+            '/api/users/', {**self.data, 'username': 'deleted'},
+            format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('username', response.json())
+
+    def test_register(self):
+        response = APIClient().post('/api/users/', self.data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.filter(email='new@example.com').exists())
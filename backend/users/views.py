@@ -5,28 +5,52 @@ from rest_framework.decorators import action
 from djoser.serializers import SetPasswordSerializer
 from rest_framework.permissions import IsAuthenticated
 from api.paginations import ApiPagination
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 from posts.models import Follow
+from posts.stats import change_author_stats
 from users.models import User
-from users.serializers import FollowSerializer, UserSerializer
+from users.serializers import AuthorSerializer, FollowSerializer
+from api import bus
+from api.deletion import purge_deleted_task, soft_delete_user
+from api.idempotency import IdempotencyMixin
+from api.profiling import ProfiledViewMixin
+from api.throttling import LoadSheddingMixin
+from api.filters import AuthorStatsOrderingFilter
 from api.permissions import IsCurrentUserOrAdminOrReadOnly
+from api.services import annotate_is_subscribed, create_if_absent
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ProfiledViewMixin, LoadSheddingMixin, IdempotencyMixin,
+                  viewsets.ModelViewSet):
     """Viewset for user and subscriptions."""
     queryset = User.objects.all()
+    # Ids only: a non-numeric id is a 404, not a 500 of the lookups.
+    lookup_value_regex = r'\d+'
+    idempotent_actions = ('subscribe',)
     permission_classes = (IsCurrentUserOrAdminOrReadOnly, )
     pagination_class = ApiPagination
-    serializer_class = UserSerializer
+    serializer_class = AuthorSerializer
+    filter_backends = (AuthorStatsOrderingFilter, )
+
+    def get_queryset(self):
+        return annotate_is_subscribed(
+            super().get_queryset().select_related('stats'),
+            self.request.user)
+
+    def perform_destroy(self, instance):
+        """Soft delete, the rows are purged in the background."""
+        soft_delete_user(instance)
+        purge_deleted_task.enqueue()
 
     @action(detail=False,
             methods=['get'],
             permission_classes=[IsAuthenticated])
     def me(self, request):
         """Custom endpoint to retrieve the current user's profile."""
-        user = self.request.user
-        serializer = UserSerializer(user, context={'request': request})
+        user = self.get_queryset().get(pk=request.user.pk)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
 
     @action(["post"],
@@ -51,32 +75,53 @@ class UserViewSet(viewsets.ModelViewSet):
             methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, *args, **kwargs):
-        """Create and delete a subscription."""
-        author = get_object_or_404(User, id=self.kwargs.get('pk'))
+        """
+        Create and delete a subscription.
+        Relies on the unique constraint of Follow, so each action
+        issues a single write query.
+        """
         user = self.request.user
         if request.method == 'POST':
+            author = get_object_or_404(User, id=self.kwargs.get('pk'))
+            if user == author:
+                return Response(
+                    {'errors': 'You cannot be followed by yourself'},
+                    status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                created = create_if_absent(Follow, user_id=user.pk,
+                                           author_id=author.pk)
+                if created:
+                    change_author_stats('followers_count', {author.pk: 1})
+            if not created:
+                return Response({'errors': 'You already are followed'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            bus.publish(Follow._meta.label_lower, [user.pk])
             serializer = FollowSerializer(
-                data=request.data,
-                context={'request': request, 'author': author})
-            if serializer.is_valid(raise_exception=True):
-                serializer.save(author=author, user=user)
-                return Response({'Subscription successfully created': serializer.data},
-                                status=status.HTTP_201_CREATED)
+                Follow(user=user, author=author),
+                context={'request': request})
+            return Response({'Subscription successfully created': serializer.data},
+                            status=status.HTTP_201_CREATED)
+        author_id = self.kwargs.get('pk')
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                author_id=author_id, user=user).delete()
+            if deleted:
+                change_author_stats('followers_count', {int(author_id): -1})
+        if not deleted:
             return Response({'errors': 'Object not found'},
                             status=status.HTTP_404_NOT_FOUND)
-        if Follow.objects.filter(author=author, user=user).exists():
-            Follow.objects.get(author=author, user=user).delete()
-            return Response('Successfully unsubscribed',
-                            status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Object not found'},
-                        status=status.HTTP_404_NOT_FOUND)
+        bus.publish(Follow._meta.label_lower, [user.pk])
+        return Response('Successfully unsubscribed',
+                        status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         """Displays all subscriptions of the current user."""
-        follows = Follow.objects.filter(user=self.request.user)
+        follows = Follow.objects.filter(
+            user=self.request.user, author__deleted_at=None,
+        ).select_related('author__stats')
         pages = self.paginate_queryset(follows)
         serializer = FollowSerializer(pages,
                                       many=True,